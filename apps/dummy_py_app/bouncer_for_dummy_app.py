@@ -31,15 +31,38 @@ sys.path.append(os.path.join(dirname, '..', '..', 'bouncer'))
 
 import bouncer_process_manager
 from bouncer_process_manager import BouncerProcessManager
+from bouncer_common import BouncerAddress, UNIX_ADDR, format_worker
+import zygote
 
 DUMMY_FASTCGI_APP_PATH = os.path.join(dirname, 'fcgi_worker_process.py')
 
 class BouncerForDummyFcgi(BouncerProcessManager):
 
+    def __init__(self, config, addr, port, logger):
+        # In zygote mode, fcgi_worker_process.py is imported once by the zygote,
+        # and every worker is forked from it (see bouncer/zygote.py)
+        self.zygote = None
+        options = config.bouncer_options.get(str(BouncerAddress(addr, port)), {})
+        if options.get("zygote", False):
+            logger.info("Launching zygote for %s", DUMMY_FASTCGI_APP_PATH)
+            self.zygote = zygote.Zygote.launch(["--module", DUMMY_FASTCGI_APP_PATH])
+        super(BouncerForDummyFcgi, self).__init__(config, addr, port, logger)
+
     def start_worker(self, addr, port):
         '''Must attempt to launch the specified worker. Should return the popen object for the new worker
            or None, if the worker couldn't be be launched for some reason.'''
-        return subprocess.Popen([DUMMY_FASTCGI_APP_PATH, str(port)])
+        if self.zygote != None:
+            try:
+                return self.zygote.spawn(addr if addr == UNIX_ADDR else "127.0.0.1", port)
+            except zygote.ZygoteError, e:
+                self.logger.error("Could not spawn worker from zygote: %s", e)
+                return None
+        if addr == UNIX_ADDR:
+            listen = format_worker(addr, port)
+        else:
+            listen = str(port)
+        return subprocess.Popen([DUMMY_FASTCGI_APP_PATH, listen],
+            preexec_fn=self.worker_preexec(addr, port))
 
     def kill_worker(self, addr, port, popen_obj):
         '''Must attempt to kill the specified worker. Does not return anything'''
@@ -48,7 +71,7 @@ class BouncerForDummyFcgi(BouncerProcessManager):
         try:
             popen_obj.terminate()
         except OSError, e:
-            print "Error while trying to kill '%s:%d': %s" % (addr, port, e)
+            print "Error while trying to kill '%s': %s" % (format_worker(addr, port), e)
 
 
 bouncer_process_manager.main(BouncerForDummyFcgi)
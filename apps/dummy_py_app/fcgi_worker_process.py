@@ -20,6 +20,9 @@
 #
 # Spawn: ./fcgi_worker_process.py [port_num]
 #   where port_num is the port number the worker should listen on
+# Or:    ./fcgi_worker_process.py unix:/path/to/sock
+#   to listen on a Unix domain socket instead
+# Or import this module and call serve(addr, port)
 #
 # Three forms of web access:
 #   (1) no parameters, i.e.:
@@ -80,4 +83,19 @@ def app(environ, start_response):
         print e
         raise
 
-WSGIServer(app, bindAddress=("127.0.0.1", int(sys.argv[1])), maxSpare=1, maxChildren=1).run()
+def serve(addr, port):
+    '''Serves app on addr:port; returns when the server shuts down. If addr is
+    "unix", then port is the path of the Unix socket to listen on.
+    The bouncer's zygote mode (see ../../bouncer/zygote.py) imports this module
+    once and calls serve in each forked worker.'''
+    if addr == "unix":
+        bindAddress = port
+    else:
+        bindAddress = (addr, port)
+    WSGIServer(app, bindAddress=bindAddress, maxSpare=1, maxChildren=1).run()
+
+if __name__ == "__main__":
+    if sys.argv[1].startswith("unix:"):
+        serve("unix", sys.argv[1][len("unix:"):])
+    else:
+        serve("127.0.0.1", int(sys.argv[1]))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== socket_latency_benchmark.py ====
+#
+# Compares the request latency of a dummy-app worker listening on loopback TCP
+# with one listening on a Unix domain socket (see "unix:/path/to/sock" workers
+# in ../../bouncer/bouncer_common.py).
+#
+# For each transport it starts one fcgi_worker_process.py, waits until it
+# answers a FastCGI probe, and then sends REQUESTS sequential FastCGI GET
+# requests (each on a new connection, like nginx without keepalive). It
+# reports the latency distribution of connect + request + response as JSON.
+# The --burn option makes each request do some work, to show how the
+# transport's share of the latency shrinks as requests get more expensive.
+#
+# Does not need nginx or a bouncer; runs entirely on localhost.
+# Requires flup (see ../../dependencies/download.sh).
+#
+# USAGE: ./socket_latency_benchmark.py [--requests 2000] [--port 9600] [--burn 0]
+#
+
+import sys
+import os
+import argparse
+import json
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(DIRNAME, '..', '..', 'bouncer'))
+sys.path.append(os.path.join(DIRNAME, '..', '..', 'common'))
+
+import worker_probe
+from bouncer_common import UNIX_ADDR, format_worker
+
+DUMMY_FASTCGI_APP_PATH = os.path.join(DIRNAME, 'fcgi_worker_process.py')
+
+READY_TIMEOUT = 30.0
+READY_INTERVAL = 0.005
+REQUEST_TIMEOUT = 10.0
+
+def summarize(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return {}
+    return {
+        "num" : len(values),
+        "min" : values[0],
+        "median" : values[len(values) / 2],
+        "p90" : values[min(len(values) - 1, int(len(values) * 0.9))],
+        "p99" : values[min(len(values) - 1, int(len(values) * 0.99))],
+        "max" : values[-1],
+        "mean" : sum(values) / len(values),
+    }
+
+def benchmark(addr, port, requests, query):
+    '''Starts a worker on addr:port (addr may be UNIX_ADDR) and returns a dict of
+    results'''
+    if addr == UNIX_ADDR:
+        listen = format_worker(addr, port)
+    else:
+        listen = str(port)
+    worker = subprocess.Popen([sys.executable, DUMMY_FASTCGI_APP_PATH, listen])
+    try:
+        if worker_probe.wait_until_ready("fcgi", addr, port, worker, READY_TIMEOUT,
+                READY_INTERVAL) == None:
+            raise RuntimeError("worker %s did not become ready" % format_worker(addr, port))
+
+        # warm up (imports, flup's child process)
+        for i in range(10):
+            worker_probe.fcgi_get(addr, port, REQUEST_TIMEOUT, query=query)
+
+        latency = []
+        errors = 0
+        for i in xrange(requests):
+            start = time.time()
+            try:
+                worker_probe.fcgi_get(addr, port, REQUEST_TIMEOUT, query=query)
+                latency.append(time.time() - start)
+            except (socket.error, socket.timeout):
+                errors += 1
+    finally:
+        worker.terminate()
+        worker.wait()
+
+    results = summarize(latency)
+    results["errors"] = errors
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares loopback TCP and Unix socket request latency for the dummy app')
+    parser.add_argument("-r", "--requests", type=int, default=2000,
+                        help="Default=%(default)d. Number of requests per transport")
+    parser.add_argument("-p", "--port", type=int, default=9600,
+                        help="Default=%(default)d. Port for the TCP worker")
+    parser.add_argument("-b", "--burn", type=int, default=0,
+                        help="Default=%(default)d. burn parameter of each request (0 = trivial requests)")
+    args = parser.parse_args()
+
+    query = "burn=%d" % args.burn if args.burn > 0 else ""
+    socket_dir = tempfile.mkdtemp()
+    try:
+        results = {
+            "requests" : args.requests,
+            "burn" : args.burn,
+            "tcp" : benchmark("127.0.0.1", args.port, args.requests, query),
+            "unix" : benchmark(UNIX_ADDR, os.path.join(socket_dir, "worker.sock"), args.requests, query),
+        }
+    finally:
+        shutil.rmtree(socket_dir)
+
+    if results["tcp"].get("median") and results["unix"].get("median"):
+        results["unix_median_speedup"] = results["tcp"]["median"] / results["unix"]["median"]
+
+    print json.dumps(results, indent=4, sort_keys=True)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== zygote_benchmark.py ====
+#
+# Compares the two ways a bouncer can (re)start dummy-app workers:
+#   exec   -- a fresh interpreter per worker (python fcgi_worker_process.py PORT)
+#   zygote -- a fork of a preloaded zygote (see ../../bouncer/zygote.py)
+#
+# For each mode it reports:
+#   - restart latency: time from killing a worker until its replacement answers
+#     a FastCGI FCGI_GET_VALUES probe
+#   - memory: total RSS and PSS of WORKERS concurrently running workers
+#     (including flup's forked children). PSS accounts for copy-on-write
+#     sharing, so it shows the memory the zygote saves; RSS does not.
+#
+# Does not need nginx or a bouncer; runs entirely on localhost.
+# Requires flup (see ../../dependencies/download.sh).
+#
+# USAGE: ./zygote_benchmark.py [--workers 4] [--restarts 20] [--base-port 9500]
+#
+
+import sys
+import os
+import argparse
+import json
+import subprocess
+import time
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(DIRNAME, '..', '..', 'bouncer'))
+sys.path.append(os.path.join(DIRNAME, '..', '..', 'common'))
+
+import procinfo
+import worker_probe
+import zygote
+
+DUMMY_FASTCGI_APP_PATH = os.path.join(DIRNAME, 'fcgi_worker_process.py')
+
+READY_TIMEOUT = 30.0
+READY_INTERVAL = 0.005
+
+def summarize(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return {}
+    return {
+        "num" : len(values),
+        "min" : values[0],
+        "median" : values[len(values) / 2],
+        "p90" : values[min(len(values) - 1, int(len(values) * 0.9))],
+        "max" : values[-1],
+        "mean" : sum(values) / len(values),
+    }
+
+def wait_ready(port, popen_obj):
+    elapsed = worker_probe.wait_until_ready("fcgi", "127.0.0.1", port, popen_obj,
+        READY_TIMEOUT, READY_INTERVAL)
+    if elapsed == None:
+        raise RuntimeError("worker on port %d did not become ready" % port)
+    return elapsed
+
+def benchmark(start_func, ports, restarts):
+    '''start_func(port) must return a popen-like object for a new worker on port.
+    Returns a dict of results'''
+    workers = {}
+    start_latency = []
+    for port in ports:
+        start = time.time()
+        workers[port] = start_func(port)
+        wait_ready(port, workers[port])
+        start_latency.append(time.time() - start)
+
+    rss = sum([procinfo.rss_tree_kb(w.pid) for w in workers.values()])
+    pss = sum([procinfo.pss_tree_kb(w.pid) for w in workers.values()])
+
+    restart_latency = []
+    for i in xrange(restarts):
+        port = ports[i % len(ports)]
+        start = time.time()
+        workers[port].terminate()
+        workers[port].wait()
+        workers[port] = start_func(port)
+        wait_ready(port, workers[port])
+        restart_latency.append(time.time() - start)
+
+    for worker in workers.values():
+        worker.terminate()
+        worker.wait()
+
+    return {
+        "start_latency" : summarize(start_latency),
+        "restart_latency" : summarize(restart_latency),
+        "rss_kb" : rss,
+        "pss_kb" : pss,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares exec and zygote worker startup for the dummy app')
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="Default=%(default)d. Number of workers to run concurrently")
+    parser.add_argument("-r", "--restarts", type=int, default=20,
+                        help="Default=%(default)d. Number of kill/restart cycles per mode")
+    parser.add_argument("-p", "--base-port", type=int, default=9500,
+                        help="Default=%(default)d. Workers listen on BASE_PORT, BASE_PORT + 1, ...")
+    args = parser.parse_args()
+
+    ports = range(args.base_port, args.base_port + args.workers)
+    results = {}
+
+    def exec_worker(port):
+        return subprocess.Popen([sys.executable, DUMMY_FASTCGI_APP_PATH, str(port)])
+    results["exec"] = benchmark(exec_worker, ports, args.restarts)
+
+    start = time.time()
+    z = zygote.Zygote.launch(["--module", DUMMY_FASTCGI_APP_PATH])
+    zygote_launch = time.time() - start
+    try:
+        results["zygote"] = benchmark(lambda port: z.spawn("127.0.0.1", port), ports, args.restarts)
+        results["zygote"]["zygote_launch"] = zygote_launch
+        results["zygote"]["zygote_rss_kb"] = procinfo.rss_kb(z.popen_obj.pid)
+        results["zygote"]["zygote_pss_kb"] = procinfo.pss_kb(z.popen_obj.pid)
+    finally:
+        z.close()
+
+    print json.dumps(results, indent=4, sort_keys=True)
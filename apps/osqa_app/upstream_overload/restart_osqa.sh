@@ -35,6 +35,6 @@ mount -t tmpfs none $NGINX_RAMDISK_DIR -o size=256M
 sleep 1
 $DIR/launch_osqa.sh
 
-sleep 10
+$DIR/../../../bouncer/wait_ready.py --config $DIR/bouncer_config.json --timeout 120
 $DIR/../../../nginx_upstream_overload/launch_nginx.sh
 
@@ -36,6 +36,6 @@ $DIR/run_bouncer.sh &
 $DIR/run_alert_router.sh &
 $DIR/run_sigservice.sh &
 
-echo "wait a minute..."
+echo "waiting for the redmine workers to become ready..."
 # it takes a long time for redmine to restart
-sleep 60
+$DIR/../../../bouncer/wait_ready.py --config $DIR/bouncer_config.json --timeout 300
@@ -22,6 +22,64 @@
  *
  */
 
+/**
+ * A fixed-bucket histogram (see worker_stats.py). counts[i] is the number of
+ * values v with bounds[i - 1] < v <= bounds[i]; the last element of counts
+ * holds the values larger than every bound. total is the sum of all values.
+ */
+struct Histogram {
+    1: list<double> bounds,
+    2: list<i64> counts,
+    3: double total
+}
+
+/**
+ * The state of one FastCGI worker, as seen by its Bouncer.
+ *
+ * A worker is "ready" once it passes the bouncer's readiness probe
+ * (see worker_probe.py); until then it does not count as available.
+ */
+struct WorkerStatus {
+    1: string worker,
+    2: bool ready,
+    3: i32 pid,
+    // seconds between the most recent launch and passing the readiness
+    // probe; -1.0 if the worker has not become ready (yet)
+    4: double time_to_ready,
+    // number of times the bouncer killed this worker in response to an alert
+    5: i32 kills,
+    // number of times the bouncer restarted this worker after it terminated
+    6: i32 restarts,
+    // number of launches that failed or never became ready
+    7: i32 failed_starts,
+    // seconds since the current instance was launched
+    8: double uptime,
+    // seconds from kill to exit
+    9: Histogram kill_latency,
+    // seconds from exit until the replacement passed its readiness probe
+    10: Histogram exit_to_ready,
+    // seconds each instance ran before it terminated
+    11: Histogram lifetime,
+    // number of times the bouncer proactively restarted this worker because it
+    // used too much memory (see "recycle" in bouncer_common.py)
+    12: i32 recycles
+}
+
+struct BouncerStats {
+    1: list<WorkerStatus> workers,
+    // seconds since the bouncer started
+    2: double uptime,
+    // application-specific histograms, e.g. php_bouncer's sql_cleanup_latency
+    3: map<string, Histogram> histograms,
+    // seconds from the start of the bouncer until all of its workers were
+    // ready for the first time; -1.0 if that has not happened (yet)
+    4: double time_to_fully_ready,
+    // workers that the bouncer gave up launching (see START_ATTEMPTS in
+    // bouncer_process_manager.py). time_to_fully_ready stays -1.0 while
+    // there are any
+    5: list<string> failed_workers
+}
+
 // Bouncer process managers must implement this inteface
 service BouncerService {
 
@@ -38,6 +96,17 @@ service BouncerService {
      */
     oneway void alert(1: string alert_message)
 
+    /**
+     * Called by alert_router
+     *
+     * Equivalent to calling alert() once for each message in alert_messages,
+     * except that the bouncer kills (and restarts) all of the workers in
+     * parallel. The alert_router uses this method when several workers
+     * managed by the same bouncer are overloaded at the same time
+     * (see alert_batch_window in bouncer_common.py).
+     */
+    oneway void alertBatch(1: list<string> alert_messages)
+
     /**
      * Called by alert_router
      *
@@ -52,11 +121,20 @@ service BouncerService {
      * it's configuration.
      *
      * On subsequent calls to heartbeat, the Bouncer should return the
-     * empty list.
+     * empty list, unless the set of workers has changed since the previous
+     * call (see "autoscale" in bouncer_common.py), in which case it should
+     * return the new list of workers.
      *
      */
     list<string> heartbeat()
 
+    /**
+     * Called by operators and tools.
+     *
+     * Returns the current state of every worker this Bouncer manages.
+     */
+    BouncerStats stats()
+
     /**
      * Called by the bouncer itself.
      *
@@ -21,6 +21,10 @@
 # This daemon should probably run at a higher priority than web server,
 # because the alerts need to get to the bouncers ASAP.
 #
+# Alerts for workers that a bouncer's scoreboard (see scoreboard.py) shows as
+# not ready (i.e. already being killed or restarted) are dropped, since the
+# bouncer would ignore them or kill the worker twice.
+#
 # ==== TODO ====
 #   - Logging
 #   - Timeouts on RPC calls
@@ -43,6 +47,8 @@ sys.path.append(os.path.join(DIRNAME, '..', 'sig_service', 'gen-py'))
 sys.path.append(os.path.join(DIRNAME, '..', 'common'))
 
 import log
+import rpc
+import cpu_affinity
 import import_thrift_lib
 import logging
 
@@ -61,15 +67,13 @@ from SignatureService.constants import *
 
 
 from thrift import Thrift
-from thrift.transport import TSocket
-from thrift.transport import TTransport
-from thrift.protocol import TBinaryProtocol
 
 import Queue
 import threading
 import time
 
 from bouncer_common import *
+import scoreboard
 
 # Request a heartbeat every HEART_BEAT_PERIOD seconds
 HEART_BEAT_PERIOD=60
@@ -111,14 +115,20 @@ class AlertRouter:
     def __init__(self, config, logger):
         self.config = config
         self.logger = logger
+        self.last_heartbeat = time.time()
+        self.scoreboards = dict((str(bouncer), scoreboard.ScoreboardReader(
+            scoreboard.scoreboard_path(config.scoreboard_dir, bouncer))) for bouncer in config.bouncer_list)
+
+    def bouncerClient(self, bouncer):
+        '''Returns (client, transport) for bouncer; the transport is not open yet'''
+        mode = self.config.bouncer_options[str(bouncer)]["rpc"]["mode"]
+        return rpc.make_client(BouncerService.Client, bouncer.addr, bouncer.port, mode)
 
     def requestHeartbeat(self):
+        self.last_heartbeat = time.time()
         for bouncer in self.config.bouncer_list:
             try:
-                transport = TSocket.TSocket(bouncer.addr, bouncer.port)
-                transport = TTransport.TBufferedTransport(transport)
-                protocol = TBinaryProtocol.TBinaryProtocol(transport)
-                client = BouncerService.Client(protocol)
+                client, transport = self.bouncerClient(bouncer)
 
                 transport.open()
 
@@ -128,6 +138,10 @@ class AlertRouter:
 
                 if result == []:
                     self.logger.debug("Bouncer %s:%d heartbeat = OK" % (bouncer.addr, bouncer.port))
+                elif self.config.bouncer_options[str(bouncer)]["autoscale"] != None:
+                    if result != self.config.bouncer_map[str(bouncer)]:
+                        self.logger.info("Bouncer %s:%d now has workers %s", bouncer.addr, bouncer.port, result)
+                        self.config.set_workers(bouncer, result)
                 elif result != self.config.bouncer_map[str(bouncer)]:
                     self.logger.error("Error: the bouncer's configuration == %s does not match the " \
                         "alert_router's configuration == %s" % (result, self.config.bouncer_map[str(bouncer)]))
@@ -139,10 +153,7 @@ class AlertRouter:
 
     def sendAlert(self, bouncer, alert_message):
         try:
-          transport = TSocket.TSocket(bouncer.addr, bouncer.port)
-          transport = TTransport.TBufferedTransport(transport)
-          protocol = TBinaryProtocol.TBinaryProtocol(transport)
-          client = BouncerService.Client(protocol)
+          client, transport = self.bouncerClient(bouncer)
 
           transport.open()
 
@@ -156,16 +167,43 @@ class AlertRouter:
         except Thrift.TException, e:
             self.logger.error("Thrift exception: %s" % e)
 
+    def sendAlertBatch(self, bouncer, alert_messages):
+        try:
+          client, transport = self.bouncerClient(bouncer)
+
+          transport.open()
+
+          client.alertBatch(alert_messages)
+
+          transport.close()
+
+          self.logger.info("Successfully sent alert batch %s to Bouncer '%s:%d'" % \
+            (alert_messages, bouncer.addr, bouncer.port))
+
+        except Thrift.TException, e:
+            self.logger.error("Thrift exception: %s" % e)
+
+    def sendAlerts(self, pending_alerts):
+        '''pending_alerts maps each bouncer string to a 2-tuple (bouncer, alert_messages).
+        Sends a single alert if there is only one message for a bouncer, otherwise
+        sends them all in one alertBatch'''
+        for bouncer, alert_messages in pending_alerts.values():
+            if len(alert_messages) == 1:
+                self.logger.info("Sending alert")
+                self.sendAlert(bouncer, alert_messages[0])
+            else:
+                self.logger.info("Sending batch of %d alerts", len(alert_messages))
+                self.sendAlertBatch(bouncer, alert_messages)
+            self.logger.debug("Sent alert")
+
     def sendNotice(self, category, request_str):
         if category != "evicted" and category != "completed":
             self.logger.error("Unsupported category: %s", category)
             return
 
         try:
-          transport = TSocket.TSocket(self.config.sigservice["addr"], self.config.sigservice["port"])
-          transport = TTransport.TBufferedTransport(transport)
-          protocol = TBinaryProtocol.TBinaryProtocol(transport)
-          client = SignatureService.Client(protocol)
+          client, transport = rpc.make_client(SignatureService.Client, self.config.sigservice["addr"],
+              self.config.sigservice["port"], self.config.sigservice["rpc"]["mode"])
 
           transport.open()
 
@@ -193,11 +231,57 @@ class AlertRouter:
         elif pipe_message.startswith("completed:"):
             return "completed", pipe_message[10:]
         else:
-            if pipe_message in self.config.worker_map:
-                return "bouncer", self.config.worker_map[pipe_message]
+            bouncer = self.config.lookup_bouncer(pipe_message)
+            if bouncer != None:
+                return "bouncer", bouncer
             else:
                 raise GetBouncerException("Error: Received alert from pipe that I do not recognize '%s'" % pipe_message)
 
+    def workerState(self, bouncer, worker):
+        '''Returns the scoreboard slot for worker, or None if the bouncer's scoreboard
+        is unavailable (or stale) or does not list the worker'''
+        reader = self.scoreboards[str(bouncer)]
+        try:
+            slots = reader.read()
+        except scoreboard.ScoreboardError, e:
+            self.logger.debug("Scoreboard unavailable: %s", e)
+            return None
+        if not reader.bouncer_alive():
+            return None
+        return slots.get(worker)
+
+    def handleMessage(self, pipe_message, pending_alerts):
+        '''Handles one message from the pipe. Notices are forwarded to the sig service
+        right away, whereas alerts are added to pending_alerts (see sendAlerts)'''
+        pipe_message = pipe_message.rstrip()
+        self.logger.debug('Received from pipe: "%s"' % pipe_message)
+        try:
+            self.logger.debug("Parsing message")
+            message_type, message = self.parseMessage(pipe_message)
+            self.logger.debug("Got message type = %s", message_type)
+        except GetBouncerException, e:
+            self.logger.error(e.message)
+            message_type, message = None, None
+
+        if message_type == "bouncer":
+            bouncer = message
+            slot = self.workerState(bouncer, pipe_message)
+            if slot != None and slot.state != scoreboard.READY:
+                self.logger.info("Dropping alert for worker '%s' because it is %s", pipe_message,
+                    scoreboard.STATE_NAMES.get(slot.state, slot.state))
+                return
+            _, alert_messages = pending_alerts.setdefault(str(bouncer), (bouncer, []))
+            if pipe_message not in alert_messages:
+                alert_messages.append(pipe_message)
+        elif message_type == "evicted" or message_type == "completed":
+            if self.config.sigservice != None:
+                self.logger.info("Forwarding to sig service: %s", pipe_message[:40])
+                self.sendNotice(message_type, message)
+            else:
+                self.logger.info("Ignoring sig-service notice: %s", pipe_message[:40])
+        else:
+            self.logger.debug("Ignoring message")
+
     def run(self):
         queue = Queue.Queue()
         pipereader = PipeReader(self.config.alert_pipe, queue, self.logger)
@@ -210,29 +294,29 @@ class AlertRouter:
                 self.requestHeartbeat()
                 continue
 
-            pipe_message = pipe_message.rstrip()
-            self.logger.debug('Received from pipe: "%s"' % pipe_message)
-            try:
-                self.logger.debug("Parsing message")
-                message_type, message = self.parseMessage(pipe_message)
-                self.logger.debug("Got message type = %s", message_type)
-            except GetBouncerException, e:
-                self.logger.error(e.message)
-                message_type, message = None, None
-
-            if message_type == "bouncer":
-                bouncer = message
-                self.logger.info("Sending alert")
-                self.sendAlert(bouncer, pipe_message)
-                self.logger.debug("Sent alert")
-            elif message_type == "evicted" or message_type == "completed":
-                if self.config.sigservice != None:
-                    self.logger.info("Forwarding to sig service: %s", pipe_message[:40])
-                    self.sendNotice(message_type, message)
-                else:
-                    self.logger.info("Ignoring sig-service notice: %s", pipe_message[:40])
-            else:
-                self.logger.debug("Ignoring message")
+            # Keep up with autoscaling bouncers even when alerts never stop
+            if time.time() - self.last_heartbeat >= HEART_BEAT_PERIOD:
+                self.requestHeartbeat()
+
+            pending_alerts = {}
+            self.handleMessage(pipe_message, pending_alerts)
+
+            # When an attack saturates every worker at once, nginx emits one alert per
+            # worker in quick succession. Wait a little while for the rest of them, so
+            # that each bouncer receives a single batch it can handle in parallel.
+            if len(pending_alerts) > 0 and self.config.alert_batch_window > 0.0:
+                deadline = time.time() + self.config.alert_batch_window
+                while True:
+                    timeout = deadline - time.time()
+                    if timeout <= 0.0:
+                        break
+                    try:
+                        pipe_message = queue.get(timeout=timeout)
+                    except Queue.Empty:
+                        break
+                    self.handleMessage(pipe_message, pending_alerts)
+
+            self.sendAlerts(pending_alerts)
 
 if __name__ == "__main__":
 
@@ -264,6 +348,13 @@ if __name__ == "__main__":
         print
         raise
 
+    if config.control_cpus != None:
+        logger.info("Pinning alert_router to cpus %s", config.control_cpus)
+        try:
+            cpu_affinity.partition_process(config.control_cpus)
+        except OSError, e:
+            logger.error("Could not pin alert_router to cpus %s: %s", config.control_cpus, e)
+
     alert_router = AlertRouter(config, logger)
     alert_router.run()
 
@@ -23,6 +23,9 @@
 #
 # {
 #    "alert_pipe" : "/home/nginx_user/alert_pipe",
+#    "alert_batch_window" : 0.005,
+#    "control_cpus" : [0],
+#    "scoreboard_dir" : "/dev/shm",
 #    "sigservice" : {
 #       "bayes_classifier" : {
 #           "model_size" : 5000,
@@ -34,7 +37,11 @@
 #       "max_sample_size" : 100,
 #       "update_requests" : 100,
 #       "min_delay" : 1,
-#       "max_delay" : 5
+#       "max_delay" : 5,
+#       "rpc" : {
+#           "mode" : "processpool",
+#           "concurrency" : 4
+#       }
 #    },
 #    "bouncers" : [
 #       {
@@ -52,7 +59,36 @@
 #           "fcgi_workers" : [
 #               "10.51.23.66:9010",
 #               "10.51.23.66:9011"
-#               ]
+#               ],
+#           "readiness" : {
+#               "probe" : "fcgi",
+#               "timeout" : 30.0,
+#               "interval" : 0.05
+#           },
+#           "zygote" : false,
+#           "startup_parallelism" : 4,
+#           "rpc" : {
+#               "mode" : "nonblocking",
+#               "concurrency" : 4
+#           },
+#           "recycle" : {
+#               "rss_threshold_mb" : 200,
+#               "idle_time" : 30.0,
+#               "period" : 10.0,
+#               "min_serving" : 1
+#           },
+#           "cpu" : {
+#               "worker_cpus" : [1, 2, 3],
+#               "pin_each" : false,
+#               "nice" : 10
+#           },
+#           "autoscale" : {
+#               "port_range" : [9010, 9019],
+#               "min_workers" : 2,
+#               "max_workers" : 10,
+#               "scale_up_rate" : 0.5,
+#               "scale_down_rate" : 0.05
+#           }
 #       }
 #    ]
 # }
@@ -68,16 +104,279 @@
 #     alert to the bouncer daemon on 10.51.23.65, which is listening on port
 #     10012.
 #   - And so on for the bouncer on .66
+#   - A worker may also be a Unix domain socket, written "unix:/path/to/sock"
+#     (the path must be absolute; this is also how nginx names such upstream
+#     servers in its alerts). Its bouncer must run on the same machine. The
+#     bouncer removes stale socket files before starting a worker and after
+#     it exits. redmine_bouncer (mongrel) does not support Unix sockets, and
+#     neither does "autoscale".
+#   - alert_batch_window is optional (default 0.0). If it is > 0, then after
+#     receiving an alert the alert_router waits up to alert_batch_window
+#     seconds for more alerts, and sends all alerts for the same bouncer in
+#     one alertBatch() call, so the bouncer can kill the workers in parallel.
+#   - Each bouncer may optionally specify a "readiness" section, which
+#     determines when a freshly (re)started worker counts as available:
+#       - probe is "tcp" (default), "fcgi", or "none". See worker_probe.py
+#       - timeout (default 30.0) is the number of seconds a worker has to
+#         become ready before the bouncer gives up and restarts it
+#       - interval (default 0.05) is the number of seconds between probes
+#   - "zygote" is optional (default false). If true, bouncers for Python apps
+#     that support it (dummy_py_app, osqa) preload the app in a fork server
+#     and fork new workers from it instead of launching a fresh interpreter
+#     for every (re)start. See zygote.py
+#   - "startup_parallelism" is optional (default 0, meaning no limit). When the
+#     bouncer starts, at most startup_parallelism workers are starting up
+#     (i.e. launched but not ready yet) at the same time. Useful for apps
+#     whose workers are slow to boot and compete for cpu/disk while booting.
+#     wait_ready.py waits until every bouncer's workers are ready.
+#   - Bouncers and the sigservice may optionally specify an "rpc" section,
+#     which selects the kind of Thrift server they run (see
+#     ../common/rpc.py). Clients (alert_router, bouncer_stats, ...) read the
+#     same section, since some modes need a different client transport.
+#       - mode is "threadpool" (default) or "nonblocking" for bouncers, and
+#         may also be "processpool" for the sigservice
+#       - concurrency (default 10) is the number of handler threads (or, for
+#         processpool, handler processes)
+#   - "recycle" is optional (default: no recycling). If present, the bouncer
+#     proactively restarts workers whose memory grew too large, but only
+#     while the site is quiet, so that the restart cost is not paid during an
+#     attack:
+#       - rss_threshold_mb (required) is the RSS (of the worker and all of its
+#         children) above which a worker gets recycled
+#       - idle_time (default 30.0): recycle only if the bouncer has not
+#         received an alert for at least idle_time seconds
+#       - period (default 10.0) is the number of seconds between RSS checks
+#       - min_serving (default 1): never recycle if that would leave fewer
+#         than min_serving ready workers
+#     Workers are recycled one at a time; the next one is not recycled before
+#     the replacement passes its readiness probe.
+#   - "control_cpus" is optional (default: no pinning). If present, the
+#     alert_router and every bouncer pin themselves to these cpus, so that
+#     workers spinning on attack requests cannot starve the processes that
+#     are supposed to kill them. Use it together with "cpu" below.
+#   - "scoreboard_dir" is optional (default: /dev/shm, or the temp directory
+#     if there is no /dev/shm). Every bouncer publishes the state of its
+#     workers in a file in this directory. See scoreboard.py
+#   - "cpu" is optional (default: workers run wherever and at whatever
+#     priority the bouncer does). If present:
+#       - worker_cpus (default: all cpus) is the list of cpus the bouncer's
+#         workers may run on. Should not overlap control_cpus.
+#       - pin_each (default false): if true, each worker is pinned to a
+#         single cpu from worker_cpus (round robin, in the order of
+#         fcgi_workers, or of autoscale[port_range] if present) instead of
+#         the whole set. A worker keeps its cpu across restarts and scaling
+#       - nice (default: unchanged) is the nice value for workers
+#     See ../common/cpu_affinity.py
+#   - "autoscale" is optional (default: the set of workers is fixed). If
+#     present, fcgi_workers is only the initial set of workers; the bouncer
+#     adds workers (on free ports from port_range) while the alert rate is
+#     high and retires them when it falls:
+#       - port_range (required) is [first_port, last_port] (inclusive). All of
+#         fcgi_workers must be in this range.
+#       - addr (default: the address of the first fcgi worker) is the address
+#         of new workers
+#       - min_workers (default: len(fcgi_workers)) and max_workers (default:
+#         the size of port_range) bound the number of workers
+#       - scale_up_rate (default 0.5): add a worker when the bouncer received
+#         at least this many alerts per second over the last window seconds
+#       - scale_down_rate (default 0.0): retire a worker when the alert rate
+#         is at most this many alerts per second
+#       - window (default 60.0), period (default 5.0; seconds between scaling
+#         decisions) and cooldown (default 30.0; minimum number of seconds
+#         between two scaling actions)
+#     The bouncer reports worker-set changes to the alert_router through
+#     heartbeat(). The alert_router routes alerts for any port in port_range
+#     to the bouncer even before it learns about the change.
+#     IMPORTANT: nginx cannot learn about new workers, so the upstream block in
+#     nginx.conf must list every port in port_range (nginx treats ports that
+#     have no worker as failed servers and skips them).
 #   - For description of sigservice config run sigservice.py -h
 #       - the sigservice part of the config is optional
 #       - for the description of bayes classifier, run bayes.py -h
 
 import sys
+import os
 import json
+import tempfile
 
 class BadConfig(ValueError):
     pass
 
+READINESS_PROBES = ["tcp", "fcgi", "none"]
+
+# bouncer state lives in a single process, so bouncers cannot use processpool
+BOUNCER_RPC_MODES = ["threadpool", "nonblocking"]
+SIGSERVICE_RPC_MODES = ["threadpool", "nonblocking", "processpool"]
+
+DEFAULT_RPC = {
+    "mode" : "threadpool",
+    "concurrency" : 10
+}
+
+DEFAULT_READINESS = {
+    "probe" : "tcp",
+    "timeout" : 30.0,
+    "interval" : 0.05
+}
+
+def parse_readiness(bouncer):
+    '''Returns the readiness section for a bouncer (a dict from the "bouncers" list),
+    with missing values filled in from DEFAULT_READINESS'''
+    readiness = dict(DEFAULT_READINESS)
+    readiness.update(bouncer.get("readiness", {}))
+    if readiness["probe"] not in READINESS_PROBES:
+        raise BadConfig("readiness[probe] must be one of %s" % READINESS_PROBES)
+    readiness["timeout"] = float(readiness["timeout"])
+    readiness["interval"] = float(readiness["interval"])
+    if readiness["timeout"] <= 0.0 or readiness["interval"] <= 0.0:
+        raise BadConfig("readiness[timeout] and readiness[interval] must be positive")
+    return readiness
+
+def parse_rpc(section, modes):
+    '''Returns the rpc section of section (a bouncer dict or the sigservice dict),
+    with missing values filled in from DEFAULT_RPC. modes is the list of allowed
+    server modes'''
+    rpc = dict(DEFAULT_RPC)
+    rpc.update(section.get("rpc", {}))
+    if rpc["mode"] not in modes:
+        raise BadConfig("rpc[mode] must be one of %s" % modes)
+    rpc["mode"] = str(rpc["mode"])
+    rpc["concurrency"] = int(rpc["concurrency"])
+    if rpc["concurrency"] <= 0:
+        raise BadConfig("rpc[concurrency] must be positive")
+    return rpc
+
+DEFAULT_RECYCLE = {
+    "idle_time" : 30.0,
+    "period" : 10.0,
+    "min_serving" : 1
+}
+
+def parse_recycle(bouncer):
+    '''Returns the recycle section for a bouncer (a dict from the "bouncers" list),
+    with missing values filled in from DEFAULT_RECYCLE, or None if the bouncer does
+    not recycle workers'''
+    if "recycle" not in bouncer:
+        return None
+    recycle = dict(DEFAULT_RECYCLE)
+    recycle.update(bouncer["recycle"])
+    if "rss_threshold_mb" not in recycle:
+        raise BadConfig("recycle[rss_threshold_mb] is not defined")
+    recycle["rss_threshold_mb"] = float(recycle["rss_threshold_mb"])
+    recycle["idle_time"] = float(recycle["idle_time"])
+    recycle["period"] = float(recycle["period"])
+    recycle["min_serving"] = int(recycle["min_serving"])
+    if recycle["rss_threshold_mb"] <= 0.0 or recycle["period"] <= 0.0:
+        raise BadConfig("recycle[rss_threshold_mb] and recycle[period] must be positive")
+    if recycle["idle_time"] < 0.0 or recycle["min_serving"] < 0:
+        raise BadConfig("recycle[idle_time] and recycle[min_serving] must be >= 0")
+    return recycle
+
+def parse_cpus(cpus, name):
+    if not isinstance(cpus, list) or len(cpus) == 0:
+        raise BadConfig("%s must be a non-empty list of cpu numbers" % name)
+    cpus = [int(cpu) for cpu in cpus]
+    if min(cpus) < 0:
+        raise BadConfig("%s must not contain negative cpu numbers" % name)
+    return cpus
+
+def parse_cpu(bouncer):
+    '''Returns the cpu section for a bouncer (a dict from the "bouncers" list), or None
+    if the bouncer does not partition its workers' cpus'''
+    if "cpu" not in bouncer:
+        return None
+    cpu = {
+        "worker_cpus" : None,
+        "pin_each" : False,
+        "nice" : None
+    }
+    cpu.update(bouncer["cpu"])
+    if cpu["worker_cpus"] != None:
+        cpu["worker_cpus"] = parse_cpus(cpu["worker_cpus"], "cpu[worker_cpus]")
+    elif cpu["pin_each"]:
+        raise BadConfig("cpu[pin_each] requires cpu[worker_cpus]")
+    cpu["pin_each"] = bool(cpu["pin_each"])
+    if cpu["nice"] != None:
+        cpu["nice"] = int(cpu["nice"])
+    return cpu
+
+DEFAULT_AUTOSCALE = {
+    "scale_up_rate" : 0.5,
+    "scale_down_rate" : 0.0,
+    "window" : 60.0,
+    "period" : 5.0,
+    "cooldown" : 30.0
+}
+
+def parse_autoscale(bouncer, fcgi_workers):
+    '''Returns the autoscale section for a bouncer (a dict from the "bouncers" list),
+    with missing values filled in, or None if the bouncer does not autoscale.
+    fcgi_workers is the bouncer's initial list of workers.'''
+    if "autoscale" not in bouncer:
+        return None
+    autoscale = dict(DEFAULT_AUTOSCALE)
+    autoscale.update(bouncer["autoscale"])
+    if "port_range" not in autoscale or len(autoscale["port_range"]) != 2:
+        raise BadConfig("autoscale[port_range] must be [first_port, last_port]")
+    first_port, last_port = [int(port) for port in autoscale["port_range"]]
+    if first_port > last_port:
+        raise BadConfig("autoscale[port_range] is empty")
+    autoscale["port_range"] = [first_port, last_port]
+    if "addr" not in autoscale:
+        if len(fcgi_workers) == 0:
+            raise BadConfig("autoscale[addr] is required if fcgi_workers is empty")
+        autoscale["addr"] = parse_worker(str(fcgi_workers[0]))[0]
+    autoscale["addr"] = str(autoscale["addr"])
+    if autoscale["addr"] == UNIX_ADDR:
+        raise BadConfig("autoscale does not support Unix socket workers")
+    for worker in fcgi_workers:
+        addr, port = parse_worker(str(worker))
+        if addr != autoscale["addr"] or not (first_port <= port <= last_port):
+            raise BadConfig("fcgi worker %s is not in autoscale[addr]:autoscale[port_range]" % worker)
+    autoscale["min_workers"] = int(autoscale.get("min_workers", len(fcgi_workers)))
+    autoscale["max_workers"] = int(autoscale.get("max_workers", last_port - first_port + 1))
+    if not (0 < autoscale["min_workers"] <= len(fcgi_workers) <= autoscale["max_workers"] <= \
+            last_port - first_port + 1):
+        raise BadConfig("autoscale must have 0 < min_workers <= len(fcgi_workers) <= max_workers <= "
+            "size of port_range")
+    for key in ["scale_up_rate", "scale_down_rate", "window", "period", "cooldown"]:
+        autoscale[key] = float(autoscale[key])
+    if autoscale["scale_down_rate"] >= autoscale["scale_up_rate"]:
+        raise BadConfig("autoscale[scale_down_rate] must be less than autoscale[scale_up_rate]")
+    if autoscale["window"] <= 0.0 or autoscale["period"] <= 0.0 or autoscale["cooldown"] < 0.0:
+        raise BadConfig("autoscale[window] and autoscale[period] must be positive and "
+            "autoscale[cooldown] must be >= 0")
+    return autoscale
+
+def autoscale_workers(autoscale):
+    '''Returns the list of every worker string the autoscale section may use'''
+    first_port, last_port = autoscale["port_range"]
+    return ["%s:%d" % (autoscale["addr"], port) for port in range(first_port, last_port + 1)]
+
+# The addr that parse_worker returns for Unix socket workers
+UNIX_ADDR = "unix"
+
+def parse_worker(worker):
+    '''Takes a string such as 'ipaddr:port' and returns a 2-tuple (ipaddr, port)
+    where ipaddr is a str and port is an int. For a Unix socket worker, i.e.
+    'unix:/path/to/sock', returns (UNIX_ADDR, '/path/to/sock'). Raises
+    ValueError if parse fails'''
+    if worker.startswith(UNIX_ADDR + ":"):
+        path = worker[len(UNIX_ADDR) + 1:]
+        if not os.path.isabs(path):
+            raise ValueError("The socket path of '%s' is not absolute" % worker)
+        return (UNIX_ADDR, path)
+    parts = worker.split(':')
+    if len(parts) != 2:
+        raise ValueError("There should be exactly one : in '%s'" % worker)
+    return (parts[0], int(parts[1]))
+
+def format_worker(addr, port):
+    '''The inverse of parse_worker'''
+    if addr == UNIX_ADDR:
+        return "%s:%s" % (UNIX_ADDR, port)
+    return "%s:%d" % (addr, port)
+
 class BouncerAddress:
 
     def __init__(self, addr, port):
@@ -94,11 +393,23 @@ class Config:
         sets:
             self.sigservice to a dict
             self.alert_pipe to the path of alert_pipe.
+            self.alert_batch_window to the number of seconds the alert_router waits
+                to batch alerts (0.0 means no batching).
+            self.control_cpus to the list of cpus for the alert_router and the bouncers
+                (or None).
+            self.scoreboard_dir to the directory that holds the bouncers' scoreboards.
             self.worker_map which is a dict that maps every FCGI worker string
                 to a BouncerAddress object.
             self.bouncer_list which is a list of BouncerAddr objects
             self.bouncer_map which is a dict that maps every bouncer string (i.e str(bouncerAddr))
-                to the FCGI workers (strings) that that bouncer is repsonsible for.'''
+                to the FCGI workers (strings) that that bouncer is repsonsible for.
+            self.bouncer_options which is a dict that maps every bouncer string to a dict of
+                that bouncer's optional settings (with defaults filled in), e.g.
+                self.bouncer_options[bouncer]["readiness"]
+            self.autoscale_map which is a dict that maps every worker string in the
+                port range of an autoscaling bouncer to that bouncer's BouncerAddress.
+        worker_map and bouncer_map hold the current set of workers; for autoscaling
+        bouncers the alert_router updates them with set_workers.'''
 
         try:
             json_config = json.load(fd)
@@ -108,6 +419,8 @@ class Config:
         self.worker_map = {}
         self.bouncer_map = {}
         self.bouncer_list = []
+        self.bouncer_options = {}
+        self.autoscale_map = {}
 
         if "sigservice" not in json_config:
             self.sigservice = None
@@ -134,11 +447,28 @@ class Config:
                 raise BadConfig("sigservice[min_delay] is not defined")
             if "max_delay" not in self.sigservice:
                 raise BadConfig("sigservice[max_delay] is not defined")
+            self.sigservice["rpc"] = parse_rpc(self.sigservice, SIGSERVICE_RPC_MODES)
 
         if "alert_pipe" not in json_config:
             raise BadConfig("alert_pipe is not defined")
         self.alert_pipe = str(json_config["alert_pipe"])
 
+        self.alert_batch_window = float(json_config.get("alert_batch_window", 0.0))
+        if self.alert_batch_window < 0.0:
+            raise BadConfig("alert_batch_window must be >= 0.0")
+
+        if "control_cpus" in json_config:
+            self.control_cpus = parse_cpus(json_config["control_cpus"], "control_cpus")
+        else:
+            self.control_cpus = None
+
+        if "scoreboard_dir" in json_config:
+            self.scoreboard_dir = str(json_config["scoreboard_dir"])
+        elif os.path.isdir("/dev/shm"):
+            self.scoreboard_dir = "/dev/shm"
+        else:
+            self.scoreboard_dir = tempfile.gettempdir()
+
         if "bouncers" not in json_config:
             raise BadConfig("bouncers is not defined")
         bouncers = json_config["bouncers"]
@@ -151,21 +481,65 @@ class Config:
             bouncer_obj = BouncerAddress(bouncer_addr, bouncer_port)
             self.bouncer_map[str(bouncer_obj)] = []
             self.bouncer_list.append(bouncer_obj)
+            self.bouncer_options[str(bouncer_obj)] = {
+                "readiness" : parse_readiness(bouncer),
+                "zygote" : bool(bouncer.get("zygote", False)),
+                "rpc" : parse_rpc(bouncer, BOUNCER_RPC_MODES),
+                "recycle" : parse_recycle(bouncer),
+                "cpu" : parse_cpu(bouncer),
+                "startup_parallelism" : int(bouncer.get("startup_parallelism", 0)),
+                "autoscale" : parse_autoscale(bouncer, fcgi_workers)
+            }
+            if self.bouncer_options[str(bouncer_obj)]["startup_parallelism"] < 0:
+                raise BadConfig("startup_parallelism must be >= 0")
             for worker in fcgi_workers:
                 worker = str(worker)
+                try:
+                    parse_worker(worker)
+                except ValueError, e:
+                    raise BadConfig("Malformed fcgi worker: %s" % e)
                 if worker in self.worker_map:
                     raise BadConfig("Same fcgi worker appears more than once")
                 self.worker_map[worker] = bouncer_obj
                 self.bouncer_map[str(bouncer_obj)].append(worker)
 
+            autoscale = self.bouncer_options[str(bouncer_obj)]["autoscale"]
+            if autoscale != None:
+                for worker in autoscale_workers(autoscale):
+                    if worker in self.autoscale_map:
+                        raise BadConfig("The autoscale port ranges of two bouncers overlap")
+                    self.autoscale_map[worker] = bouncer_obj
+
+        for worker, bouncer_obj in self.autoscale_map.items():
+            if self.worker_map.get(worker, bouncer_obj) is not bouncer_obj:
+                raise BadConfig("fcgi worker %s is in the autoscale port_range of another bouncer" % worker)
+
+    def lookup_bouncer(self, worker):
+        '''Returns the BouncerAddress responsible for worker (a string like
+        "127.0.0.1:9001"), or None'''
+        if worker in self.worker_map:
+            return self.worker_map[worker]
+        return self.autoscale_map.get(worker)
+
+    def set_workers(self, bouncer, workers):
+        '''Replaces the set of workers for bouncer (a BouncerAddress) with workers'''
+        for worker in self.bouncer_map[str(bouncer)]:
+            del self.worker_map[worker]
+        self.bouncer_map[str(bouncer)] = list(workers)
+        for worker in workers:
+            self.worker_map[worker] = bouncer
+
     def __str__(self):
         '''Just for debugging'''
         result = {}
         result['sigservice'] = self.sigservice
         result['alert_pipe'] = self.alert_pipe
+        result['alert_batch_window'] = self.alert_batch_window
+        result['control_cpus'] = self.control_cpus
         result['worker_map'] = self.worker_map
         result['bouncer_map'] = self.bouncer_map
         result['bouncer_list'] = self.bouncer_list
+        result['bouncer_options'] = self.bouncer_options
         return json.dumps(result, indent=4, sort_keys=True, default=str)
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== bouncer_common_test.py ====
+#
+#
+import unittest
+import json
+import StringIO
+from bouncer_common import *
+
+def make_config(bouncers):
+    return Config(StringIO.StringIO(json.dumps({"alert_pipe" : "/tmp/alert_pipe", "bouncers" : bouncers})))
+
+def make_bouncer(port, workers, autoscale=None):
+    bouncer = {
+        "bouncer_addr" : "127.0.0.1",
+        "bouncer_port" : port,
+        "fcgi_workers" : workers
+    }
+    if autoscale != None:
+        bouncer["autoscale"] = autoscale
+    return bouncer
+
+class Test_bouncer_common(unittest.TestCase):
+
+    def test_parse_worker(self):
+        self.assertEqual(parse_worker("127.0.0.1:9001"), ("127.0.0.1", 9001))
+        self.assertEqual(parse_worker("unix:/tmp/php9001.sock"), (UNIX_ADDR, "/tmp/php9001.sock"))
+        self.assertEqual(format_worker(UNIX_ADDR, "/tmp/php9001.sock"), "unix:/tmp/php9001.sock")
+        self.assertRaises(ValueError, parse_worker, "unix:php9001.sock")
+        self.assertRaises(ValueError, parse_worker, "127.0.0.1")
+
+        config = make_config([make_bouncer(3001, ["unix:/tmp/a.sock", "127.0.0.1:9001"])])
+        self.assertEqual(config.lookup_bouncer("unix:/tmp/a.sock"), config.bouncer_list[0])
+        self.assertRaises(BadConfig, make_config, [make_bouncer(3001, ["unix:/tmp/a.sock"],
+            {"port_range" : [9001, 9004]})])
+
+    def test_autoscale(self):
+        config = make_config([make_bouncer(3001, ["127.0.0.1:9001", "127.0.0.1:9002"],
+            {"port_range" : [9001, 9004]})])
+        autoscale = config.bouncer_options["127.0.0.1:3001"]["autoscale"]
+        self.assertEqual(autoscale["addr"], "127.0.0.1")
+        self.assertEqual(autoscale["min_workers"], 2)
+        self.assertEqual(autoscale["max_workers"], 4)
+
+        bouncer = config.bouncer_list[0]
+        self.assertEqual(config.lookup_bouncer("127.0.0.1:9004"), bouncer)
+        self.assertEqual(config.lookup_bouncer("127.0.0.1:9005"), None)
+
+        config.set_workers(bouncer, ["127.0.0.1:9001", "127.0.0.1:9003"])
+        self.assertEqual(config.bouncer_map[str(bouncer)], ["127.0.0.1:9001", "127.0.0.1:9003"])
+        self.assertEqual(sorted(config.worker_map.keys()), ["127.0.0.1:9001", "127.0.0.1:9003"])
+
+    def test_bad_autoscale(self):
+        workers = ["127.0.0.1:9001", "127.0.0.1:9002"]
+        # worker outside of port_range
+        self.assertRaises(BadConfig, make_config, [make_bouncer(3001, workers,
+            {"port_range" : [9002, 9004]})])
+        # more initial workers than max_workers
+        self.assertRaises(BadConfig, make_config, [make_bouncer(3001, workers,
+            {"port_range" : [9001, 9004], "max_workers" : 1})])
+        self.assertRaises(BadConfig, make_config, [make_bouncer(3001, workers,
+            {"port_range" : [9001, 9004], "scale_up_rate" : 0.1, "scale_down_rate" : 0.1})])
+        # overlapping port ranges
+        self.assertRaises(BadConfig, make_config, [
+            make_bouncer(3001, workers, {"port_range" : [9001, 9004]}),
+            make_bouncer(3002, ["127.0.0.1:9004"], {"port_range" : [9004, 9005]})])
+        # another bouncer's fixed worker inside the port range
+        self.assertRaises(BadConfig, make_config, [
+            make_bouncer(3001, workers, {"port_range" : [9001, 9004]}),
+            make_bouncer(3002, ["127.0.0.1:9003"])])
+
+if __name__ == '__main__':
+    unittest.main()
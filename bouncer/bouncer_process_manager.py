@@ -30,9 +30,11 @@
 # parses the command line arguments, instantiates the subclass, and runs the
 # server. See the documentation for main(...) for more details.
 #
+# The kind of Thrift server (thread pool or non-blocking) is selected by the
+# bouncer's "rpc" option; see bouncer_common.py and ../common/rpc.py.
+#
 # ==== TODO ====
 #   - The sublcass methods raise exceptions, the superclass should handle them
-#   - Consider event handling models: threaded, event based, ...?
 #
 
 import sys
@@ -47,22 +49,41 @@ sys.path.append(os.path.join(DIRNAME, 'gen-py'))
 sys.path.append(os.path.join(DIRNAME, '..', 'common'))
 
 import log
+import rpc
 
 import import_thrift_lib
 
 from BouncerService import BouncerService
 from BouncerService.ttypes import *
 
-from thrift.transport import TSocket
-from thrift.transport import TTransport
-from thrift.protocol import TBinaryProtocol
-from thrift.server import TServer
 from thrift.Thrift import TException
 
+import errno
 import socket
+import stat
 import threading
+import time
+import collections
 
 from bouncer_common import *
+import worker_probe
+import worker_stats
+import procinfo
+import cpu_affinity
+import scoreboard
+
+# A worker is considered to be crash looping once it has exited CRASH_LOOP_EXITS
+# times in a row, without being killed by the bouncer, less than
+# CRASH_LOOP_LIFETIME seconds after it was launched
+CRASH_LOOP_EXITS = 3
+CRASH_LOOP_LIFETIME = 10.0
+
+# A worker whose first launch fails (start_worker returns None) is retried up to
+# START_ATTEMPTS launches in total, START_RETRY_DELAY seconds after the first
+# failure and twice as long after each further one. After that it is reported
+# in failed_workers (see stats)
+START_ATTEMPTS = 5
+START_RETRY_DELAY = 0.5
 
 class StartWorkerFailed(Exception):
     pass
@@ -73,23 +94,26 @@ class WorkerMonitor(threading.Thread):
     '''A thread that watches a worker process and sends workerTerminated
     message when the worker terminates.'''
 
-    def __init__(self, popen_obj, bouncerAddr, worker, logger):
+    def __init__(self, popen_obj, bouncerAddr, worker, logger, on_exit=None, rpc_mode="threadpool"):
         '''popen_obj is an instance of subprocess.Popen for the worker to be monitored.
         bouncerAddr is the BouncerAddress objcect for this bouncer.
-        worker is a string like "127.0.0.1:9001".'''
+        worker is a string like "127.0.0.1:9001".
+        on_exit, if not None, is called as on_exit(worker, popen_obj) as soon as the
+        worker terminates (before the workerTerminated message is sent).
+        rpc_mode is the bouncer's Thrift server mode (see rpc.py).'''
         self.popen_obj = popen_obj
         self.bouncerAddr = bouncerAddr
         self.worker = worker
         self.logger = logger
+        self.on_exit = on_exit
+        self.rpc_mode = rpc_mode
         super(WorkerMonitor, self).__init__()
 
     def sendMessage(self):
         self.logger.info("Sending worker-terminated message for worker '%s' to bouncer" % self.worker)
         try:
-            transport = TSocket.TSocket(self.bouncerAddr.addr, self.bouncerAddr.port)
-            transport = TTransport.TBufferedTransport(transport)
-            protocol = TBinaryProtocol.TBinaryProtocol(transport)
-            client = BouncerService.Client(protocol)
+            client, transport = rpc.make_client(BouncerService.Client,
+                self.bouncerAddr.addr, self.bouncerAddr.port, self.rpc_mode)
 
             transport.open()
 
@@ -104,8 +128,181 @@ class WorkerMonitor(threading.Thread):
         self.logger.debug("Monitor launched for worker '%s'" % self.worker)
         self.popen_obj.wait()
         self.logger.info("Monitor for worker '%s': worker terminated" % self.worker)
+        if self.on_exit != None:
+            self.on_exit(self.worker, self.popen_obj)
         self.sendMessage()
 
+class ReadinessProbe(threading.Thread):
+    '''A thread that probes a freshly launched worker until it is ready to serve
+    requests, then reports the result to the bouncer (via workerReady or
+    workerNotReady).'''
+
+    def __init__(self, bpm, worker, popen_obj):
+        '''bpm is the BouncerProcessManager that launched the worker.
+        worker is a string like "127.0.0.1:9001".
+        popen_obj is an instance of subprocess.Popen for the worker to be probed.'''
+        self.bpm = bpm
+        self.worker = worker
+        self.popen_obj = popen_obj
+        super(ReadinessProbe, self).__init__()
+        self.daemon = True
+
+    def run(self):
+        readiness = self.bpm.readiness
+        addr, port = BouncerProcessManager.parse_worker(self.worker)
+        elapsed = worker_probe.wait_until_ready(readiness["probe"], addr, port, self.popen_obj,
+            readiness["timeout"], readiness["interval"])
+        if elapsed == None:
+            self.bpm.workerNotReady(self.worker, self.popen_obj)
+        else:
+            self.bpm.workerReady(self.worker, self.popen_obj, elapsed)
+
+class MemoryRecycler(threading.Thread):
+    '''A thread that proactively restarts (recycles) workers whose RSS exceeds a
+    threshold, so that leaky workers get restarted while the site is quiet rather
+    than in the middle of an overload. See "recycle" in bouncer_common.py.'''
+
+    def __init__(self, bpm, recycle):
+        '''bpm is the BouncerProcessManager whose workers are recycled.
+        recycle is the bouncer's recycle options (see bouncer_common.parse_recycle)'''
+        self.bpm = bpm
+        self.recycle = recycle
+        self.logger = bpm.logger
+        super(MemoryRecycler, self).__init__()
+        self.daemon = True
+
+    def pick_worker(self):
+        '''Returns (worker, popen_obj, rss_kb) for the ready worker with the largest RSS
+        over the threshold, or None if no worker should be recycled right now'''
+        idle = time.time() - self.bpm.last_alert_time
+        if idle < self.recycle["idle_time"]:
+            self.logger.debug("Not recycling; last alert was %fs ago", idle)
+            return None
+        with self.bpm.lock:
+            ready = [(worker, self.bpm.worker_popen_map[worker]) for worker in self.bpm.workers
+                if self.bpm.worker_ready_map.get(worker, False)]
+        if len(ready) - 1 < self.recycle["min_serving"]:
+            self.logger.debug("Not recycling; only %d workers are ready", len(ready))
+            return None
+        threshold_kb = self.recycle["rss_threshold_mb"] * 1024
+        largest = None
+        for worker, popen_obj in ready:
+            rss = procinfo.rss_tree_kb(popen_obj.pid)
+            if rss > threshold_kb and (largest == None or rss > largest[2]):
+                largest = (worker, popen_obj, rss)
+        return largest
+
+    def wait_for_replacement(self, worker, popen_obj):
+        '''Waits until a new instance of worker (i.e. not popen_obj) is ready. Returns
+        True on success, False if that takes longer than the readiness timeout'''
+        readiness = self.bpm.readiness
+        deadline = time.time() + readiness["timeout"] + self.recycle["period"]
+        while time.time() < deadline:
+            with self.bpm.lock:
+                replaced = self.bpm.worker_popen_map.get(worker) is not popen_obj
+                ready = self.bpm.worker_ready_map.get(worker, False)
+            if replaced and ready:
+                return True
+            time.sleep(readiness["interval"])
+        return False
+
+    def run(self):
+        while True:
+            time.sleep(self.recycle["period"])
+            try:
+                candidate = self.pick_worker()
+                if candidate == None:
+                    continue
+                worker, popen_obj, rss = candidate
+                self.logger.info("Recycling worker '%s' (rss = %dkB)", worker, rss)
+                if not self.bpm.recycleWorker(worker, popen_obj):
+                    continue
+                start = time.time()
+                if self.wait_for_replacement(worker, popen_obj):
+                    self.logger.info("Recycled worker '%s' is ready again after %fs", worker,
+                        time.time() - start)
+                else:
+                    self.logger.error("Recycled worker '%s' did not become ready again", worker)
+            except Exception:
+                self.logger.exception("Error while recycling workers")
+
+class Autoscaler(threading.Thread):
+    '''A thread that adds workers while the bouncer receives many alerts and
+    retires them when alerts become rare. See "autoscale" in bouncer_common.py.'''
+
+    def __init__(self, bpm, autoscale):
+        '''bpm is the BouncerProcessManager whose worker pool is scaled.
+        autoscale is the bouncer's autoscale options (see bouncer_common.parse_autoscale)'''
+        self.bpm = bpm
+        self.autoscale = autoscale
+        self.logger = bpm.logger
+        self.last_scale_time = bpm.start_time
+        super(Autoscaler, self).__init__()
+        self.daemon = True
+
+    def alert_rate(self, now):
+        '''Returns the number of alerts per second over the last window seconds'''
+        with self.bpm.alert_times_lock:
+            self.bpm.trim_alert_times(now)
+            return len(self.bpm.alert_times) / self.autoscale["window"]
+
+    @staticmethod
+    def port_is_free(addr, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((addr, port))
+            return True
+        except socket.error:
+            return False
+        finally:
+            sock.close()
+
+    def free_worker(self):
+        '''Returns the worker string for the lowest free port in port_range, or None'''
+        with self.bpm.lock:
+            taken = set(self.bpm.workers) | self.bpm.retired
+        for worker in autoscale_workers(self.autoscale):
+            if worker in taken:
+                continue
+            addr, port = BouncerProcessManager.parse_worker(worker)
+            if Autoscaler.port_is_free(addr, port):
+                return worker
+        return None
+
+    def scale(self, now):
+        '''Adds or retires at most one worker. Returns True iff it did.'''
+        if not self.bpm.startup_finished or now - self.last_scale_time < self.autoscale["cooldown"]:
+            return False
+        rate = self.alert_rate(now)
+        num_workers = len(self.bpm.workers)
+        if rate >= self.autoscale["scale_up_rate"] and num_workers < self.autoscale["max_workers"]:
+            worker = self.free_worker()
+            if worker == None:
+                self.logger.warning("Cannot add a worker (alert rate = %f/s); no free port in %s",
+                    rate, self.autoscale["port_range"])
+                return False
+            self.logger.info("Alert rate is %f/s; adding worker '%s' (%d workers)", rate, worker,
+                num_workers + 1)
+            self.bpm.addWorker(worker)
+        elif rate <= self.autoscale["scale_down_rate"] and num_workers > self.autoscale["min_workers"]:
+            worker = self.bpm.workers[-1]
+            self.logger.info("Alert rate is %f/s; retiring worker '%s' (%d workers)", rate, worker,
+                num_workers - 1)
+            self.bpm.retireWorker(worker)
+        else:
+            return False
+        self.last_scale_time = now
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self.autoscale["period"])
+            try:
+                self.scale(time.time())
+            except Exception:
+                self.logger.exception("Error while autoscaling workers")
+
 class BouncerProcessManager(object):
     '''The super class for bouncer process managers. Each web application requires its
     own logic for starting, killing, and checking the status of workers. Therefore
@@ -117,17 +314,49 @@ class BouncerProcessManager(object):
     the worker to kill. The worker string is of the form '127.0.0.1:9001', i.e.
     'ip_addr:port'.
 
+    Workers may also listen on Unix domain sockets ('unix:/path/to/sock'). For
+    those, start_worker and kill_worker receive addr == UNIX_ADDR and the socket
+    path as port (see parse_worker). The superclass removes stale socket files
+    before each launch and after each exit, so subclasses only need to tell the
+    worker to listen on the path.
+
     The documentation for those methods, specifies they contract that implementations
-    must fulfill.'''
+    must fulfill.
+
+    A freshly (re)started worker does not count as available until it passes the
+    readiness probe configured for this bouncer (see "readiness" in bouncer_common.py).
+    Alerts for workers that are still starting are ignored, and workers that do not
+    become ready within the readiness timeout are killed (and thus restarted).
+
+    Workers are launched by a background thread, at most startup_parallelism at a
+    time (see bouncer_common.py): a worker holds its startup slot until it passes
+    (or fails) its readiness probe. Once every worker has been ready, stats()
+    reports how long that took (time_to_fully_ready).
+
+    If the bouncer's config has a "recycle" section, a MemoryRecycler thread also
+    restarts workers that use too much memory, during quiet periods.
+
+    If the bouncer's config has an "autoscale" section, an Autoscaler thread adds
+    and retires workers depending on the alert rate. self.workers is then replaced
+    (never modified in place) whenever the set of workers changes, so other threads
+    may iterate over it without holding self.lock. The next heartbeat() reports the
+    new set of workers to the alert_router.
+
+    The bouncer publishes the state of every worker (starting, ready, killing,
+    exited, crash-looping or retiring) in a scoreboard file (see scoreboard.py),
+    which other local processes can read without RPCs.
+
+    If the bouncer's config has a "cpu" section, start_worker implementations should
+    pass preexec_fn=self.worker_preexec(addr, port) to subprocess.Popen, so that the
+    worker (and everything it forks) runs on the configured cpus at the configured
+    nice value. launch_worker also applies these settings to every thread of the
+    new worker and of its descendants, which covers workers that are not started
+    via Popen (e.g. zygote workers).'''
 
     @staticmethod
     def parse_worker(worker):
-        '''Takes a string such as 'ipaddr:port' and returns a 2-tuple (ipaddr, port)
-        where ipaddr is a str and port is an int. Raises ValueError if parse fails'''
-        parts = worker.split(':')
-        if len(parts) != 2:
-            raise ValueError("There should be exactly one : in '%s'" % worker)
-        return (parts[0], int(parts[1]))
+        '''See bouncer_common.parse_worker'''
+        return parse_worker(worker)
 
     def __init__(self, config, addr, port, logger):
         self.logger = logger
@@ -135,27 +364,122 @@ class BouncerProcessManager(object):
         self.bouncerAddr = BouncerAddress(addr, port)
         if str(self.bouncerAddr) not in self.config.bouncer_map:
             raise BadConfig("This bouncer '%s' is not in the configuration" % str(self.bouncerAddr))
-        self.workers = self.config.bouncer_map[str(self.bouncerAddr)]
+        self.workers = list(self.config.bouncer_map[str(self.bouncerAddr)])
+        self.readiness = self.config.bouncer_options[str(self.bouncerAddr)]["readiness"]
+        self.rpc = self.config.bouncer_options[str(self.bouncerAddr)]["rpc"]
+        self.recycle = self.config.bouncer_options[str(self.bouncerAddr)]["recycle"]
+        self.cpu = self.config.bouncer_options[str(self.bouncerAddr)]["cpu"]
+        self.startup_parallelism = self.config.bouncer_options[str(self.bouncerAddr)]["startup_parallelism"]
+        self.autoscale = self.config.bouncer_options[str(self.bouncerAddr)]["autoscale"]
         self.receivedFirstHeartbeat = False
 
+        # maps each worker string to its fixed position (in fcgi_workers, or in
+        # port_range if the bouncer autoscales), which pin_each uses to pick its cpu.
+        # Unlike self.workers, it never changes
+        if self.autoscale != None:
+            positions = autoscale_workers(self.autoscale)
+        else:
+            positions = self.workers
+        self.worker_positions = dict((worker, index) for index, worker in enumerate(positions))
+
+        # True iff the set of workers changed since the last heartbeat
+        self.workersChanged = False
+        self.start_time = time.time()
+
+        # time of the most recent alert (used by MemoryRecycler to detect quiet periods)
+        self.last_alert_time = self.start_time
+
+        # times of the alerts in the last autoscale window (used by Autoscaler to
+        # compute the alert rate). Only kept if the bouncer autoscales. Alerts
+        # arrive on several threads, so alert_times_lock protects it
+        self.alert_times = collections.deque()
+        self.alert_times_lock = threading.Lock()
+
+        # protects workers, retired, worker_popen_map, worker_ready_map,
+        # worker_time_to_ready, worker_counters, startup_pending, time_to_fully_ready and
+        # failed_workers
+        self.lock = threading.Lock()
+
+        # workers that Autoscaler removed, but that have not terminated yet
+        self.retired = set()
+
+        # maps each worker string to the number of times in a row it exited soon
+        # after launch without being killed (see CRASH_LOOP_EXITS)
+        self.crash_streak = {}
+
+        if self.autoscale != None:
+            num_slots = len(autoscale_workers(self.autoscale))
+        else:
+            num_slots = len(self.workers)
+        path = scoreboard.scoreboard_path(self.config.scoreboard_dir, self.bouncerAddr)
+        try:
+            self.scoreboard = scoreboard.ScoreboardWriter(path, num_slots)
+            self.logger.info("Publishing worker states in %s", path)
+        except (OSError, IOError), e:
+            self.logger.error("Could not create scoreboard %s: %s", path, e)
+            self.scoreboard = None
+
         # maps each worker string to the popen object for that worker process
         self.worker_popen_map = {}
 
+        # maps each worker string to True iff the worker has passed its readiness probe
+        self.worker_ready_map = {}
+
+        # maps each worker string to the number of seconds its most recent launch took to
+        # become ready (or None if it has not become ready)
+        self.worker_time_to_ready = {}
+
+        # maps each worker string to its worker_stats.WorkerCounters
+        self.worker_counters = dict((worker, worker_stats.WorkerCounters()) for worker in self.workers)
+
+        # Threads inherit the affinity of the thread that creates them, so this
+        # pins every thread started from now on. Threads that subclasses started
+        # before calling this constructor (e.g. php_bouncer's SqlKillers) are
+        # pinned individually
+        if self.config.control_cpus != None:
+            self.logger.info("Pinning bouncer to cpus %s", self.config.control_cpus)
+            try:
+                cpu_affinity.partition_process(self.config.control_cpus)
+            except OSError, e:
+                self.logger.error("Could not pin bouncer to cpus %s: %s", self.config.control_cpus, e)
+
         for worker in self.workers:
             try:
                 addr, port = BouncerProcessManager.parse_worker(worker)
             except ValueError, e:
                 raise StartWorkerFailed("Could not start worker '%s' because it is malformed" % worker)
 
-            self.logger.info("Starting worker: %s" % worker)
-            popen_obj = self.start_worker(addr, port)
-            if (popen_obj == None):
-                raise StartWorkerFailed("Could not start worker '%s' for unknown reason" % worker)
+        # the workers whose first launch still holds a startup slot
+        self.startup_pending = set()
+        if self.startup_parallelism > 0:
+            self.startup_slots = threading.Semaphore(self.startup_parallelism)
+        else:
+            self.startup_slots = None
 
-            self.worker_popen_map[worker] = popen_obj
+        # seconds from the start of the bouncer until every worker was ready (or None)
+        self.time_to_fully_ready = None
+
+        # workers that could not be launched in START_ATTEMPTS attempts. They are
+        # not running, so time_to_fully_ready stays None
+        self.failed_workers = set()
+
+        # True once startWorkers has launched every worker, and once additionally all
+        # of them have released their startup slots
+        self.startup_launched = False
+        self.startup_finished = False
 
-            # Launch the WorkerMonitor thread for this worker
-            WorkerMonitor(popen_obj, self.bouncerAddr, worker, self.logger).start()
+        # Launch the workers in the background, so that the Thrift server (which
+        # receives the workerTerminated messages needed to restart workers that
+        # crash during startup) can start right away
+        startup_thread = threading.Thread(target=self.startWorkers)
+        startup_thread.daemon = True
+        startup_thread.start()
+
+        if self.recycle != None:
+            MemoryRecycler(self, self.recycle).start()
+
+        if self.autoscale != None:
+            Autoscaler(self, self.autoscale).start()
 
     def start_worker(self, addr, port):
         '''Must attempt to launch the specified worker. Should return the popen object for the new worker
@@ -166,10 +490,228 @@ class BouncerProcessManager(object):
         '''Must attempt to kill the specified worker. Does not return anything'''
         pass
 
+    def worker_partition(self, addr, port):
+        '''Returns (cpus, nice) for the worker at addr:port, according to the bouncer's
+        cpu options. Either may be None, meaning unchanged.'''
+        if self.cpu == None:
+            return None, None
+        cpus = self.cpu["worker_cpus"]
+        if cpus != None and self.cpu["pin_each"]:
+            index = self.worker_positions[format_worker(addr, port)]
+            cpus = [cpus[index % len(cpus)]]
+        return cpus, self.cpu["nice"]
+
+    def worker_preexec(self, addr, port):
+        '''Returns a function for the preexec_fn argument of subprocess.Popen that
+        applies the bouncer's cpu options to the worker at addr:port (or None if
+        there are no cpu options)'''
+        if self.cpu == None:
+            return None
+        cpus, nice = self.worker_partition(addr, port)
+        return lambda: cpu_affinity.partition(cpus, nice)
+
+    def extra_histograms(self):
+        '''May be overridden to export application-specific statistics through the
+        stats() RPC. Should return a dict that maps names to
+        worker_stats.BucketHistogram objects.'''
+        return {}
+
+    def remove_socket(self, addr, port):
+        '''Removes the socket file of a Unix socket worker, so that the next instance
+        can bind it (and nginx gets "connection refused" instead of a hang)'''
+        if addr != UNIX_ADDR:
+            return
+        try:
+            if stat.S_ISSOCK(os.lstat(port).st_mode):
+                os.unlink(port)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                self.logger.error("Could not remove socket file %s: %s", port, e)
+
+    def launch_worker(self, worker, addr, port, restart=False):
+        '''Starts the worker (via start_worker) along with its WorkerMonitor and
+        ReadinessProbe threads. restart should be True iff the worker is being
+        relaunched after it terminated. Returns the popen object for the new worker
+        or None.'''
+        self.remove_socket(addr, port)
+        popen_obj = self.start_worker(addr, port)
+        if popen_obj != None and self.cpu != None:
+            cpus, nice = self.worker_partition(addr, port)
+            try:
+                cpu_affinity.partition_process(cpus, nice, popen_obj.pid, children=True)
+            except OSError, e:
+                self.logger.error("Could not set cpus=%s nice=%s for worker '%s': %s", cpus, nice,
+                    worker, e)
+        with self.lock:
+            self.worker_popen_map[worker] = popen_obj
+            self.worker_ready_map[worker] = False
+            self.worker_time_to_ready[worker] = None
+            counters = self.worker_counters[worker]
+            if popen_obj != None:
+                counters.launched(time.time(), restart)
+                if self.crash_streak.get(worker, 0) >= CRASH_LOOP_EXITS:
+                    self.publish(worker, scoreboard.CRASH_LOOPING)
+                else:
+                    self.publish(worker, scoreboard.STARTING)
+            else:
+                counters.start_failed()
+                self.publish(worker, scoreboard.EXITED)
+        if popen_obj != None:
+            WorkerMonitor(popen_obj, self.bouncerAddr, worker, self.logger, self.workerExited,
+                self.rpc["mode"]).start()
+            ReadinessProbe(self, worker, popen_obj).start()
+        return popen_obj
+
+    def publish(self, worker, state):
+        '''Writes the state of worker to the scoreboard. Must be called with self.lock held'''
+        if self.scoreboard == None:
+            return
+        popen_obj = self.worker_popen_map.get(worker)
+        counters = self.worker_counters[worker]
+        try:
+            self.scoreboard.update(worker, state,
+                pid = popen_obj.pid if popen_obj != None else -1,
+                restarts = counters.restarts,
+                kills = counters.kills + counters.recycles,
+                start_time = counters.start_time or 0.0,
+                last_kill_time = counters.kill_time or 0.0)
+        except scoreboard.ScoreboardError, e:
+            self.logger.error("Could not publish state of worker '%s': %s", worker, e)
+
+    def startWorkers(self):
+        '''Launches every worker, with at most startup_parallelism workers starting
+        up at the same time'''
+        for worker in self.workers:
+            addr, port = BouncerProcessManager.parse_worker(worker)
+            if self.startup_slots != None:
+                self.startup_slots.acquire()
+            with self.lock:
+                self.startup_pending.add(worker)
+            self.logger.info("Starting worker: %s" % worker)
+            popen_obj = self.launch_worker(worker, addr, port)
+            if popen_obj == None:
+                self.logger.error("Could not start worker '%s'; retrying", worker)
+                # retrying does not need a startup slot
+                self.startupDone(worker)
+                retry_thread = threading.Thread(target=self.retryStart, args=(worker, addr, port))
+                retry_thread.daemon = True
+                retry_thread.start()
+        with self.lock:
+            self.startup_finished = len(self.startup_pending) == 0
+            self.startup_launched = True
+
+    def retryStart(self, worker, addr, port):
+        '''Relaunches worker, whose first launch failed, with exponential backoff (see
+        START_ATTEMPTS). Adds it to failed_workers if every attempt fails'''
+        delay = START_RETRY_DELAY
+        for attempt in xrange(2, START_ATTEMPTS + 1):
+            time.sleep(delay)
+            delay *= 2
+            with self.lock:
+                if worker not in self.workers:
+                    return
+            if self.launch_worker(worker, addr, port) != None:
+                self.logger.info("Started worker '%s' on attempt %d", worker, attempt)
+                return
+            self.logger.error("Could not start worker '%s' (attempt %d of %d)", worker, attempt,
+                START_ATTEMPTS)
+        with self.lock:
+            if worker not in self.workers:
+                return
+            self.failed_workers.add(worker)
+        self.logger.critical("Giving up on starting worker '%s' after %d attempts", worker, START_ATTEMPTS)
+
+    def startupDone(self, worker):
+        '''Releases the startup slot held by worker, if any'''
+        with self.lock:
+            if worker not in self.startup_pending:
+                return
+            self.startup_pending.remove(worker)
+            if len(self.startup_pending) == 0 and self.startup_launched:
+                self.startup_finished = True
+        if self.startup_slots != None:
+            self.startup_slots.release()
+
+    def workerExited(self, worker, popen_obj):
+        '''Called by WorkerMonitor (in its own thread) as soon as popen_obj terminates'''
+        with self.lock:
+            if self.worker_popen_map.get(worker) is popen_obj:
+                now = time.time()
+                counters = self.worker_counters[worker]
+                if counters.kill_time == None and counters.start_time != None and \
+                        now - counters.start_time < CRASH_LOOP_LIFETIME:
+                    self.crash_streak[worker] = self.crash_streak.get(worker, 0) + 1
+                else:
+                    self.crash_streak[worker] = 0
+                self.worker_ready_map[worker] = False
+                counters.exited(now)
+                if worker not in self.retired:
+                    self.publish(worker, scoreboard.EXITED)
+                # the replacement is launched later (by workerTerminated), so the
+                # socket file still belongs to popen_obj
+                addr, port = BouncerProcessManager.parse_worker(worker)
+                self.remove_socket(addr, port)
+
+    def workerReady(self, worker, popen_obj, elapsed):
+        '''Called by ReadinessProbe once popen_obj (an instance of worker) passes its
+        readiness probe, elapsed seconds after it was launched.'''
+        with self.lock:
+            if self.worker_popen_map.get(worker) is not popen_obj:
+                # this instance of the worker has already been replaced
+                return
+            self.worker_ready_map[worker] = True
+            self.worker_time_to_ready[worker] = elapsed
+            self.worker_counters[worker].ready(time.time())
+            self.publish(worker, scoreboard.READY)
+            fully_ready = self.time_to_fully_ready == None and \
+                all([self.worker_ready_map.get(w, False) for w in self.workers])
+            if fully_ready:
+                self.time_to_fully_ready = time.time() - self.start_time
+        self.logger.info("Worker '%s' is ready (time to ready = %fs)", worker, elapsed)
+        self.startupDone(worker)
+        if fully_ready:
+            self.logger.info("All %d workers are ready (time to fully ready = %fs)", len(self.workers),
+                self.time_to_fully_ready)
+
+    def workerNotReady(self, worker, popen_obj):
+        '''Called by ReadinessProbe if popen_obj (an instance of worker) exits or times
+        out before passing its readiness probe.'''
+        with self.lock:
+            if self.worker_popen_map.get(worker) is not popen_obj:
+                return
+            self.worker_counters[worker].start_failed()
+        # the restart does not need a startup slot
+        self.startupDone(worker)
+        if popen_obj.poll() != None:
+            # The WorkerMonitor for this worker will restart it
+            self.logger.error("Worker '%s' terminated before it became ready", worker)
+            return
+        self.logger.error("Worker '%s' did not become ready within %fs; killing it", worker,
+            self.readiness["timeout"])
+        with self.lock:
+            self.publish(worker, scoreboard.KILLING)
+        addr, port = BouncerProcessManager.parse_worker(worker)
+        self.kill_worker(addr, port, popen_obj)
+
+    def trim_alert_times(self, now):
+        '''Forgets the alert times older than the autoscale window. Must be called
+        with self.alert_times_lock held'''
+        while len(self.alert_times) > 0 and self.alert_times[0] < now - self.autoscale["window"]:
+            self.alert_times.popleft()
+
     def alert(self, alert_message):
         self.logger.info("Received alert '%s'" % alert_message)
+        self.last_alert_time = time.time()
+        if self.autoscale != None:
+            with self.alert_times_lock:
+                self.alert_times.append(self.last_alert_time)
+                # Autoscaler.alert_rate trims too, but it only runs every period
+                self.trim_alert_times(self.last_alert_time)
         worker = alert_message
 
+        if worker in self.retired:
+            self.logger.info("Ignoring alert for retired worker '%s'", worker)
+            return
         if worker not in self.workers:
             self.logger.critical("This bouncer is not configured to restart worker '%s'", worker)
             return
@@ -183,27 +725,154 @@ class BouncerProcessManager(object):
             self.logger.error("Worker '%s' does not seem to be running (it's not in worker_popen_map)", worker)
             return
 
-        popen_obj = self.worker_popen_map[worker]
+        with self.lock:
+            popen_obj = self.worker_popen_map[worker]
+            ready = self.worker_ready_map[worker]
         if popen_obj == None:
             self.logger.error("Worker '%s' does not seem to be running (its popen_obj == None)", worker)
             return
 
+        if not ready:
+            # The worker is still starting up, so it cannot be the cause of the overload
+            self.logger.warning("Ignoring alert for worker '%s' because it is not ready yet", worker)
+            return
+
         self.logger.info("Killing worker '%s'" % worker)
+        with self.lock:
+            self.worker_counters[worker].killed(time.time())
+            self.publish(worker, scoreboard.KILLING)
         self.kill_worker(addr, port, popen_obj)
 
         # No need to start worker manually; the WorkerMonitor thread for that worker
         # will detect that the worker was killed and will call workerTerminated, which
         # will then restart the worker
 
+    def recycleWorker(self, worker, popen_obj):
+        '''Called by MemoryRecycler. Kills popen_obj (an instance of worker) so that it
+        gets restarted, unless it has been replaced or is not ready. Returns True iff
+        the worker was killed.'''
+        with self.lock:
+            if self.worker_popen_map.get(worker) is not popen_obj or not self.worker_ready_map[worker]:
+                return False
+            self.worker_counters[worker].recycled(time.time())
+            self.publish(worker, scoreboard.KILLING)
+        addr, port = BouncerProcessManager.parse_worker(worker)
+        self.kill_worker(addr, port, popen_obj)
+        return True
+
+    def addWorker(self, worker):
+        '''Called by Autoscaler. Adds worker to the set of workers and launches it'''
+        addr, port = BouncerProcessManager.parse_worker(worker)
+        with self.lock:
+            self.workers = self.workers + [worker]
+            self.workersChanged = True
+            if worker not in self.worker_counters:
+                self.worker_counters[worker] = worker_stats.WorkerCounters()
+        popen_obj = self.launch_worker(worker, addr, port)
+        if popen_obj == None:
+            self.logger.error("Could not start new worker '%s'", worker)
+
+    def retireWorker(self, worker):
+        '''Called by Autoscaler. Removes worker from the set of workers and kills it
+        (it is not restarted)'''
+        addr, port = BouncerProcessManager.parse_worker(worker)
+        with self.lock:
+            self.workers = [w for w in self.workers if w != worker]
+            self.workersChanged = True
+            popen_obj = self.worker_popen_map.get(worker)
+            if popen_obj != None:
+                # forgotten once its WorkerMonitor reports that it terminated
+                self.retired.add(worker)
+                self.publish(worker, scoreboard.RETIRING)
+        if popen_obj == None:
+            self.forgetWorker(worker)
+        elif popen_obj.poll() == None:
+            self.kill_worker(addr, port, popen_obj)
+
+    def forgetWorker(self, worker):
+        '''Drops the state of a retired worker'''
+        with self.lock:
+            self.retired.discard(worker)
+            self.failed_workers.discard(worker)
+            self.crash_streak.pop(worker, None)
+            if self.scoreboard != None:
+                self.scoreboard.remove(worker)
+            for worker_dict in [self.worker_popen_map, self.worker_ready_map, self.worker_time_to_ready]:
+                worker_dict.pop(worker, None)
+
+    def alertBatch(self, alert_messages):
+        self.logger.info("Received batch of %d alerts: %s", len(alert_messages), alert_messages)
+
+        # Duplicates are possible if nginx alerted twice for the same worker within
+        # the alert_router's batching window. Kill each worker once.
+        workers = []
+        for worker in alert_messages:
+            if worker not in workers:
+                workers.append(worker)
+
+        # kill_worker may block (e.g. while waiting for the worker to die), so kill
+        # every worker in its own thread. Restarts happen in parallel too, since
+        # each worker has its own WorkerMonitor.
+        threads = [threading.Thread(target=self.alert, args=(worker,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
     def heartbeat(self):
 
-        if self.receivedFirstHeartbeat:
-            self.logger.debug("Received heartbeat")
-            return []
-        else:
+        with self.lock:
+            workersChanged = self.workersChanged
+            self.workersChanged = False
+        if not self.receivedFirstHeartbeat:
             self.logger.info("Received first heartbeat")
             self.receivedFirstHeartbeat = True
             return self.workers
+        elif workersChanged:
+            self.logger.info("Received heartbeat; reporting new set of workers %s", self.workers)
+            return self.workers
+        else:
+            self.logger.debug("Received heartbeat")
+            return []
+
+    @staticmethod
+    def histogram(bucket_histogram):
+        '''Converts a worker_stats.BucketHistogram into a thrift Histogram'''
+        return Histogram(
+            bounds = list(bucket_histogram.bounds),
+            counts = list(bucket_histogram.counts),
+            total = bucket_histogram.total)
+
+    def stats(self):
+        self.logger.debug("Received stats request")
+        statuses = []
+        now = time.time()
+        with self.lock:
+            for worker in self.workers:
+                popen_obj = self.worker_popen_map.get(worker)
+                time_to_ready = self.worker_time_to_ready.get(worker)
+                counters = self.worker_counters[worker]
+                statuses.append(WorkerStatus(
+                    worker = worker,
+                    ready = self.worker_ready_map.get(worker, False),
+                    pid = popen_obj.pid if popen_obj != None else -1,
+                    time_to_ready = time_to_ready if time_to_ready != None else -1.0,
+                    kills = counters.kills,
+                    recycles = counters.recycles,
+                    restarts = counters.restarts,
+                    failed_starts = counters.failed_starts,
+                    uptime = counters.uptime(now),
+                    kill_latency = BouncerProcessManager.histogram(counters.kill_latency),
+                    exit_to_ready = BouncerProcessManager.histogram(counters.exit_to_ready),
+                    lifetime = BouncerProcessManager.histogram(counters.lifetime)))
+            time_to_fully_ready = self.time_to_fully_ready
+            failed_workers = sorted(self.failed_workers)
+        histograms = dict((name, BouncerProcessManager.histogram(histogram))
+            for name, histogram in self.extra_histograms().items())
+        return BouncerStats(workers = statuses, uptime = now - self.start_time,
+            histograms = histograms,
+            time_to_fully_ready = time_to_fully_ready if time_to_fully_ready != None else -1.0,
+            failed_workers = failed_workers)
 
     def workerTerminated(self, worker):
         self.logger.info("Received workerCrashed(%s) message" % worker)
@@ -212,24 +881,25 @@ class BouncerProcessManager(object):
         except ValueError, e:
             self.logger.error("Could not handle message because worker '%s' is malformed" % worker)
             return
+        if worker in self.retired:
+            self.logger.info("Retired worker '%s' has terminated", worker)
+            self.forgetWorker(worker)
+            return
+        if worker not in self.workers:
+            self.logger.error("This bouncer is not configured to restart worker '%s'", worker)
+            return
         self.logger.debug("Trying to start the worker")
-        popen_obj = self.start_worker(addr, port)
-        self.worker_popen_map[worker] = popen_obj
-        if popen_obj != None:
-            # Launch the WorkerMonitor thread for this worker
-            WorkerMonitor(popen_obj, self.bouncerAddr, worker, self.logger).start()
-        else:
+        popen_obj = self.launch_worker(worker, addr, port, restart=True)
+        if popen_obj == None:
             self.logger.error("Could not start the worker")
 
     def run(self):
         processor = BouncerService.Processor(self)
-        transport = TSocket.TServerSocket(port=self.bouncerAddr.port)
-        tfactory = TTransport.TBufferedTransportFactory()
-        pfactory = TBinaryProtocol.TBinaryProtocolFactory()
-
-        server = TServer.TThreadPoolServer(processor, transport, tfactory, pfactory)
+        server = rpc.make_server(processor, self.bouncerAddr.port, self.rpc["mode"],
+            self.rpc["concurrency"])
 
-        self.logger.info("Starting Bouncer process manager on port %d" % self.bouncerAddr.port)
+        self.logger.info("Starting Bouncer process manager on port %d (rpc mode = %s, concurrency = %d)",
+            self.bouncerAddr.port, self.rpc["mode"], self.rpc["concurrency"])
         server.serve()
         self.logger.info("finished")
 
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== bouncer_stats.py ====
+#
+# Polls the stats() RPC of every bouncer in the config file and prints one
+# row per worker, one aggregate row per bouncer, and a grand total.
+# Application-specific histograms (e.g. php_bouncer's sql_cleanup_latency) are
+# printed below the aggregate row of their bouncer.
+#
+# Latency columns show the median and 99th percentile of the fixed-bucket
+# histograms kept by each bouncer (see worker_stats.py), so they are upper
+# bounds of the corresponding bucket rather than exact values.
+#
+# USAGE: ./bouncer_stats.py -c bouncer_config.json [--period 5]
+#
+
+import sys
+import os
+import argparse
+import time
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(DIRNAME, 'gen-py'))
+sys.path.append(os.path.join(DIRNAME, '..', 'common'))
+
+import import_thrift_lib
+import rpc
+
+from BouncerService import BouncerService
+from BouncerService.ttypes import *
+
+from thrift import Thrift
+
+from bouncer_common import *
+from worker_stats import BucketHistogram
+
+ROW_FORMAT = "%-22s %-22s %5s %7s %9s %6s %7s %8s %6s %17s %17s"
+HEADER = ROW_FORMAT % ("bouncer", "worker", "ready", "pid", "uptime", "kills", "recycle",
+    "restarts", "failed", "kill->exit p50/99", "exit->ready p50/99")
+
+def get_stats(bouncer, rpc_mode):
+    '''Returns the BouncerStats for bouncer (a BouncerAddress) or raises Thrift.TException.
+    rpc_mode is the bouncer's Thrift server mode (see rpc.py)'''
+    client, transport = rpc.make_client(BouncerService.Client, bouncer.addr, bouncer.port, rpc_mode)
+    transport.open()
+    try:
+        return client.stats()
+    finally:
+        transport.close()
+
+def bucket_histogram(histogram):
+    '''Converts a thrift Histogram into a worker_stats.BucketHistogram'''
+    return BucketHistogram(histogram.bounds, histogram.counts, histogram.total)
+
+def format_seconds(value):
+    if value == None:
+        return "-"
+    if value == float("inf"):
+        return "inf"
+    if value < 1.0:
+        return "%dms" % int(round(value * 1000))
+    return "%.1fs" % value
+
+def format_quantiles(histogram):
+    return "%s/%s" % (format_seconds(histogram.quantile(0.5)), format_seconds(histogram.quantile(0.99)))
+
+class Aggregate:
+    '''Sums WorkerStatus rows'''
+
+    def __init__(self):
+        self.num_workers = 0
+        self.num_ready = 0
+        self.kills = 0
+        self.recycles = 0
+        self.restarts = 0
+        self.failed_starts = 0
+        self.kill_latency = None
+        self.exit_to_ready = None
+
+    def add(self, status):
+        self.num_workers += 1
+        if status.ready:
+            self.num_ready += 1
+        self.kills += status.kills
+        self.recycles += status.recycles
+        self.restarts += status.restarts
+        self.failed_starts += status.failed_starts
+        kill_latency = bucket_histogram(status.kill_latency)
+        exit_to_ready = bucket_histogram(status.exit_to_ready)
+        if self.kill_latency == None:
+            self.kill_latency = kill_latency
+            self.exit_to_ready = exit_to_ready
+        else:
+            self.kill_latency.merge(kill_latency)
+            self.exit_to_ready.merge(exit_to_ready)
+
+    def merge(self, other):
+        self.num_workers += other.num_workers
+        self.num_ready += other.num_ready
+        self.kills += other.kills
+        self.recycles += other.recycles
+        self.restarts += other.restarts
+        self.failed_starts += other.failed_starts
+        if other.kill_latency == None:
+            return
+        if self.kill_latency == None:
+            self.kill_latency = BucketHistogram(other.kill_latency.bounds)
+            self.exit_to_ready = BucketHistogram(other.exit_to_ready.bounds)
+        self.kill_latency.merge(other.kill_latency)
+        self.exit_to_ready.merge(other.exit_to_ready)
+
+    def row(self, bouncer, label):
+        if self.kill_latency == None:
+            kill_latency, exit_to_ready = "-", "-"
+        else:
+            kill_latency = format_quantiles(self.kill_latency)
+            exit_to_ready = format_quantiles(self.exit_to_ready)
+        return ROW_FORMAT % (bouncer, label, "%d/%d" % (self.num_ready, self.num_workers), "", "",
+            self.kills, self.recycles, self.restarts, self.failed_starts, kill_latency, exit_to_ready)
+
+def print_table(config):
+    print HEADER
+    total = Aggregate()
+    for bouncer in config.bouncer_list:
+        try:
+            stats = get_stats(bouncer, config.bouncer_options[str(bouncer)]["rpc"]["mode"])
+        except Thrift.TException, e:
+            print ROW_FORMAT % (bouncer, "unreachable: %s" % e, "", "", "", "", "", "", "", "", "")
+            continue
+        aggregate = Aggregate()
+        for status in stats.workers:
+            aggregate.add(status)
+            print ROW_FORMAT % (bouncer, status.worker, "yes" if status.ready else "no",
+                status.pid, format_seconds(status.uptime), status.kills, status.recycles,
+                status.restarts, status.failed_starts,
+                format_quantiles(bucket_histogram(status.kill_latency)),
+                format_quantiles(bucket_histogram(status.exit_to_ready)))
+        print aggregate.row(bouncer, "(all workers)")
+        if stats.time_to_fully_ready >= 0.0:
+            print "%-22s %-22s %s" % (bouncer, "time to fully ready", format_seconds(stats.time_to_fully_ready))
+        if stats.failed_workers:
+            print "%-22s %-22s %s" % (bouncer, "could not start", " ".join(stats.failed_workers))
+        for name, histogram in sorted((stats.histograms or {}).items()):
+            histogram = bucket_histogram(histogram)
+            print "%-22s %-22s n=%d p50/99=%s" % (bouncer, name, histogram.num(),
+                format_quantiles(histogram))
+        total.merge(aggregate)
+    print total.row("TOTAL", "")
+
+if __name__ == "__main__":
+
+    cwd = os.getcwd()
+
+    default_config = os.path.join(cwd, "bouncer_config.json")
+
+    parser = argparse.ArgumentParser(description='Prints statistics from every bouncer in the config')
+    parser.add_argument("-c", "--config", type=str, default=default_config,
+                        help="Default=%(default)s. The config file. See bouncer/bouncer_common.py for config-file format.")
+    parser.add_argument("-p", "--period", type=float, default=0.0,
+                        help="Default=%(default)s. If > 0, then poll every PERIOD seconds (otherwise poll once).")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = Config(f)
+
+    while True:
+        print_table(config)
+        if args.period <= 0.0:
+            break
+        print
+        time.sleep(args.period)
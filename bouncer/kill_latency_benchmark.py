@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== kill_latency_benchmark.py ====
+#
+# Measures how quickly a bouncer-like control loop can react while every
+# worker is spinning in an infinite loop (like the trainer's dummy_vuln.php
+# under attack), with and without cpu partitioning (see "control_cpus" and
+# "cpu" in bouncer_common.py).
+#
+# Runs SPINNERS busy-looping python processes ("workers"). The control loop
+# repeatedly sleeps for a short random time (waiting for an "alert"), then
+# kills a spinner, waits for it to exit, and starts a replacement. It reports:
+#   - wakeup_delay: how late the control loop woke up from its sleep, i.e.
+#     how long it waited for a cpu
+#   - kill_to_exit: time from kill() until wait() returned
+#   - alert_to_restart: wakeup_delay + kill + wait + starting the replacement
+#
+# Modes:
+#   shared      -- control loop and spinners share all cpus at the same nice value
+#   niced       -- as shared, but spinners run at nice NICE
+#   partitioned -- control loop pinned to CONTROL_CPUS, spinners pinned to the
+#                  remaining cpus at nice NICE
+#
+# Does not need nginx, thrift or a bouncer. The partitioned mode needs at
+# least 2 cpus.
+#
+# USAGE: ./kill_latency_benchmark.py [--spinners 8] [--kills 100] [--control-cpus 0] [--nice 10]
+#
+
+import sys
+import os
+import argparse
+import json
+import random
+import subprocess
+import time
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(DIRNAME, '..', 'common'))
+
+import cpu_affinity
+
+SPIN_CMD = [sys.executable, "-c", "while True: pass"]
+
+def summarize(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return {}
+    return {
+        "num" : len(values),
+        "median" : values[len(values) / 2],
+        "p99" : values[min(len(values) - 1, int(len(values) * 0.99))],
+        "max" : values[-1],
+        "mean" : sum(values) / len(values),
+    }
+
+def benchmark(num_spinners, kills, worker_cpus, nice, min_sleep, max_sleep):
+    '''Runs the control loop in the calling process. worker_cpus and nice may be None'''
+    preexec = lambda: cpu_affinity.partition(worker_cpus, nice)
+    spinners = [subprocess.Popen(SPIN_CMD, preexec_fn=preexec) for i in range(num_spinners)]
+
+    # let the spinners get going
+    time.sleep(1.0)
+
+    wakeup_delay = []
+    kill_to_exit = []
+    alert_to_restart = []
+    try:
+        for i in xrange(kills):
+            sleep = random.uniform(min_sleep, max_sleep)
+            start = time.time()
+            time.sleep(sleep)
+            alert = time.time()
+            wakeup_delay.append(alert - start - sleep)
+
+            index = i % len(spinners)
+            killed = time.time()
+            spinners[index].kill()
+            spinners[index].wait()
+            kill_to_exit.append(time.time() - killed)
+            spinners[index] = subprocess.Popen(SPIN_CMD, preexec_fn=preexec)
+            alert_to_restart.append(time.time() - start - sleep)
+    finally:
+        for spinner in spinners:
+            spinner.kill()
+            spinner.wait()
+
+    return {
+        "wakeup_delay" : summarize(wakeup_delay),
+        "kill_to_exit" : summarize(kill_to_exit),
+        "alert_to_restart" : summarize(alert_to_restart),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measures kill latency while all workers spin, with and without cpu partitioning')
+    parser.add_argument("-s", "--spinners", type=int, default=2 * cpu_affinity.cpu_count(),
+                        help="Default=%(default)d. Number of spinning workers")
+    parser.add_argument("-k", "--kills", type=int, default=100,
+                        help="Default=%(default)d. Number of kill/restart cycles per mode")
+    parser.add_argument("-c", "--control-cpus", type=str, default="0",
+                        help="Default=%(default)s. Comma separated list of cpus for the control loop in partitioned mode")
+    parser.add_argument("-n", "--nice", type=int, default=10,
+                        help="Default=%(default)d. Nice value for spinners in the niced and partitioned modes")
+    parser.add_argument("--min-sleep", type=float, default=0.01,
+                        help="Default=%(default)s. Minimum number of seconds between kills")
+    parser.add_argument("--max-sleep", type=float, default=0.05,
+                        help="Default=%(default)s. Maximum number of seconds between kills")
+    args = parser.parse_args()
+
+    all_cpus = cpu_affinity.get_affinity(0)
+    control_cpus = [int(cpu) for cpu in args.control_cpus.split(",")]
+    worker_cpus = [cpu for cpu in all_cpus if cpu not in control_cpus]
+
+    results = {
+        "cpus" : all_cpus,
+        "spinners" : args.spinners,
+    }
+    results["shared"] = benchmark(args.spinners, args.kills, None, None,
+        args.min_sleep, args.max_sleep)
+    results["niced"] = benchmark(args.spinners, args.kills, None, args.nice,
+        args.min_sleep, args.max_sleep)
+    results["niced"]["nice"] = args.nice
+
+    if len(worker_cpus) == 0:
+        sys.stderr.write("Skipping partitioned mode: no cpus left for workers\n")
+    else:
+        cpu_affinity.set_affinity(0, control_cpus)
+        results["partitioned"] = benchmark(args.spinners, args.kills, worker_cpus, args.nice,
+            args.min_sleep, args.max_sleep)
+        results["partitioned"]["control_cpus"] = control_cpus
+        results["partitioned"]["worker_cpus"] = worker_cpus
+        results["partitioned"]["nice"] = args.nice
+        cpu_affinity.set_affinity(0, all_cpus)
+
+    print json.dumps(results, indent=4, sort_keys=True)
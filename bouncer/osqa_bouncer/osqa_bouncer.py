@@ -35,26 +35,54 @@ import log
 import env
 import bouncer_process_manager
 from bouncer_process_manager import BouncerProcessManager
+from bouncer_common import BouncerAddress, UNIX_ADDR, format_worker
+import zygote
 
 osqa_deps = os.path.join(DIRNAME, "..", "..", "apps", "osqa_app", "env.sh")
 var = env.env(osqa_deps)
 
 INSTALL_OSQA_PATH = var["INSTALL_OSQA_PATH"]
 
-OSQA_CMD_TEMPLATE_STR = 'python %s/manage.py run_gunicorn 0.0.0.0:$port' % INSTALL_OSQA_PATH
+OSQA_CMD_TEMPLATE_STR = 'python %s/manage.py run_gunicorn $bind' % INSTALL_OSQA_PATH
 
 class BouncerForOsqa(BouncerProcessManager):
 
+    def __init__(self, config, addr, port, logger):
+        # In zygote mode, the OSQA Django project is imported once by the zygote,
+        # and every worker is forked from it (see bouncer/zygote.py). The forked
+        # workers serve HTTP with gunicorn, like the workers that run_gunicorn launches.
+        self.zygote = None
+        options = config.bouncer_options.get(str(BouncerAddress(addr, port)), {})
+        if options.get("zygote", False):
+            logger.info("Launching zygote for %s", INSTALL_OSQA_PATH)
+            self.zygote = zygote.Zygote.launch(
+                ["--django-path", INSTALL_OSQA_PATH, "--django-settings", "settings"],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            log.FileLoggerThread(logger, "osqa zygote stdout", logging.INFO, self.zygote.popen_obj.stdout).start()
+            log.FileLoggerThread(logger, "osqa zygote stderr", logging.ERROR, self.zygote.popen_obj.stderr).start()
+        super(BouncerForOsqa, self).__init__(config, addr, port, logger)
+
     def start_worker(self, addr, port):
         '''Must attempt to launch the specified worker. Should return the popen object for the new worker
            or None, if the worker couldn't be be launched for some reason.'''
+        if self.zygote != None:
+            try:
+                return self.zygote.spawn(addr if addr == UNIX_ADDR else "0.0.0.0", port)
+            except zygote.ZygoteError, e:
+                self.logger.error("Could not spawn worker from zygote: %s", e)
+                return None
+        # gunicorn binds Unix sockets given as unix:/path/to/sock
+        if addr == UNIX_ADDR:
+            bind = format_worker(addr, port)
+        else:
+            bind = "0.0.0.0:%d" % port
         cmd_str = Template(OSQA_CMD_TEMPLATE_STR).substitute( \
-                addr = addr, \
-                port = str(port) \
+                bind = bind \
             )
         self.logger.debug("cmd_str='%s'" % cmd_str)
         cmd = cmd_str.split()
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            preexec_fn=self.worker_preexec(addr, port))
         stdoutLogger = log.FileLoggerThread(self.logger, "osqa stdout", logging.INFO, process.stdout)
         stderrLogger = log.FileLoggerThread(self.logger, "osqa stderr", logging.ERROR, process.stderr)
         stdoutLogger.start()
@@ -66,7 +94,7 @@ class BouncerForOsqa(BouncerProcessManager):
         try:
             popen_obj.kill()
         except OSError, e:
-            self.logger.error("Error while trying to kill '%s:%d': %s" % (addr, port, e))
+            self.logger.error("Error while trying to kill '%s': %s" % (format_worker(addr, port), e))
 
 bouncer_process_manager.main(BouncerForOsqa)
 
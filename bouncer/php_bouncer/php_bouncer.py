@@ -18,13 +18,42 @@
 #
 # See ../bouncer/bouncer_process_manager.py for more information
 #
+# Killing a php-cgi worker does not stop the MySQL queries it started, so after
+# every kill the bouncer also kills all queries belonging to that worker's MySQL
+# user (user<port>). This cleanup is handed off to a small pool of persistent
+# SqlKiller threads, each holding its own admin connection to MySQL, so that
+# kill_worker (and therefore the restart of the worker) never waits on MySQL.
+# Cleanup latency (from kill to the last KILL statement) is exported through the
+# stats() RPC as the "sql_cleanup_latency" histogram.
+#
+# If the MySQLdb module is not installed, the SqlKillers fall back to running
+# "php kill_sql.php" (slow, but still off the kill path).
+#
+# NOTE: cleanup runs concurrently with the worker's restart, so in principle it
+# can also kill the first queries of the replacement worker (which connects as
+# the same MySQL user). That window existed before as well; cleanup is usually
+# far faster than php-cgi startup.
+#
+# For Unix socket workers (unix:/path/to/sock) the MySQL user is user<N>, where
+# N is the number in the socket's file name (e.g. /var/run/php/php9001.sock
+# uses user9001). Workers whose socket name has no number get no MySQL user of
+# their own, and their queries are not cleaned up.
+#
 
 import sys
 import os
 import subprocess
 import time
+import re
 from string import Template
 import logging
+import threading
+import Queue
+
+try:
+    import MySQLdb
+except ImportError:
+    MySQLdb = None
 
 DIRNAME = os.path.dirname(os.path.realpath(__file__))
 
@@ -35,6 +64,8 @@ import log
 import env
 import bouncer_process_manager
 from bouncer_process_manager import BouncerProcessManager
+from bouncer_common import UNIX_ADDR, format_worker
+import worker_stats
 
 dependencies = os.path.join(DIRNAME, "..", "..", "dependencies", "env.sh")
 
@@ -42,21 +73,128 @@ var = env.env(dependencies)
 
 PHP_CGI_VULN_BIN = var["PHP_CGI_VULN_BIN"]
 KILL_SQL_PHP = os.path.join(DIRNAME, "kill_sql.php")
-PHP_FCGI_CMD_TEMPLATE_STR = '%s -b $addr:$port' % PHP_CGI_VULN_BIN
+PHP_FCGI_CMD_TEMPLATE_STR = '%s -b $bind' % PHP_CGI_VULN_BIN
+MYSQL_ADMIN_USER = var.get("MYSQL_ADMIN_USER", "root")
+MYSQL_ADMIN_PASSWORD = var.get("MYSQL_ADMIN_PASSWORD", "")
+
+# number of SqlKiller threads (i.e. concurrent admin connections to MySQL)
+SQL_KILLER_THREADS = 2
+
+def mysql_user(addr, port):
+    '''Returns the MySQL user of the worker at addr:port, or None'''
+    if addr != UNIX_ADDR:
+        return "user%d" % port
+    match = re.search(r"(\d+)[^/\d]*$", port)
+    if match == None:
+        return None
+    return "user%s" % match.group(1)
+
+class SqlKiller(threading.Thread):
+    '''A persistent helper thread that kills the MySQL queries of killed workers.
+    Reads (mysql_user, kill_time) pairs from queue, kills every query of
+    mysql_user, and records the time since kill_time in latency (a
+    worker_stats.BucketHistogram, protected by lock).'''
+
+    def __init__(self, queue, latency, lock, logger):
+        self.queue = queue
+        self.latency = latency
+        self.lock = lock
+        self.logger = logger
+        self.conn = None
+        super(SqlKiller, self).__init__()
+        self.daemon = True
+
+    def connect(self):
+        if self.conn == None:
+            self.conn = MySQLdb.connect(user = MYSQL_ADMIN_USER, passwd = MYSQL_ADMIN_PASSWORD)
+            self.conn.autocommit(True)
+        return self.conn
+
+    def kill_queries_mysqldb(self, mysql_user):
+        '''Kills the queries of mysql_user over the persistent connection. Reconnects
+        (once) if the connection has gone away.'''
+        for attempt in range(2):
+            try:
+                cursor = self.connect().cursor()
+                try:
+                    cursor.execute("SELECT ID FROM information_schema.PROCESSLIST WHERE USER = %s",
+                        (mysql_user,))
+                    for (query_id,) in cursor.fetchall():
+                        try:
+                            cursor.execute("KILL %d" % int(query_id))
+                        except MySQLdb.OperationalError:
+                            # the query finished in the meantime
+                            pass
+                finally:
+                    cursor.close()
+                return
+            except MySQLdb.Error, e:
+                self.logger.warning("MySQL error while killing queries of %s: %s" % (mysql_user, e))
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+                self.conn = None
+
+    def kill_queries_php(self, mysql_user):
+        cmd = ["php", KILL_SQL_PHP]
+        environ = dict(os.environ.items() + [("MYSQL_USER", mysql_user)])
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env = environ)
+        stdout, stderr = process.communicate()
+        if stdout:
+            self.logger.info("kill_sql.php stdout: %s" % stdout.rstrip())
+        if stderr:
+            self.logger.error("kill_sql.php stderr: %s" % stderr.rstrip())
+
+    def run(self):
+        while True:
+            mysql_user, kill_time = self.queue.get()
+            try:
+                if MySQLdb != None:
+                    self.kill_queries_mysqldb(mysql_user)
+                else:
+                    self.kill_queries_php(mysql_user)
+            except Exception:
+                self.logger.exception("Error while killing queries of %s" % mysql_user)
+            elapsed = time.time() - kill_time
+            self.logger.debug("killed queries of %s in %fs" % (mysql_user, elapsed))
+            with self.lock:
+                self.latency.add(elapsed)
 
 class BouncerForPhp(BouncerProcessManager):
 
+    def __init__(self, config, addr, port, logger):
+        # The SqlKillers must be up before the superclass starts (and thus may
+        # kill) workers
+        self.sql_kill_queue = Queue.Queue()
+        self.sql_cleanup_latency = worker_stats.BucketHistogram(worker_stats.LATENCY_BUCKETS)
+        self.sql_cleanup_lock = threading.Lock()
+        if MySQLdb == None:
+            logger.warning("MySQLdb not installed; falling back to kill_sql.php for query cleanup")
+        for i in range(SQL_KILLER_THREADS):
+            SqlKiller(self.sql_kill_queue, self.sql_cleanup_latency, self.sql_cleanup_lock,
+                logger).start()
+        super(BouncerForPhp, self).__init__(config, addr, port, logger)
+
     def start_worker(self, addr, port):
         '''Must attempt to launch the specified worker. Should return the popen object for the new worker
            or None, if the worker couldn't be be launched for some reason.'''
+        # php-cgi -b takes either addr:port or the path of a Unix socket
+        if addr == UNIX_ADDR:
+            bind = port
+        else:
+            bind = format_worker(addr, port)
         cmd_str = Template(PHP_FCGI_CMD_TEMPLATE_STR).substitute( \
-                addr = addr, \
-                port = str(port) \
+                bind = bind \
             )
         self.logger.debug("cmd_str='%s'" % cmd_str)
         cmd = cmd_str.split()
-        environ = dict(os.environ.items() + [("MYSQL_USER", "user%d" % port)])
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env = environ)
+        environ = dict(os.environ)
+        user = mysql_user(addr, port)
+        if user != None:
+            environ["MYSQL_USER"] = user
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env = environ,
+            preexec_fn=self.worker_preexec(addr, port))
         stdoutLogger = log.FileLoggerThread(self.logger, "php5-cgi stdout", logging.INFO, process.stdout)
         stderrLogger = log.FileLoggerThread(self.logger, "php5-cgi stderr", logging.ERROR, process.stderr)
         stdoutLogger.start()
@@ -65,22 +203,22 @@ class BouncerForPhp(BouncerProcessManager):
 
     def kill_worker(self, addr, port, popen_obj):
         '''Must attempt to kill the specified worker. Does not return anything'''
-        self.logger.debug("killing %d", port)
+        self.logger.debug("killing %s", format_worker(addr, port))
         try:
             popen_obj.kill()
         except OSError, e:
-            self.logger.error("Error while trying to kill '%s:%d': %s" % (addr, port, e))
+            self.logger.error("Error while trying to kill '%s': %s" % (format_worker(addr, port), e))
 
-        cmd_str = "php %s" % KILL_SQL_PHP
-        self.logger.debug("cmd_str='%s'" % cmd_str)
-        cmd = cmd_str.split()
-        environ = dict(os.environ.items() + [("MYSQL_USER", "user%d" % port)])
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env = environ)
-        stdoutLogger = log.FileLoggerThread(self.logger, "kill_sql.php stdout", logging.INFO, process.stdout)
-        stderrLogger = log.FileLoggerThread(self.logger, "kill_sql.php stderr", logging.ERROR, process.stderr)
-        stdoutLogger.start()
-        stderrLogger.start()
-        process.wait()
+        # query cleanup happens asynchronously, see SqlKiller
+        user = mysql_user(addr, port)
+        if user != None:
+            self.sql_kill_queue.put((user, time.time()))
+
+    def extra_histograms(self):
+        with self.sql_cleanup_lock:
+            latency = worker_stats.BucketHistogram(self.sql_cleanup_latency.bounds)
+            latency.merge(self.sql_cleanup_latency)
+        return {"sql_cleanup_latency" : latency}
 
 bouncer_process_manager.main(BouncerForPhp)
 
@@ -35,6 +35,7 @@ import log
 import env
 import bouncer_process_manager
 from bouncer_process_manager import BouncerProcessManager
+from bouncer_common import UNIX_ADDR, format_worker
 
 remine_deps = os.path.join(DIRNAME, "..", "..", "apps", "redmine_app", "env.sh")
 var = env.env(remine_deps)
@@ -54,13 +55,18 @@ class BouncerForRedmine(BouncerProcessManager):
     def start_worker(self, addr, port):
         '''Must attempt to launch the specified worker. Should return the popen object for the new worker
            or None, if the worker couldn't be be launched for some reason.'''
+        if addr == UNIX_ADDR:
+            self.logger.error("Cannot start worker '%s': mongrel does not support Unix sockets",
+                format_worker(addr, port))
+            return None
         cmd_str = Template(REDMINE_CMD_TEMPLATE_STR).substitute( \
                 addr = addr, \
                 port = str(port) \
             )
         self.logger.debug("cmd_str='%s'" % cmd_str)
         cmd = cmd_str.split()
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            preexec_fn=self.worker_preexec(addr, port))
         stdoutLogger = log.FileLoggerThread(self.logger, "redmine stdout", logging.INFO, process.stdout)
         stderrLogger = log.FileLoggerThread(self.logger, "redmine stderr", logging.ERROR, process.stderr)
         stdoutLogger.start()
@@ -72,7 +78,7 @@ class BouncerForRedmine(BouncerProcessManager):
         try:
             popen_obj.kill()
         except OSError, e:
-            self.logger.error("Error while trying to kill '%s:%d': %s" % (addr, port, e))
+            self.logger.error("Error while trying to kill '%s': %s" % (format_worker(addr, port), e))
 
 bouncer_process_manager.main(BouncerForRedmine)
 
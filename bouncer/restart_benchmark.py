@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== restart_benchmark.py ====
+#
+# Measures how long each bundled bouncer takes to get from an alert to a
+# serving worker. For every app (see APPS) it:
+#   (1) writes a config file with one bouncer and WORKERS workers on localhost
+#   (2) starts the app's bouncer and waits until all workers are ready
+#   (3) for each rate in RATES, sends ALERTS alert() calls (round robin over the
+#       workers, RATE alerts per second) through the Thrift client and measures
+#       for each alert:
+#         time_to_exit          -- from sending the alert until the old worker
+#                                  process is gone
+#         time_to_first_request -- from sending the alert until a GET request
+#                                  to the worker succeeds again
+#   (4) stops the bouncer and all of its workers
+# and prints a JSON report.
+#
+# Alerts for workers that are not ready (still restarting from a previous
+# alert) are not sent, since the bouncer would ignore them; they are counted
+# as "not_ready".
+#
+# dummy_py needs only flup (see ../dependencies/download.sh) and works offline.
+# php, osqa and redmine are skipped (with the reason in the report) when their
+# runtimes are not installed. Use --apps to select apps.
+#
+# Requires the compiled thrift files (see compile.sh).
+#
+# USAGE: ./restart_benchmark.py [--apps dummy_py,php] [--workers 4] [--alerts 20] [--rates 1,5]
+#
+
+import sys
+import os
+import argparse
+import json
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import httplib
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(DIRNAME, 'gen-py'))
+sys.path.append(os.path.join(DIRNAME, '..', 'common'))
+
+import env
+import procinfo
+import import_thrift_lib
+import rpc
+
+from BouncerService import BouncerService
+
+from thrift import Thrift
+
+from bouncer_common import *
+import worker_probe
+import wait_ready
+from bouncer_stats import get_stats
+
+ROOT = os.path.join(DIRNAME, "..")
+
+def env_var(filename, name):
+    '''Returns the variable name as defined by the env.sh script filename (or None)'''
+    try:
+        return env.env(os.path.join(ROOT, filename)).get(name)
+    except (ValueError, OSError):
+        return None
+
+def missing_dummy_py():
+    if not os.path.isdir(os.path.join(ROOT, "dependencies", "downloads", "flup-1.0.2")):
+        return "flup is not installed (see dependencies/download.sh)"
+    return None
+
+def missing_php():
+    php_cgi = env_var(os.path.join("dependencies", "env.sh"), "PHP_CGI_VULN_BIN")
+    if php_cgi == None or not os.access(php_cgi, os.X_OK):
+        return "php-cgi is not installed (PHP_CGI_VULN_BIN in dependencies/env.sh)"
+    return None
+
+def missing_osqa():
+    path = env_var(os.path.join("apps", "osqa_app", "env.sh"), "INSTALL_OSQA_PATH")
+    if path == None or not os.path.exists(os.path.join(path, "manage.py")):
+        return "OSQA is not installed (INSTALL_OSQA_PATH in apps/osqa_app/env.sh)"
+    return None
+
+def missing_redmine():
+    path = env_var(os.path.join("apps", "redmine_app", "env.sh"), "INSTALL_REDMINE_PATH")
+    if path == None or not os.path.exists(os.path.join(path, "script", "server")):
+        return "Redmine is not installed (INSTALL_REDMINE_PATH in apps/redmine_app/env.sh)"
+    if subprocess.call(["which", "ruby"], stdout=open(os.devnull, "w")) != 0:
+        return "ruby is not installed"
+    return None
+
+# For each app:
+#   bouncer   -- path of the bouncer script
+#   protocol  -- how to send a request to a worker ("fcgi" or "http")
+#   probe     -- readiness probe for the bouncer config
+#   timeout   -- readiness timeout for the bouncer config
+#   missing   -- returns the reason the app cannot run here, or None
+APPS = {
+    "dummy_py" : {
+        "bouncer" : os.path.join(ROOT, "apps", "dummy_py_app", "bouncer_for_dummy_app.py"),
+        "protocol" : "fcgi",
+        "probe" : "fcgi",
+        "timeout" : 30.0,
+        "missing" : missing_dummy_py,
+    },
+    "php" : {
+        "bouncer" : os.path.join(DIRNAME, "php_bouncer", "php_bouncer.py"),
+        "protocol" : "fcgi",
+        "probe" : "fcgi",
+        "timeout" : 30.0,
+        "missing" : missing_php,
+    },
+    "osqa" : {
+        "bouncer" : os.path.join(DIRNAME, "osqa_bouncer", "osqa_bouncer.py"),
+        "protocol" : "http",
+        "probe" : "tcp",
+        "timeout" : 120.0,
+        "missing" : missing_osqa,
+    },
+    "redmine" : {
+        "bouncer" : os.path.join(DIRNAME, "redmine_bouncer", "redmine_bouncer.py"),
+        "protocol" : "http",
+        "probe" : "tcp",
+        "timeout" : 300.0,
+        "missing" : missing_redmine,
+    },
+}
+
+REQUEST_FUNCS = {
+    "fcgi" : worker_probe.fcgi_get,
+    "http" : worker_probe.http_get,
+}
+
+# seconds between checks while waiting for a worker to exit or serve
+POLL_INTERVAL = 0.005
+
+def summarize(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return {}
+    return {
+        "num" : len(values),
+        "min" : values[0],
+        "median" : values[len(values) / 2],
+        "p90" : values[min(len(values) - 1, int(len(values) * 0.9))],
+        "max" : values[-1],
+        "mean" : sum(values) / len(values),
+    }
+
+def process_exists(pid):
+    return os.path.exists("/proc/%d" % pid)
+
+class AlertMeasurement(threading.Thread):
+    '''Waits for one alerted worker to exit and then to serve a request again'''
+
+    def __init__(self, worker, pid, sent, request_func, timeout):
+        self.worker = worker
+        self.pid = pid
+        self.sent = sent
+        self.request_func = request_func
+        self.timeout = timeout
+        self.time_to_exit = None
+        self.time_to_first_request = None
+        super(AlertMeasurement, self).__init__()
+
+    def run(self):
+        addr, port = parse_worker(self.worker)
+        deadline = self.sent + self.timeout
+        while process_exists(self.pid):
+            if time.time() > deadline:
+                return
+            time.sleep(POLL_INTERVAL)
+        self.time_to_exit = time.time() - self.sent
+        while time.time() < deadline:
+            try:
+                self.request_func(addr, port, 1.0)
+                self.time_to_first_request = time.time() - self.sent
+                return
+            except (socket.error, socket.timeout, httplib.HTTPException):
+                time.sleep(POLL_INTERVAL)
+
+class BouncerUnderTest:
+    '''A bouncer (and its workers) started from a temporary config file'''
+
+    def __init__(self, app, app_name, workers, bouncer_port, base_port, tempdir):
+        self.app = app
+        self.bouncer = BouncerAddress("127.0.0.1", bouncer_port)
+        self.workers = ["127.0.0.1:%d" % port for port in range(base_port, base_port + workers)]
+        json_config = {
+            "alert_pipe" : os.path.join(tempdir, "alert_pipe"),
+            "bouncers" : [{
+                "bouncer_addr" : self.bouncer.addr,
+                "bouncer_port" : self.bouncer.port,
+                "fcgi_workers" : self.workers,
+                "readiness" : {
+                    "probe" : app["probe"],
+                    "timeout" : app["timeout"],
+                },
+            }],
+        }
+        self.config_filename = os.path.join(tempdir, "%s_config.json" % app_name)
+        with open(self.config_filename, "w") as f:
+            json.dump(json_config, f, indent=4)
+        with open(self.config_filename) as f:
+            self.config = Config(f)
+        self.mode = self.config.bouncer_options[str(self.bouncer)]["rpc"]["mode"]
+        self.log = open(os.path.join(tempdir, "%s_bouncer.log" % app_name), "w")
+        self.process = None
+
+    def start(self, timeout):
+        '''Starts the bouncer, and returns its time_to_fully_ready (or None if the
+        workers did not become ready within timeout seconds)'''
+        cmd = [sys.executable, self.app["bouncer"], "--config", self.config_filename,
+            "--addr", self.bouncer.addr, "--port", str(self.bouncer.port), "--logfile", "ERROR"]
+        self.process = subprocess.Popen(cmd, stdout=self.log, stderr=subprocess.STDOUT)
+        result = wait_ready.wait_ready(self.config, timeout, 0.1)
+        if result == None:
+            return None
+        return result[str(self.bouncer)]
+
+    def stats(self):
+        return get_stats(self.bouncer, self.mode)
+
+    def alert(self, worker):
+        client, transport = rpc.make_client(BouncerService.Client, self.bouncer.addr,
+            self.bouncer.port, self.mode)
+        transport.open()
+        try:
+            client.alert(worker)
+        finally:
+            transport.close()
+
+    def log_tail(self, lines=20):
+        '''Returns the last lines of the bouncer's output'''
+        self.log.flush()
+        with open(self.log.name) as f:
+            return f.readlines()[-lines:]
+
+    def stop(self):
+        '''Kills the bouncer and everything it started (workers, zygote, ...)'''
+        if self.process == None:
+            return
+        pids = procinfo.descendants(self.process.pid)
+        self.process.kill()
+        self.process.wait()
+        for pid in pids:
+            try:
+                os.kill(pid, 9)
+            except OSError:
+                pass
+        self.log.close()
+
+def run_rate(bouncer, request_func, rate, alerts, timeout):
+    '''Sends alerts at rate alerts per second and returns a dict of results'''
+    measurements = []
+    not_ready = 0
+    errors = 0
+    start = time.time()
+    for i in xrange(alerts):
+        scheduled = start + float(i) / rate
+        now = time.time()
+        if scheduled > now:
+            time.sleep(scheduled - now)
+        worker = bouncer.workers[i % len(bouncer.workers)]
+        try:
+            statuses = dict((status.worker, status) for status in bouncer.stats().workers)
+            status = statuses[worker]
+            if not status.ready:
+                not_ready += 1
+                continue
+            sent = time.time()
+            bouncer.alert(worker)
+        except Thrift.TException:
+            errors += 1
+            continue
+        measurement = AlertMeasurement(worker, status.pid, sent, request_func, timeout)
+        measurement.start()
+        measurements.append(measurement)
+    for measurement in measurements:
+        measurement.join()
+
+    per_worker = {}
+    for measurement in measurements:
+        result = per_worker.setdefault(measurement.worker, {"time_to_exit" : [], "time_to_first_request" : []})
+        if measurement.time_to_exit != None:
+            result["time_to_exit"].append(measurement.time_to_exit)
+        if measurement.time_to_first_request != None:
+            result["time_to_first_request"].append(measurement.time_to_first_request)
+    return {
+        "rate" : rate,
+        "sent" : len(measurements),
+        "not_ready" : not_ready,
+        "errors" : errors,
+        "timeouts" : len([m for m in measurements if m.time_to_first_request == None]),
+        "time_to_exit" : summarize([m.time_to_exit for m in measurements if m.time_to_exit != None]),
+        "time_to_first_request" : summarize([m.time_to_first_request for m in measurements
+            if m.time_to_first_request != None]),
+        "per_worker" : dict((worker, {
+            "time_to_exit" : summarize(result["time_to_exit"]),
+            "time_to_first_request" : summarize(result["time_to_first_request"]),
+        }) for worker, result in per_worker.items()),
+    }
+
+def run_app(app_name, args, tempdir):
+    app = APPS[app_name]
+    reason = app["missing"]()
+    if reason != None:
+        return {"skipped" : reason}
+    bouncer = BouncerUnderTest(app, app_name, args.workers, args.bouncer_port, args.base_port, tempdir)
+    try:
+        time_to_fully_ready = bouncer.start(app["timeout"] * args.workers)
+        if time_to_fully_ready == None:
+            return {
+                "error" : "bouncer did not become ready",
+                "bouncer_output" : bouncer.log_tail(),
+            }
+        result = {
+            "workers" : args.workers,
+            "time_to_fully_ready" : time_to_fully_ready,
+            "rates" : [],
+        }
+        request_func = REQUEST_FUNCS[app["protocol"]]
+        for rate in args.rates:
+            result["rates"].append(run_rate(bouncer, request_func, rate, args.alerts, app["timeout"]))
+            # let the last restarts finish before the next rate
+            wait_ready.wait_ready(bouncer.config, app["timeout"], 0.1)
+        return result
+    finally:
+        bouncer.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measures alert-to-serving latency for every bundled bouncer')
+    parser.add_argument("-a", "--apps", type=str, default=",".join(sorted(APPS.keys())),
+                        help="Default=%(default)s. Comma separated list of apps to benchmark")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="Default=%(default)d. Number of workers per bouncer")
+    parser.add_argument("-n", "--alerts", type=int, default=20,
+                        help="Default=%(default)d. Number of alerts per rate")
+    parser.add_argument("-r", "--rates", type=str, default="1,5",
+                        help="Default=%(default)s. Comma separated list of alert rates (alerts per second)")
+    parser.add_argument("-p", "--bouncer-port", type=int, default=3901,
+                        help="Default=%(default)d. Port for the bouncer under test")
+    parser.add_argument("-b", "--base-port", type=int, default=9800,
+                        help="Default=%(default)d. Workers listen on BASE_PORT, BASE_PORT + 1, ...")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Default=stdout. File to write the JSON report to")
+    args = parser.parse_args()
+    args.rates = [float(rate) for rate in args.rates.split(",")]
+
+    tempdir = tempfile.mkdtemp(prefix="restart_benchmark_")
+    report = {}
+    try:
+        for app_name in args.apps.split(","):
+            if app_name not in APPS:
+                parser.error("Unknown app '%s'" % app_name)
+            sys.stderr.write("Benchmarking %s\n" % app_name)
+            report[app_name] = run_app(app_name, args, tempdir)
+    finally:
+        shutil.rmtree(tempdir, True)
+
+    report_json = json.dumps(report, indent=4, sort_keys=True)
+    if args.output == None:
+        print report_json
+    else:
+        with open(args.output, "w") as f:
+            f.write(report_json + "\n")
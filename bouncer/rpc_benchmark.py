@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== rpc_benchmark.py ====
+#
+# Load test for the Thrift servers of a running bouncer or sigservice (in
+# whatever rpc mode the config file selects; see bouncer_common.py).
+#
+# For each target rate, CLIENTS threads fire calls on a fixed schedule for
+# DURATION seconds, then the achieved throughput and latency percentiles are
+# reported as JSON. Latency is measured from the time a call was scheduled
+# (not from when it was actually sent), so queueing in an overloaded client
+# shows up as latency instead of silently lowering the offered load.
+#
+# Calls:
+#   bouncer    -- alternates heartbeat() and alert() for a worker the bouncer
+#                 does not manage (the bouncer logs and ignores it, so no
+#                 worker is killed)
+#   sigservice -- alternates evicted() and completed() with synthetic URLs.
+#                 NOTE: these end up in the sigservice's training samples, so
+#                 do not benchmark a sigservice that is protecting a live site.
+#
+# alert(), evicted() and completed() are oneway, so their latency only covers
+# sending the request. heartbeat() latency is a full round trip.
+#
+# By default every client keeps one connection open; --reconnect opens a new
+# connection per call, like the alert_router does.
+#
+# USAGE: ./rpc_benchmark.py -c bouncer_config.json -t bouncer [--rates 100,500,1000]
+#
+
+import sys
+import os
+import argparse
+import json
+import threading
+import time
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(DIRNAME, 'gen-py'))
+sys.path.append(os.path.join(DIRNAME, '..', 'sig_service', 'gen-py'))
+sys.path.append(os.path.join(DIRNAME, '..', 'common'))
+
+import import_thrift_lib
+import rpc
+
+from BouncerService import BouncerService
+from SignatureService import SignatureService
+
+from thrift import Thrift
+
+from bouncer_common import *
+
+BOGUS_WORKER = "rpc-benchmark:0"
+
+def percentile(values, q):
+    '''values must be sorted'''
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+class Target:
+    '''The service being benchmarked'''
+
+    def __init__(self, client_class, addr, port, mode, calls):
+        '''calls is a list of functions f(client, i) that each make one call'''
+        self.client_class = client_class
+        self.addr = addr
+        self.port = port
+        self.mode = mode
+        self.calls = calls
+
+    def connect(self):
+        client, transport = rpc.make_client(self.client_class, self.addr, self.port, self.mode)
+        transport.open()
+        return client, transport
+
+def bouncer_target(config, bouncer):
+    if bouncer == None:
+        bouncer = config.bouncer_list[0]
+    else:
+        bouncer = [b for b in config.bouncer_list if str(b) == bouncer][0]
+    calls = [
+        lambda client, i: client.heartbeat(),
+        lambda client, i: client.alert(BOGUS_WORKER),
+    ]
+    return Target(BouncerService.Client, bouncer.addr, bouncer.port,
+        config.bouncer_options[str(bouncer)]["rpc"]["mode"], calls)
+
+def sigservice_target(config):
+    if config.sigservice == None:
+        raise BadConfig("The config file does not have a sigservice section")
+    calls = [
+        lambda client, i: client.evicted("/rpc_benchmark/evicted?i=%d" % i),
+        lambda client, i: client.completed("/rpc_benchmark/completed?i=%d" % i),
+    ]
+    return Target(SignatureService.Client, config.sigservice["addr"], config.sigservice["port"],
+        config.sigservice["rpc"]["mode"], calls)
+
+class LoadClient(threading.Thread):
+    '''Makes calls to target at a fixed rate until end_time'''
+
+    def __init__(self, target, rate, start_time, end_time, reconnect):
+        self.target = target
+        self.interval = 1.0 / rate
+        self.start_time = start_time
+        self.end_time = end_time
+        self.reconnect = reconnect
+        self.latency = []
+        self.errors = 0
+        super(LoadClient, self).__init__()
+
+    def run(self):
+        client, transport = None, None
+        scheduled = self.start_time
+        i = 0
+        while scheduled < self.end_time:
+            now = time.time()
+            if scheduled > now:
+                time.sleep(scheduled - now)
+            try:
+                if client == None:
+                    client, transport = self.target.connect()
+                self.target.calls[i % len(self.target.calls)](client, i)
+                self.latency.append(time.time() - scheduled)
+            except Thrift.TException:
+                self.errors += 1
+                if transport != None:
+                    transport.close()
+                client, transport = None, None
+            if self.reconnect and transport != None:
+                transport.close()
+                client, transport = None, None
+            i += 1
+            scheduled += self.interval
+        if transport != None:
+            transport.close()
+
+def benchmark(target, rate, duration, clients, reconnect):
+    '''Returns a dict of results for one rate (calls per second, over all clients)'''
+    start_time = time.time() + 0.1
+    end_time = start_time + duration
+    threads = [LoadClient(target, float(rate) / clients, start_time + float(i) / rate,
+        end_time, reconnect) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start_time
+
+    latency = sorted(sum([thread.latency for thread in threads], []))
+    return {
+        "offered_rate" : rate,
+        "throughput" : len(latency) / elapsed,
+        "calls" : len(latency),
+        "errors" : sum([thread.errors for thread in threads]),
+        "p50" : percentile(latency, 0.5),
+        "p99" : percentile(latency, 0.99),
+        "max" : latency[-1] if len(latency) > 0 else None,
+    }
+
+if __name__ == "__main__":
+
+    cwd = os.getcwd()
+
+    default_config = os.path.join(cwd, "bouncer_config.json")
+
+    parser = argparse.ArgumentParser(description='Load test for the Thrift server of a bouncer or the sigservice')
+    parser.add_argument("-c", "--config", type=str, default=default_config,
+                        help="Default=%(default)s. The config file. See bouncer/bouncer_common.py for config-file format.")
+    parser.add_argument("-t", "--target", type=str, default="bouncer", choices=["bouncer", "sigservice"],
+                        help="Default=%(default)s. The service to load")
+    parser.add_argument("-b", "--bouncer", type=str, default=None,
+                        help="Default=the first bouncer in the config. The bouncer (ADDR:PORT) to load")
+    parser.add_argument("-r", "--rates", type=str, default="100,200,500,1000,2000,5000",
+                        help="Default=%(default)s. Comma separated list of offered rates (calls per second)")
+    parser.add_argument("-d", "--duration", type=float, default=5.0,
+                        help="Default=%(default)s. Number of seconds to run each rate")
+    parser.add_argument("-n", "--clients", type=int, default=4,
+                        help="Default=%(default)d. Number of concurrent client threads")
+    parser.add_argument("--reconnect", action="store_true", default=False,
+                        help="Open a new connection for every call (like alert_router)")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = Config(f)
+
+    if args.target == "bouncer":
+        target = bouncer_target(config, args.bouncer)
+    else:
+        target = sigservice_target(config)
+
+    results = {
+        "target" : "%s:%d" % (target.addr, target.port),
+        "rpc_mode" : target.mode,
+        "clients" : args.clients,
+        "reconnect" : args.reconnect,
+        "rates" : [],
+    }
+    for rate in [int(r) for r in args.rates.split(",")]:
+        results["rates"].append(benchmark(target, rate, args.duration, args.clients, args.reconnect))
+        sys.stderr.write("%d calls/s --> %s\n" % (rate, json.dumps(results["rates"][-1], sort_keys=True)))
+
+    print json.dumps(results, indent=4, sort_keys=True)
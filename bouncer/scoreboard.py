@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== scoreboard.py ====
+#
+# A fixed-layout, mmap'ed file in which a bouncer publishes the state of its
+# workers, so that other processes on the same machine (scoreboard_top.py,
+# the alert_router) can read it without making RPCs.
+#
+# Layout (little endian):
+#   header: magic "BSCB", version (u32), num_slots (u32), bouncer pid (u32),
+#           bouncer start time (double)
+#   num_slots slots of: seq (u32), worker (128 bytes, NUL padded; long enough
+#           for "unix:" plus the longest Unix socket path), state (u32),
+#           pid (i32), restarts (u32), kills (u32), start_time (double),
+#           last_kill_time (double), updated (double)
+#
+# There is a single writer (the bouncer). Every slot has a sequence number
+# that is odd while the slot is being written, so readers retry instead of
+# returning a torn slot. The writer creates the file under a temporary name
+# and renames it into place, so readers never see a partially initialized
+# file; a restarted bouncer replaces the file, and ScoreboardReader notices.
+#
+# USAGE: see scoreboard_top.py
+#
+
+import os
+import errno
+import struct
+import mmap
+import time
+import collections
+
+MAGIC = "BSCB"
+VERSION = 2
+
+HEADER = struct.Struct("<4sIIId")
+SLOT = struct.Struct("<I128sIiIIddd")
+SEQ = struct.Struct("<I")
+
+# worker states
+EMPTY = 0
+STARTING = 1
+READY = 2
+KILLING = 3
+EXITED = 4
+CRASH_LOOPING = 5
+RETIRING = 6
+
+STATE_NAMES = {
+    EMPTY : "empty",
+    STARTING : "starting",
+    READY : "ready",
+    KILLING : "killing",
+    EXITED : "exited",
+    CRASH_LOOPING : "crash-looping",
+    RETIRING : "retiring",
+}
+
+WorkerSlot = collections.namedtuple("WorkerSlot",
+    ["worker", "state", "pid", "restarts", "kills", "start_time", "last_kill_time", "updated"])
+
+Header = collections.namedtuple("Header", ["num_slots", "pid", "start_time"])
+
+# number of times a reader retries a slot that is being written
+MAX_READ_RETRIES = 100
+
+class ScoreboardError(Exception):
+    pass
+
+def scoreboard_path(scoreboard_dir, bouncer):
+    '''Returns the path of the scoreboard file for bouncer (a BouncerAddress)'''
+    return os.path.join(scoreboard_dir, "bouncer-%s-%d.scoreboard" % (bouncer.addr, bouncer.port))
+
+def slot_offset(index):
+    return HEADER.size + index * SLOT.size
+
+class ScoreboardWriter:
+    '''Creates and updates a scoreboard file. Callers are responsible for locking.'''
+
+    def __init__(self, path, num_slots):
+        self.path = path
+        self.num_slots = num_slots
+        # maps each worker string to the index of its slot
+        self.slots = {}
+        size = slot_offset(num_slots)
+        tmp_path = "%s.tmp.%d" % (path, os.getpid())
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0644)
+        try:
+            os.ftruncate(fd, size)
+            self.mmap = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.mmap, 0, MAGIC, VERSION, num_slots, os.getpid(), time.time())
+        os.rename(tmp_path, path)
+
+    def update(self, worker, state, pid=-1, restarts=0, kills=0, start_time=0.0, last_kill_time=0.0):
+        '''Publishes the state of worker, allocating a slot for it if necessary.
+        Raises ScoreboardError if there is no free slot.'''
+        if worker not in self.slots:
+            used = set(self.slots.values())
+            free = [index for index in range(self.num_slots) if index not in used]
+            if len(free) == 0:
+                raise ScoreboardError("No free scoreboard slot for worker '%s'" % worker)
+            self.slots[worker] = free[0]
+        self.write(self.slots[worker], worker, state, pid, restarts, kills, start_time,
+            last_kill_time)
+
+    def remove(self, worker):
+        '''Frees the slot of worker (if it has one)'''
+        if worker in self.slots:
+            self.write(self.slots.pop(worker), "", EMPTY, -1, 0, 0, 0.0, 0.0)
+
+    def write(self, index, worker, state, pid, restarts, kills, start_time, last_kill_time):
+        offset = slot_offset(index)
+        seq = SEQ.unpack_from(self.mmap, offset)[0]
+        SEQ.pack_into(self.mmap, offset, (seq + 1) & 0xffffffff)
+        SLOT.pack_into(self.mmap, offset, (seq + 1) & 0xffffffff, worker, state, pid, restarts,
+            kills, start_time, last_kill_time, time.time())
+        SEQ.pack_into(self.mmap, offset, (seq + 2) & 0xffffffff)
+
+    def close(self):
+        self.mmap.close()
+
+class ScoreboardReader:
+    '''Reads a scoreboard file. Reopens the file if the bouncer replaced it.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.mmap = None
+        self.inode = None
+        self.header = None
+
+    def open(self):
+        '''(Re)maps the file if necessary. Raises ScoreboardError if it is missing or invalid'''
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError, e:
+            self.close()
+            raise ScoreboardError("Could not stat %s: %s" % (self.path, e))
+        if inode == self.inode:
+            return
+        self.close()
+        try:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ)
+        except (IOError, mmap.error), e:
+            raise ScoreboardError("Could not map %s: %s" % (self.path, e))
+        if len(mapped) < HEADER.size:
+            mapped.close()
+            raise ScoreboardError("%s is too short" % self.path)
+        magic, version, num_slots, pid, start_time = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != VERSION or len(mapped) < slot_offset(num_slots):
+            mapped.close()
+            raise ScoreboardError("%s is not a version %d scoreboard" % (self.path, VERSION))
+        self.mmap = mapped
+        self.inode = inode
+        self.header = Header(num_slots, pid, start_time)
+
+    def close(self):
+        if self.mmap != None:
+            self.mmap.close()
+        self.mmap = None
+        self.inode = None
+        self.header = None
+
+    def bouncer_alive(self):
+        '''Returns True iff the bouncer that wrote the scoreboard is still running'''
+        try:
+            os.kill(self.header.pid, 0)
+        except OSError, e:
+            return e.errno == errno.EPERM
+        return True
+
+    def read_slot(self, index):
+        '''Returns the WorkerSlot at index, or None if it is empty'''
+        offset = slot_offset(index)
+        for i in range(MAX_READ_RETRIES):
+            values = SLOT.unpack_from(self.mmap, offset)
+            seq = values[0]
+            if seq % 2 == 0 and SEQ.unpack_from(self.mmap, offset)[0] == seq:
+                break
+        else:
+            raise ScoreboardError("Slot %d of %s is always being written" % (index, self.path))
+        if values[2] == EMPTY:
+            return None
+        return WorkerSlot(values[1].rstrip("\0"), *values[2:])
+
+    def read(self):
+        '''Returns a dict that maps each worker string to its WorkerSlot'''
+        self.open()
+        slots = {}
+        for index in range(self.header.num_slots):
+            slot = self.read_slot(index)
+            if slot != None:
+                slots[slot.worker] = slot
+        return slots
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== scoreboard_test.py ====
+#
+#
+import unittest
+import os
+import shutil
+import tempfile
+from scoreboard import *
+
+class Test_scoreboard(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.scoreboard")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_write_read(self):
+        writer = ScoreboardWriter(self.path, 2)
+        reader = ScoreboardReader(self.path)
+        self.assertEqual(reader.read(), {})
+        self.assertEqual(reader.header.num_slots, 2)
+        self.assertEqual(reader.header.pid, os.getpid())
+        self.assertTrue(reader.bouncer_alive())
+
+        writer.update("127.0.0.1:9001", STARTING, pid=123, start_time=10.0)
+        writer.update("127.0.0.1:9002", READY, pid=124, restarts=2, kills=3, last_kill_time=5.0)
+        slots = reader.read()
+        self.assertEqual(slots["127.0.0.1:9001"].state, STARTING)
+        self.assertEqual(slots["127.0.0.1:9001"].pid, 123)
+        self.assertEqual(slots["127.0.0.1:9001"].start_time, 10.0)
+        self.assertEqual(slots["127.0.0.1:9002"].kills, 3)
+        self.assertRaises(ScoreboardError, writer.update, "127.0.0.1:9003", STARTING)
+
+        writer.remove("127.0.0.1:9001")
+        writer.update("127.0.0.1:9003", KILLING)
+        self.assertEqual(sorted(reader.read().keys()), ["127.0.0.1:9002", "127.0.0.1:9003"])
+        writer.close()
+
+    def test_replaced(self):
+        ScoreboardWriter(self.path, 1).update("127.0.0.1:9001", READY)
+        reader = ScoreboardReader(self.path)
+        self.assertEqual(reader.read().keys(), ["127.0.0.1:9001"])
+        # a restarted bouncer replaces the file
+        ScoreboardWriter(self.path, 3)
+        self.assertEqual(reader.read(), {})
+        self.assertEqual(reader.header.num_slots, 3)
+
+    def test_missing(self):
+        self.assertRaises(ScoreboardError, ScoreboardReader(self.path).read)
+        with open(self.path, "w") as f:
+            f.write("not a scoreboard" * 10)
+        self.assertRaises(ScoreboardError, ScoreboardReader(self.path).read)
+
+if __name__ == '__main__':
+    unittest.main()
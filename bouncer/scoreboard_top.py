@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== scoreboard_top.py ====
+#
+# A top-like view of the workers of every bouncer in the config file. Reads
+# the bouncers' scoreboards (see scoreboard.py) directly, so it makes no RPCs
+# and can poll as often as you like. Must run on the same machine as the
+# bouncers.
+#
+# USAGE: ./scoreboard_top.py -c bouncer_config.json [--period 1] [--once]
+#
+
+import sys
+import os
+import argparse
+import time
+
+from bouncer_common import *
+import scoreboard
+
+ROW_FORMAT = "%-22s %-14s %7s %9s %8s %6s %10s %9s"
+HEADER = ROW_FORMAT % ("worker", "state", "pid", "uptime", "restarts", "kills", "last kill", "updated")
+
+CLEAR_SCREEN = "\033[H\033[2J"
+
+def format_age(now, timestamp):
+    '''Formats the number of seconds since timestamp (0.0 means never)'''
+    if timestamp == 0.0:
+        return "-"
+    age = now - timestamp
+    if age < 1.0:
+        return "%dms" % int(round(age * 1000))
+    if age < 3600.0:
+        return "%.1fs" % age
+    return "%.1fh" % (age / 3600.0)
+
+def bouncer_lines(config, bouncer, reader, now):
+    '''Returns the lines describing one bouncer'''
+    try:
+        slots = reader.read()
+    except scoreboard.ScoreboardError, e:
+        return ["%s: no scoreboard (%s)" % (bouncer, e)]
+    header = reader.header
+    status = "up %s" % format_age(now, header.start_time) if reader.bouncer_alive() else "NOT RUNNING"
+    counts = {}
+    for slot in slots.values():
+        counts[slot.state] = counts.get(slot.state, 0) + 1
+    summary = ", ".join(["%d %s" % (num, scoreboard.STATE_NAMES.get(state, state))
+        for state, num in sorted(counts.items())])
+    lines = ["%s: pid %d, %s, %d/%d slots used (%s)" % (bouncer, header.pid, status, len(slots),
+        header.num_slots, summary)]
+    for worker, slot in sorted(slots.items()):
+        lines.append(ROW_FORMAT % (worker, scoreboard.STATE_NAMES.get(slot.state, slot.state),
+            slot.pid if slot.pid > 0 else "-",
+            format_age(now, slot.start_time) if slot.start_time > 0.0 else "-",
+            slot.restarts, slot.kills, format_age(now, slot.last_kill_time),
+            format_age(now, slot.updated)))
+    return lines
+
+def print_screen(config, readers):
+    now = time.time()
+    lines = [time.strftime("%H:%M:%S", time.localtime(now)) + "  " + config.scoreboard_dir, HEADER]
+    for bouncer in config.bouncer_list:
+        lines.append("")
+        lines.extend(bouncer_lines(config, bouncer, readers[str(bouncer)], now))
+    print "\n".join(lines)
+
+if __name__ == "__main__":
+
+    cwd = os.getcwd()
+
+    default_config = os.path.join(cwd, "bouncer_config.json")
+
+    parser = argparse.ArgumentParser(description='Shows the scoreboards of every bouncer in the config')
+    parser.add_argument("-c", "--config", type=str, default=default_config,
+                        help="Default=%(default)s. The config file. See bouncer/bouncer_common.py for config-file format.")
+    parser.add_argument("-p", "--period", type=float, default=1.0,
+                        help="Default=%(default)s. Seconds between refreshes")
+    parser.add_argument("-o", "--once", action="store_true", default=False,
+                        help="Print the scoreboards once and exit")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = Config(f)
+
+    readers = dict((str(bouncer), scoreboard.ScoreboardReader(
+        scoreboard.scoreboard_path(config.scoreboard_dir, bouncer))) for bouncer in config.bouncer_list)
+
+    try:
+        while True:
+            if not args.once and sys.stdout.isatty():
+                sys.stdout.write(CLEAR_SCREEN)
+            print_screen(config, readers)
+            if args.once:
+                break
+            print
+            time.sleep(args.period)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== wait_ready.py ====
+#
+# Waits until every bouncer in the config file reports that all of its workers
+# have been ready (see time_to_fully_ready in BouncerService.thrift), then
+# prints how long each bouncer took. Meant for restart scripts, instead of
+# sleeping for a fixed amount of time before launching nginx.
+#
+# Bouncers that are not listening yet are retried until the timeout expires.
+# A bouncer that gave up launching some of its workers (see failed_workers in
+# BouncerService.thrift) will never be fully ready, so that fails right away.
+#
+# Exit status is 0 on success, and 1 on timeout or if some workers failed.
+#
+# USAGE: ./wait_ready.py -c bouncer_config.json [--timeout 300] [--interval 0.1]
+#
+
+import sys
+import os
+import argparse
+import time
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(DIRNAME, 'gen-py'))
+sys.path.append(os.path.join(DIRNAME, '..', 'common'))
+
+import import_thrift_lib
+
+from thrift import Thrift
+
+from bouncer_common import *
+from bouncer_stats import get_stats
+
+class WorkersFailed(Exception):
+    pass
+
+def wait_ready(config, timeout, interval):
+    '''Returns a dict that maps each bouncer string to its time_to_fully_ready,
+    or None if some bouncer was not fully ready within timeout seconds. Raises
+    WorkersFailed if some bouncer could not launch some of its workers'''
+    deadline = time.time() + timeout
+    result = {}
+    while True:
+        for bouncer in config.bouncer_list:
+            if str(bouncer) in result:
+                continue
+            try:
+                stats = get_stats(bouncer, config.bouncer_options[str(bouncer)]["rpc"]["mode"])
+            except Thrift.TException:
+                continue
+            if stats.failed_workers:
+                raise WorkersFailed("%s could not start workers %s" % (bouncer, ", ".join(stats.failed_workers)))
+            if stats.time_to_fully_ready >= 0.0:
+                result[str(bouncer)] = stats.time_to_fully_ready
+        if len(result) == len(config.bouncer_list):
+            return result
+        if time.time() >= deadline:
+            return None
+        time.sleep(interval)
+
+if __name__ == "__main__":
+
+    cwd = os.getcwd()
+
+    default_config = os.path.join(cwd, "bouncer_config.json")
+
+    parser = argparse.ArgumentParser(description='Waits until the workers of every bouncer in the config are ready')
+    parser.add_argument("-c", "--config", type=str, default=default_config,
+                        help="Default=%(default)s. The config file. See bouncer/bouncer_common.py for config-file format.")
+    parser.add_argument("-t", "--timeout", type=float, default=300.0,
+                        help="Default=%(default)s. Give up after TIMEOUT seconds")
+    parser.add_argument("-i", "--interval", type=float, default=0.1,
+                        help="Default=%(default)s. Seconds between polls")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = Config(f)
+
+    try:
+        result = wait_ready(config, args.timeout, args.interval)
+    except WorkersFailed, e:
+        print "Bouncer failed: %s" % e
+        sys.exit(1)
+    if result == None:
+        print "Timed out after %fs waiting for bouncers to become ready" % args.timeout
+        sys.exit(1)
+    for bouncer, time_to_fully_ready in sorted(result.items()):
+        print "%s: fully ready after %fs" % (bouncer, time_to_fully_ready)
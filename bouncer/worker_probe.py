@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== worker_probe.py ====
+#
+# Readiness probes for FastCGI (and HTTP) workers. A freshly started worker
+# is not "ready" until it has bound its port and finished loading the app.
+# The bouncer uses these probes to decide when a restarted worker counts as
+# available again.
+#
+# Two probes are provided:
+#   tcp  -- succeeds as soon as a TCP connect() to the worker succeeds
+#   fcgi -- sends a FCGI_GET_VALUES management record and succeeds when the
+#           worker answers with FCGI_GET_VALUES_RESULT. This proves the
+#           FastCGI server loop is running, not just that the port is bound.
+#           Only use it for real FastCGI workers (php-cgi, flup), not for
+#           HTTP workers like gunicorn or mongrel.
+#
+# fcgi_get and http_get make a complete GET request, for tools (such as
+# restart_benchmark.py) that need to know when a worker actually serves pages.
+#
+# For Unix socket workers, addr is "unix" and port is the socket path (see
+# parse_worker in bouncer_common.py); the "tcp" probe then simply connects to
+# the socket.
+#
+# USAGE: ./worker_probe.py [tcp|fcgi] addr port
+#        ./worker_probe.py [tcp|fcgi] unix /path/to/sock
+#
+
+import sys
+import socket
+import struct
+import time
+import httplib
+
+from bouncer_common import UNIX_ADDR
+
+FCGI_VERSION_1 = 1
+FCGI_BEGIN_REQUEST = 1
+FCGI_END_REQUEST = 3
+FCGI_PARAMS = 4
+FCGI_STDIN = 5
+FCGI_STDOUT = 6
+FCGI_GET_VALUES = 9
+FCGI_GET_VALUES_RESULT = 10
+FCGI_HEADER_LEN = 8
+FCGI_RESPONDER = 1
+
+# The variables we ask for in the FCGI_GET_VALUES probe. The answer is
+# irrelevant; all that matters is that the worker answers.
+FCGI_PROBE_NAMES = ["FCGI_MAX_CONNS", "FCGI_MAX_REQS", "FCGI_MPXS_CONNS"]
+
+def fcgi_name_value(name, value=""):
+    '''Encodes a FastCGI name-value pair (for names and values < 128 bytes)'''
+    return struct.pack("!BB", len(name), len(value)) + name + value
+
+def fcgi_record(record_type, request_id, content):
+    '''Encodes a FastCGI record (header + content + padding)'''
+    padding = (8 - (len(content) % 8)) % 8
+    header = struct.pack("!BBHHBB", FCGI_VERSION_1, record_type, request_id,
+        len(content), padding, 0)
+    return header + content + ("\x00" * padding)
+
+def recv_exactly(sock, num_bytes):
+    '''Reads exactly num_bytes from sock. Raises socket.error if the peer closes
+    the connection first.'''
+    chunks = []
+    remaining = num_bytes
+    while remaining > 0:
+        chunk = sock.recv(remaining)
+        if chunk == "":
+            raise socket.error("connection closed by worker")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return "".join(chunks)
+
+def connect(addr, port, timeout):
+    '''Returns a socket connected to the worker, or raises socket.error'''
+    if addr == UNIX_ADDR:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(port)
+        except:
+            sock.close()
+            raise
+        return sock
+    return socket.create_connection((addr, port), timeout)
+
+class WorkerHTTPConnection(httplib.HTTPConnection):
+    '''An HTTPConnection that connects to the worker via connect (and thus
+    also works for Unix socket workers)'''
+
+    def __init__(self, addr, port, timeout):
+        if addr == UNIX_ADDR:
+            httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        else:
+            httplib.HTTPConnection.__init__(self, addr, port, timeout=timeout)
+        self.worker_addr = addr
+        self.worker_port = port
+
+    def connect(self):
+        self.sock = connect(self.worker_addr, self.worker_port, self.timeout)
+
+def tcp_probe(addr, port, timeout):
+    '''Returns True iff the worker accepts a TCP connection within timeout seconds'''
+    try:
+        sock = connect(addr, port, timeout)
+    except (socket.error, socket.timeout):
+        return False
+    sock.close()
+    return True
+
+def fcgi_probe(addr, port, timeout):
+    '''Returns True iff the worker answers a FCGI_GET_VALUES request within
+    timeout seconds'''
+    try:
+        sock = connect(addr, port, timeout)
+    except (socket.error, socket.timeout):
+        return False
+    try:
+        content = "".join([fcgi_name_value(name) for name in FCGI_PROBE_NAMES])
+        sock.sendall(fcgi_record(FCGI_GET_VALUES, 0, content))
+        header = recv_exactly(sock, FCGI_HEADER_LEN)
+        version, record_type, _, _, _, _ = struct.unpack("!BBHHBB", header)
+        return version == FCGI_VERSION_1 and record_type == FCGI_GET_VALUES_RESULT
+    except (socket.error, socket.timeout):
+        return False
+    finally:
+        sock.close()
+
+def fcgi_get(addr, port, timeout, path="/", query=""):
+    '''Sends a FastCGI GET request for path?query to the worker and returns the
+    worker's stdout (CGI headers and body). Raises socket.error (or socket.timeout)
+    if the request fails.'''
+    sock = connect(addr, port, timeout)
+    try:
+        params = "".join([fcgi_name_value(name, value) for name, value in [
+            ("REQUEST_METHOD", "GET"),
+            ("SCRIPT_NAME", path),
+            ("PATH_INFO", ""),
+            ("QUERY_STRING", query),
+            ("SERVER_NAME", addr if addr != UNIX_ADDR else "localhost"),
+            ("SERVER_PORT", str(port) if addr != UNIX_ADDR else "80"),
+            ("SERVER_PROTOCOL", "HTTP/1.1"),
+            ("CONTENT_LENGTH", "0"),
+        ]])
+        # request id 1, role responder, flags 0 (close the connection when done)
+        sock.sendall(
+            fcgi_record(FCGI_BEGIN_REQUEST, 1, struct.pack("!HB5x", FCGI_RESPONDER, 0)) +
+            fcgi_record(FCGI_PARAMS, 1, params) +
+            fcgi_record(FCGI_PARAMS, 1, "") +
+            fcgi_record(FCGI_STDIN, 1, ""))
+        stdout = []
+        while True:
+            header = recv_exactly(sock, FCGI_HEADER_LEN)
+            _, record_type, _, length, padding, _ = struct.unpack("!BBHHBB", header)
+            content = recv_exactly(sock, length + padding)[:length]
+            if record_type == FCGI_STDOUT:
+                stdout.append(content)
+            elif record_type == FCGI_END_REQUEST:
+                return "".join(stdout)
+    finally:
+        sock.close()
+
+def http_get(addr, port, timeout, path="/", query=""):
+    '''Sends an HTTP GET request for path?query to the worker and returns the body.
+    Raises socket.error (or httplib.HTTPException) if the request fails or the
+    status is 5xx. Other statuses (e.g. redirects to a login page) count as
+    served.'''
+    conn = WorkerHTTPConnection(addr, port, timeout)
+    try:
+        conn.request("GET", path + ("?" + query if query else ""))
+        response = conn.getresponse()
+        body = response.read()
+        if response.status >= 500:
+            raise httplib.HTTPException("status %d" % response.status)
+        return body
+    finally:
+        conn.close()
+
+def none_probe(addr, port, timeout):
+    '''Always succeeds; i.e. workers count as ready as soon as they are launched'''
+    return True
+
+PROBES = {
+    "tcp" : tcp_probe,
+    "fcgi" : fcgi_probe,
+    "none" : none_probe,
+}
+
+def wait_until_ready(probe, addr, port, popen_obj, timeout, interval):
+    '''Repeatedly probes the worker until it answers, the worker process exits,
+    or timeout seconds elapse.
+    probe is one of the keys in PROBES.
+    Returns the number of seconds it took for the worker to become ready, or
+    None if it never became ready.'''
+    probe_func = PROBES[probe]
+    start = time.time()
+    deadline = start + timeout
+    while True:
+        if popen_obj != None and popen_obj.poll() != None:
+            return None
+        now = time.time()
+        if now >= deadline:
+            return None
+        if probe_func(addr, port, min(interval * 10, deadline - now)):
+            return time.time() - start
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in PROBES:
+        print "Usage: %s [%s] addr port" % (sys.argv[0], "|".join(sorted(PROBES.keys())))
+        sys.exit(1)
+    addr = sys.argv[2]
+    port = sys.argv[3] if addr == UNIX_ADDR else int(sys.argv[3])
+    elapsed = wait_until_ready(sys.argv[1], addr, port, None, 10.0, 0.05)
+    if elapsed == None:
+        print "not ready"
+        sys.exit(1)
+    print "ready after %fs" % elapsed
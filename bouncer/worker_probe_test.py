@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== worker_probe_test.py ====
+#
+#
+import unittest
+import threading
+import os
+import shutil
+import tempfile
+from worker_probe import *
+
+class FakeWorker(threading.Thread):
+    '''Accepts one connection and answers with reply (a string)'''
+
+    def __init__(self, reply, socket_path=None):
+        '''Listens on a loopback port, or on socket_path if it is not None'''
+        super(FakeWorker, self).__init__()
+        self.daemon = True
+        self.reply = reply
+        if socket_path == None:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.bind(("127.0.0.1", 0))
+            self.port = self.listener.getsockname()[1]
+        else:
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener.bind(socket_path)
+            self.port = socket_path
+        self.listener.listen(1)
+        self.received = None
+
+    def run(self):
+        conn, _ = self.listener.accept()
+        self.received = recv_exactly(conn, FCGI_HEADER_LEN)
+        conn.sendall(self.reply)
+        conn.close()
+        self.listener.close()
+
+class Test_worker_probe(unittest.TestCase):
+
+    def test_fcgi_record(self):
+        record = fcgi_record(FCGI_GET_VALUES, 0, fcgi_name_value("FCGI_MAX_CONNS"))
+        self.assertEqual(len(record) % 8, 0)
+        self.assertEqual(record[:8], struct.pack("!BBHHBB", 1, FCGI_GET_VALUES, 0, 16, 0, 0))
+        self.assertEqual(record[8:10], "\x0e\x00")
+
+    def test_fcgi_probe(self):
+        worker = FakeWorker(fcgi_record(FCGI_GET_VALUES_RESULT, 0, fcgi_name_value("FCGI_MAX_CONNS", "1")))
+        worker.start()
+        self.assertTrue(fcgi_probe("127.0.0.1", worker.port, 1.0))
+        worker.join()
+        self.assertEqual(ord(worker.received[1]), FCGI_GET_VALUES)
+
+    def test_fcgi_probe_wrong_answer(self):
+        worker = FakeWorker("HTTP/1.0 400 Bad Request\r\n\r\n")
+        worker.start()
+        self.assertFalse(fcgi_probe("127.0.0.1", worker.port, 1.0))
+        worker.join()
+
+    def test_fcgi_get(self):
+        reply = fcgi_record(FCGI_STDOUT, 1, "Content-Type: text/html\r\n\r\n") + \
+            fcgi_record(FCGI_STDOUT, 1, "Oh hai!") + \
+            fcgi_record(FCGI_END_REQUEST, 1, "\x00" * 8)
+        worker = FakeWorker(reply)
+        worker.start()
+        self.assertEqual(fcgi_get("127.0.0.1", worker.port, 1.0),
+            "Content-Type: text/html\r\n\r\nOh hai!")
+        worker.join()
+        self.assertEqual(struct.unpack("!BBHHBB", worker.received)[1], FCGI_BEGIN_REQUEST)
+
+    def test_unix_socket(self):
+        socket_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(socket_dir, "worker.sock")
+            worker = FakeWorker(fcgi_record(FCGI_GET_VALUES_RESULT, 0, ""), path)
+            worker.start()
+            self.assertTrue(fcgi_probe(UNIX_ADDR, path, 1.0))
+            worker.join()
+            self.assertFalse(tcp_probe(UNIX_ADDR, os.path.join(socket_dir, "missing.sock"), 0.5))
+        finally:
+            shutil.rmtree(socket_dir)
+
+    def test_nobody_listening(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.assertFalse(tcp_probe("127.0.0.1", port, 0.5))
+        self.assertEqual(wait_until_ready("tcp", "127.0.0.1", port, None, 0.2, 0.05), None)
+
+if __name__ == '__main__':
+    unittest.main()
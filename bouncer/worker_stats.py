@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== worker_stats.py ====
+#
+# Lightweight counters and fixed-bucket histograms that BouncerProcessManager
+# keeps for each of its workers. They are cheap enough to update on every
+# kill / exit / restart, and they are exported by the stats() RPC (see
+# BouncerService.thrift) and aggregated by bouncer_stats.py.
+#
+# This module does not depend on thrift so that it can be used (and tested)
+# on its own.
+#
+
+import bisect
+
+# Bucket upper bounds (in seconds) for latency histograms, i.e. kill latency
+# (time from kill to exit) and exit-to-ready latency (time from exit until the
+# replacement worker passes its readiness probe). The last bucket catches
+# everything above the largest bound.
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+# Bucket upper bounds (in seconds) for worker lifetimes (uptime at exit)
+UPTIME_BUCKETS = [1.0, 10.0, 60.0, 300.0, 1800.0, 3600.0, 6 * 3600.0, 24 * 3600.0]
+
+class BucketHistogram:
+    '''A histogram with fixed bucket boundaries. counts[i] is the number of values
+    v such that bounds[i - 1] < v <= bounds[i]; counts[-1] holds the values larger
+    than bounds[-1].'''
+
+    def __init__(self, bounds, counts=None, total=0.0):
+        self.bounds = list(bounds)
+        if counts == None:
+            self.counts = [0] * (len(self.bounds) + 1)
+        else:
+            if len(counts) != len(self.bounds) + 1:
+                raise ValueError("len(counts) must be len(bounds) + 1")
+            self.counts = list(counts)
+        self.total = total
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def merge(self, other):
+        '''Adds the counts from other (which must have the same bounds) into self'''
+        if other.bounds != self.bounds:
+            raise ValueError("Cannot merge histograms with different bounds")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def num(self):
+        return sum(self.counts)
+
+    def mean(self):
+        num = self.num()
+        if num == 0:
+            return None
+        return self.total / num
+
+    def quantile(self, q):
+        '''Returns the upper bound of the bucket containing the q-quantile (0 <= q <= 1),
+        float("inf") if it falls in the overflow bucket, or None if the histogram
+        is empty.'''
+        num = self.num()
+        if num == 0:
+            return None
+        rank = max(1, int(round(q * num)))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if i < len(self.bounds):
+                    return self.bounds[i]
+                return float("inf")
+        return float("inf")
+
+class WorkerCounters:
+    '''Counters and histograms for one worker (across all of its restarts).
+    Callers are responsible for locking.'''
+
+    def __init__(self):
+        self.kills = 0
+        self.recycles = 0
+        self.restarts = 0
+        self.failed_starts = 0
+        self.kill_latency = BucketHistogram(LATENCY_BUCKETS)
+        self.exit_to_ready = BucketHistogram(LATENCY_BUCKETS)
+        self.lifetime = BucketHistogram(UPTIME_BUCKETS)
+
+        # time when the current instance of the worker was launched
+        self.start_time = None
+        # time of the most recent kill that has not been followed by an exit yet
+        self.kill_time = None
+        # time of the most recent exit that has not been followed by a ready worker yet
+        self.exit_time = None
+
+    def launched(self, now, restart):
+        self.start_time = now
+        if restart:
+            self.restarts += 1
+
+    def start_failed(self):
+        self.failed_starts += 1
+
+    def killed(self, now):
+        self.kills += 1
+        self.kill_time = now
+
+    def recycled(self, now):
+        '''Like killed, but for a worker that is killed to reclaim its memory'''
+        self.recycles += 1
+        self.kill_time = now
+
+    def exited(self, now):
+        if self.kill_time != None:
+            self.kill_latency.add(now - self.kill_time)
+            self.kill_time = None
+        if self.start_time != None:
+            self.lifetime.add(now - self.start_time)
+            self.start_time = None
+        self.exit_time = now
+
+    def ready(self, now):
+        if self.exit_time != None:
+            self.exit_to_ready.add(now - self.exit_time)
+            self.exit_time = None
+
+    def uptime(self, now):
+        '''Seconds since the current instance was launched (0.0 if it is not running)'''
+        if self.start_time == None:
+            return 0.0
+        return now - self.start_time
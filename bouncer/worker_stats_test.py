@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== worker_stats_test.py ====
+#
+#
+import unittest
+from worker_stats import *
+
+class Test_worker_stats(unittest.TestCase):
+
+    def test_histogram(self):
+        h = BucketHistogram([1.0, 2.0, 3.0])
+        self.assertEqual(h.quantile(0.5), None)
+        for value in [0.5, 1.0, 1.5, 2.5, 10.0]:
+            h.add(value)
+        self.assertEqual(h.counts, [2, 1, 1, 1])
+        self.assertEqual(h.quantile(0.0), 1.0)
+        self.assertEqual(h.quantile(0.4), 1.0)
+        self.assertEqual(h.quantile(0.6), 2.0)
+        self.assertEqual(h.quantile(1.0), float("inf"))
+        self.assertEqual(h.mean(), 3.1)
+
+        other = BucketHistogram([1.0, 2.0, 3.0], [0, 0, 3, 0], 7.5)
+        h.merge(other)
+        self.assertEqual(h.counts, [2, 1, 4, 1])
+        self.assertRaises(ValueError, h.merge, BucketHistogram([1.0]))
+
+    def test_counters(self):
+        c = WorkerCounters()
+        c.launched(100.0, False)
+        self.assertEqual(c.uptime(105.0), 5.0)
+        c.killed(110.0)
+        c.exited(110.5)
+        c.launched(110.6, True)
+        c.ready(111.5)
+        self.assertEqual((c.kills, c.restarts, c.failed_starts), (1, 1, 0))
+        self.assertEqual(c.kill_latency.counts[LATENCY_BUCKETS.index(0.5)], 1)
+        self.assertEqual(c.exit_to_ready.counts[LATENCY_BUCKETS.index(1.0)], 1)
+        self.assertEqual(c.lifetime.counts[UPTIME_BUCKETS.index(60.0)], 1)
+
+        # a crash (exit without a kill) does not count towards kill latency
+        c.exited(200.0)
+        self.assertEqual(c.kill_latency.num(), 1)
+        self.assertEqual(c.uptime(201.0), 0.0)
+
+        # recycling is not a kill, but its latency is tracked all the same
+        c.launched(201.0, True)
+        c.recycled(300.0)
+        c.exited(300.01)
+        self.assertEqual((c.kills, c.recycles), (1, 1))
+        self.assertEqual(c.kill_latency.num(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
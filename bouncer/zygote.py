@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== zygote.py ====
+#
+# A fork server ("zygote") for Python web-app workers.
+#
+# Normally a bouncer restarts a Python worker by launching a fresh
+# interpreter, which pays the full interpreter-startup and import cost on
+# every restart. In zygote mode the bouncer instead launches one zygote
+# process per bouncer. The zygote imports the app once, then forks a child
+# for every worker the bouncer asks for. Children start with the app already
+# loaded and share the zygote's memory copy-on-write.
+#
+# The zygote can preload either:
+#   (1) a Python file that defines a function serve(addr, port), which
+#       never returns while the worker is serving. For example
+#       ../apps/dummy_py_app/fcgi_worker_process.py
+#   (2) a Django project (by project directory and settings module); the
+#       children serve the Django WSGI handler over HTTP with gunicorn, like
+#       manage.py run_gunicorn
+#
+# Protocol (over a unix socket, one connection per worker):
+#   bouncer -> zygote   "spawn ADDR PORT\n"  (for Unix socket workers ADDR is
+#                       "unix" and PORT is the socket path; see
+#                       parse_worker in bouncer_common.py)
+#   zygote -> bouncer   "pid PID\n"  (or "error MESSAGE\n")
+#   zygote -> bouncer   "exit RETURNCODE\n" when the child terminates
+# RETURNCODE follows the subprocess.Popen convention (-N for signal N).
+#
+# The bouncer side of the protocol is the Zygote class, whose spawn method
+# returns a ZygoteProcess, which has the subset of the subprocess.Popen
+# interface that bouncers use (pid, poll, wait, terminate, kill).
+#
+# USAGE (normally invoked by Zygote.launch):
+#   ./zygote.py --socket /tmp/zygote.sock --module app.py --function serve
+#   ./zygote.py --socket /tmp/zygote.sock --django-path /path/to/project --django-settings settings
+#
+
+import sys
+import os
+import errno
+import imp
+import select
+import signal
+import socket
+import argparse
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+import shutil
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+ZYGOTE_PATH = os.path.realpath(__file__)
+
+from bouncer_common import UNIX_ADDR, format_worker
+
+class ZygoteError(Exception):
+    pass
+
+def returncode_from_status(status):
+    '''Converts a status from os.waitpid into a subprocess.Popen-style returncode'''
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+def load_module(path, function):
+    '''Imports the Python file at path and returns its function named function'''
+    module_dir = os.path.dirname(os.path.realpath(path))
+    if module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+    name = os.path.splitext(os.path.basename(path))[0]
+    module = imp.load_source(name, path)
+    return getattr(module, function)
+
+def load_django(project_path, settings_module):
+    '''Imports a Django project (and all of its INSTALLED_APPS and urls) and returns
+    a serve(addr, port) function that serves the project with gunicorn, like
+    "manage.py run_gunicorn ADDR:PORT" does (same defaults, including the
+    worker timeout)'''
+    project_path = os.path.realpath(project_path)
+    sys.path.insert(0, project_path)
+    sys.path.insert(0, os.path.dirname(project_path))
+    os.environ["DJANGO_SETTINGS_MODULE"] = settings_module
+
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.core import urlresolvers
+    from gunicorn.app.base import Application
+
+    # Import everything a request would import, so the children do not have to
+    for app in settings.INSTALLED_APPS:
+        __import__(app)
+    urlresolvers.get_resolver(None).url_patterns
+    handler = WSGIHandler()
+
+    # Children must not share database connections with each other
+    from django.db import connection
+    connection.close()
+
+    class DjangoApplication(Application):
+        '''Serves the preloaded handler'''
+
+        def __init__(self, bind):
+            self.bind = bind
+            Application.__init__(self)
+
+        def init(self, parser, opts, args):
+            return {"bind" : self.bind}
+
+        def load(self):
+            return handler
+
+    def serve(addr, port):
+        # gunicorn binds Unix sockets given as unix:/path/to/sock
+        if addr == UNIX_ADDR:
+            bind = format_worker(addr, port)
+        else:
+            bind = "%s:%d" % (addr, port)
+        # Application parses gunicorn's command line options, which the
+        # zygote's are not
+        sys.argv = sys.argv[:1]
+        DjangoApplication(bind).run()
+
+    return serve
+
+class ZygoteServer:
+    '''The zygote process itself'''
+
+    def __init__(self, socket_path, serve):
+        '''serve is the preloaded serve(addr, port) function'''
+        self.socket_path = socket_path
+        self.serve = serve
+        # maps the pid of each child to the connection of the bouncer that spawned it
+        self.children = {}
+
+    def handle_sigchld(self, signum, frame):
+        try:
+            os.write(self.sigchld_w, "x")
+        except OSError:
+            # the pipe is full, so the main loop will wake up anyway
+            pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            conn = self.children.pop(pid, None)
+            if conn != None:
+                try:
+                    conn.sendall("exit %d\n" % returncode_from_status(status))
+                except socket.error:
+                    pass
+                conn.close()
+
+    def child(self, conn, addr, port):
+        '''Runs in the forked child; never returns'''
+        code = 0
+        try:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            self.listener.close()
+            os.close(self.sigchld_r)
+            os.close(self.sigchld_w)
+            conn.close()
+            for other in self.children.values():
+                other.close()
+            self.serve(addr, port)
+        except:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def spawn(self, conn):
+        conn.settimeout(5.0)
+        request = ""
+        while not request.endswith("\n"):
+            chunk = conn.recv(1024)
+            if chunk == "":
+                conn.close()
+                return
+            request += chunk
+        parts = request.split()
+        if len(parts) != 3 or parts[0] != "spawn":
+            conn.sendall("error malformed request\n")
+            conn.close()
+            return
+        addr = parts[1]
+        try:
+            port = parts[2] if addr == UNIX_ADDR else int(parts[2])
+        except ValueError:
+            conn.sendall("error malformed port\n")
+            conn.close()
+            return
+        pid = os.fork()
+        if pid == 0:
+            self.child(conn, addr, port)
+        conn.settimeout(None)
+        conn.sendall("pid %d\n" % pid)
+        self.children[pid] = conn
+
+    def run(self):
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(64)
+
+        self.sigchld_r, self.sigchld_w = os.pipe()
+        import fcntl
+        fcntl.fcntl(self.sigchld_w, fcntl.F_SETFL, os.O_NONBLOCK)
+        signal.signal(signal.SIGCHLD, self.handle_sigchld)
+
+        while True:
+            try:
+                readable, _, _ = select.select([self.listener, self.sigchld_r], [], [])
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if self.sigchld_r in readable:
+                os.read(self.sigchld_r, 4096)
+                self.reap()
+            if self.listener in readable:
+                try:
+                    conn, _ = self.listener.accept()
+                except socket.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    self.spawn(conn)
+                except socket.error:
+                    traceback.print_exc()
+
+class ZygoteProcess:
+    '''A worker forked by the zygote. Mimics the parts of subprocess.Popen that
+    bouncers use. The worker is not a child of the bouncer, so its exit status
+    arrives over the zygote connection.'''
+
+    def __init__(self, conn, pid):
+        self.conn = conn
+        self.connfile = conn.makefile("r")
+        self.pid = pid
+        self.returncode = None
+        self.lock = threading.Lock()
+
+    def read_exit(self):
+        '''Blocks until the zygote reports that the worker exited'''
+        line = self.connfile.readline()
+        parts = line.split()
+        if len(parts) == 2 and parts[0] == "exit":
+            self.returncode = int(parts[1])
+        else:
+            # The zygote itself died; the worker is an orphan now. Kill it so the
+            # bouncer does not lose track of the port.
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.returncode = -signal.SIGKILL
+        self.connfile.close()
+        self.conn.close()
+
+    def poll(self):
+        if self.returncode != None:
+            return self.returncode
+        # If another thread is blocked in wait(), it will set returncode
+        if not self.lock.acquire(False):
+            return self.returncode
+        try:
+            if self.returncode == None:
+                readable, _, _ = select.select([self.conn], [], [], 0.0)
+                if len(readable) > 0:
+                    self.read_exit()
+        finally:
+            self.lock.release()
+        return self.returncode
+
+    def wait(self):
+        with self.lock:
+            if self.returncode == None:
+                self.read_exit()
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode == None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+class Zygote:
+    '''The bouncer's handle on a zygote process'''
+
+    def __init__(self, popen_obj, socket_dir, socket_path):
+        self.popen_obj = popen_obj
+        self.socket_dir = socket_dir
+        self.socket_path = socket_path
+
+    @staticmethod
+    def launch(args, timeout=60.0, **popen_kwargs):
+        '''Launches a zygote process with the given command-line args (see the
+        USAGE section at the top of this file, minus --socket). Blocks until the
+        zygote has preloaded the app and is accepting spawn requests.
+        popen_kwargs are passed on to subprocess.Popen (e.g. stdout, stderr).
+        Returns a Zygote object, or raises ZygoteError.'''
+        socket_dir = tempfile.mkdtemp(prefix="zygote")
+        socket_path = os.path.join(socket_dir, "zygote.sock")
+        cmd = [sys.executable, ZYGOTE_PATH, "--socket", socket_path] + args
+        popen_obj = subprocess.Popen(cmd, **popen_kwargs)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if popen_obj.poll() != None:
+                shutil.rmtree(socket_dir, True)
+                raise ZygoteError("zygote exited with returncode %d" % popen_obj.returncode)
+            # An empty connection is harmless; the zygote just closes it
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+                return Zygote(popen_obj, socket_dir, socket_path)
+            except socket.error:
+                time.sleep(0.01)
+            finally:
+                probe.close()
+        popen_obj.kill()
+        shutil.rmtree(socket_dir, True)
+        raise ZygoteError("zygote did not start within %fs" % timeout)
+
+    def spawn(self, addr, port):
+        '''Asks the zygote to fork a worker that serves on addr:port. Returns a
+        ZygoteProcess or raises ZygoteError'''
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+            conn.sendall("spawn %s %s\n" % (addr, port))
+            connfile = conn.makefile("r")
+            line = connfile.readline()
+            connfile.close()
+        except socket.error, e:
+            conn.close()
+            raise ZygoteError("could not reach zygote: %s" % e)
+        parts = line.split()
+        if len(parts) != 2 or parts[0] != "pid":
+            conn.close()
+            raise ZygoteError("zygote refused to spawn %s:%s: %s" % (addr, port, line.strip()))
+        return ZygoteProcess(conn, int(parts[1]))
+
+    def close(self):
+        try:
+            self.popen_obj.kill()
+        except OSError:
+            pass
+        self.popen_obj.wait()
+        shutil.rmtree(self.socket_dir, True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fork server for Python web-app workers')
+    parser.add_argument("-s", "--socket", type=str, required=True,
+                        help="REQUIRED. Path of the unix socket to listen on")
+    parser.add_argument("-m", "--module", type=str, default=None,
+                        help="Python file that defines the serve function")
+    parser.add_argument("-f", "--function", type=str, default="serve",
+                        help="Default=%(default)s. Name of the function in MODULE that serves the app. "
+                        "It is called as FUNCTION(addr, port) in each forked worker.")
+    parser.add_argument("--django-path", type=str, default=None,
+                        help="Directory of a Django project to preload (instead of MODULE)")
+    parser.add_argument("--django-settings", type=str, default="settings",
+                        help="Default=%(default)s. Django settings module")
+    args = parser.parse_args()
+
+    if args.module != None:
+        serve = load_module(args.module, args.function)
+    elif args.django_path != None:
+        serve = load_django(args.django_path, args.django_settings)
+    else:
+        parser.error("One of --module or --django-path is required")
+
+    ZygoteServer(args.socket, serve).run()
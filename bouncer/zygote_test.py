@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== zygote_test.py ====
+#
+#
+import unittest
+from zygote import *
+import worker_probe
+
+# A tiny "app" for the zygote to preload: accepts connections and closes them
+APP = '''
+import socket
+PRELOADED = True
+def serve(addr, port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((addr, port))
+    listener.listen(5)
+    while True:
+        conn, _ = listener.accept()
+        conn.close()
+'''
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+class Test_zygote(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        app_path = os.path.join(self.tempdir, "zygote_test_app.py")
+        with open(app_path, "w") as f:
+            f.write(APP)
+        self.zygote = Zygote.launch(["--module", app_path], timeout=10.0)
+
+    def tearDown(self):
+        self.zygote.close()
+        shutil.rmtree(self.tempdir, True)
+
+    def test_spawn_kill(self):
+        port = free_port()
+        process = self.zygote.spawn("127.0.0.1", port)
+        self.assertTrue(process.pid > 0)
+        self.assertEqual(process.poll(), None)
+        self.assertNotEqual(worker_probe.wait_until_ready("tcp", "127.0.0.1", port, process, 5.0, 0.01), None)
+        process.kill()
+        self.assertEqual(process.wait(), -signal.SIGKILL)
+        self.assertEqual(process.poll(), -signal.SIGKILL)
+
+        # the port can be reused by a fresh worker
+        process = self.zygote.spawn("127.0.0.1", port)
+        self.assertNotEqual(worker_probe.wait_until_ready("tcp", "127.0.0.1", port, process, 5.0, 0.01), None)
+        process.terminate()
+        self.assertEqual(process.wait(), -signal.SIGTERM)
+
+    def test_bad_worker_exits(self):
+        # bind fails for a bogus address, so the child exits with code 1
+        process = self.zygote.spawn("256.0.0.1", free_port())
+        self.assertEqual(process.wait(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
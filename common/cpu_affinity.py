@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== cpu_affinity.py ====
+#
+# CPU affinity and scheduling priority for processes (Linux only).
+#
+# Python 2 has no os.sched_setaffinity, so this calls into libc via ctypes.
+#
+# On Linux, sched_setaffinity and setpriority(PRIO_PROCESS) act on a single
+# thread: set_affinity, set_nice and partition only change the thread whose
+# id they are given (0 = the calling thread). Threads and processes inherit
+# both settings from the thread that creates them, so setting them in a Popen
+# preexec_fn (in the single-threaded child) covers everything the worker
+# starts later. partition_process also changes the threads (and optionally the
+# descendant processes) that a running process has already started.
+#
+# USAGE: ./cpu_affinity.py pid [cpu,cpu,...]
+#
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import sys
+
+import procinfo
+
+# size of cpu_set_t in glibc (1024 cpus)
+CPU_SETSIZE = 1024
+
+PRIO_PROCESS = 0
+
+class CpuSet(ctypes.Structure):
+    _fields_ = [("bits", ctypes.c_ulong * (CPU_SETSIZE / (8 * ctypes.sizeof(ctypes.c_ulong))))]
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+def _check(result):
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+def cpu_count():
+    return os.sysconf("SC_NPROCESSORS_ONLN")
+
+def set_affinity(pid, cpus):
+    '''Restricts the thread pid (0 = the calling thread) to the cpus (a list of
+    ints). Raises OSError on failure'''
+    cpu_set = CpuSet()
+    bits_per_word = 8 * ctypes.sizeof(ctypes.c_ulong)
+    for cpu in cpus:
+        if cpu < 0 or cpu >= CPU_SETSIZE:
+            raise ValueError("bad cpu number %d" % cpu)
+        cpu_set.bits[cpu / bits_per_word] |= 1 << (cpu % bits_per_word)
+    _check(_libc.sched_setaffinity(pid, ctypes.sizeof(cpu_set), ctypes.byref(cpu_set)))
+
+def get_affinity(pid):
+    '''Returns the list of cpus the thread pid (0 = the calling thread) may run
+    on. Raises OSError on failure'''
+    cpu_set = CpuSet()
+    _check(_libc.sched_getaffinity(pid, ctypes.sizeof(cpu_set), ctypes.byref(cpu_set)))
+    bits_per_word = 8 * ctypes.sizeof(ctypes.c_ulong)
+    return [cpu for cpu in range(CPU_SETSIZE)
+        if cpu_set.bits[cpu / bits_per_word] & (1 << (cpu % bits_per_word))]
+
+def set_nice(pid, nice):
+    '''Sets the nice value of the thread pid (0 = the calling thread; see the
+    BUGS section of setpriority(2)). Lowering the nice value requires root.
+    Raises OSError on failure'''
+    _check(_libc.setpriority(PRIO_PROCESS, pid, nice))
+
+def partition(cpus=None, nice=None, pid=0):
+    '''Applies cpus and nice (either may be None, meaning leave unchanged) to the
+    thread pid (0 = the calling thread)'''
+    if cpus != None:
+        set_affinity(pid, cpus)
+    if nice != None:
+        set_nice(pid, nice)
+
+def thread_ids(pid):
+    '''Returns the ids of the threads of process pid'''
+    try:
+        return [int(tid) for tid in os.listdir("/proc/%d/task" % pid)]
+    except OSError:
+        return [pid]
+
+def partition_process(cpus=None, nice=None, pid=0, children=False):
+    '''Like partition, but applies to every thread of process pid (0 = the calling
+    process), and if children is True to every thread of its descendants.
+    Threads that exit meanwhile are skipped'''
+    if pid == 0:
+        pid = os.getpid()
+    pids = [pid]
+    if children:
+        pids += procinfo.descendants(pid)
+    for process in pids:
+        for tid in thread_ids(process):
+            try:
+                partition(cpus, nice, tid)
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+if __name__ == "__main__":
+    pid = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        set_affinity(pid, [int(cpu) for cpu in sys.argv[2].split(",")])
+    print "cpus=%s" % get_affinity(pid)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== procinfo.py ====
+#
+# Reads per-process memory usage from /proc (Linux only).
+#
+# Many workers (php-cgi, flup's fcgi_fork, mongrel) fork children of their own,
+# so the *_tree functions add up a process and all of its descendants.
+#
+# USAGE: ./procinfo.py pid
+#
+
+import os
+import sys
+
+def parent_pid(pid):
+    '''Returns the parent pid of pid, or None if pid does not exist'''
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            stat = f.read()
+    except IOError:
+        return None
+    # the command name (field 2) is in parentheses and may contain spaces
+    fields = stat[stat.rindex(")") + 2:].split()
+    return int(fields[1])
+
+def descendants(pid):
+    '''Returns the list of pids of all descendants of pid (not including pid)'''
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        ppid = parent_pid(int(entry))
+        if ppid != None:
+            children.setdefault(ppid, []).append(int(entry))
+    result = []
+    stack = [pid]
+    while len(stack) > 0:
+        for child in children.get(stack.pop(), []):
+            result.append(child)
+            stack.append(child)
+    return result
+
+def rss_kb(pid):
+    '''Returns the resident set size of pid in kB, or 0 if pid does not exist'''
+    try:
+        with open("/proc/%d/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+def pss_kb(pid):
+    '''Returns the proportional set size of pid in kB, i.e. its resident memory with
+    every shared page divided among the processes sharing it. Unlike RSS, PSS
+    reflects copy-on-write sharing between forked processes. Returns 0 if pid
+    does not exist (or its smaps are not readable).'''
+    total = 0
+    try:
+        with open("/proc/%d/smaps" % pid) as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    total += int(line.split()[1])
+    except IOError:
+        pass
+    return total
+
+def rss_tree_kb(pid):
+    '''Returns the total RSS (in kB) of pid and all of its descendants'''
+    return sum([rss_kb(p) for p in [pid] + descendants(pid)])
+
+def pss_tree_kb(pid):
+    '''Returns the total PSS (in kB) of pid and all of its descendants'''
+    return sum([pss_kb(p) for p in [pid] + descendants(pid)])
+
+if __name__ == "__main__":
+    pid = int(sys.argv[1])
+    print "rss=%dkB pss=%dkB rss_tree=%dkB pss_tree=%dkB" % \
+        (rss_kb(pid), pss_kb(pid), rss_tree_kb(pid), pss_tree_kb(pid))
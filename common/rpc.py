@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== rpc.py ====
+#
+# Builds Thrift servers and clients for the bouncers and the sig service, so
+# that the server mode is selected in one place (see "rpc" in
+# ../bouncer/bouncer_common.py):
+#
+#   threadpool  -- TThreadPoolServer: one handler thread per open connection,
+#                  CONCURRENCY threads. Buffered transport.
+#   nonblocking -- TNonblockingServer: a single select() loop reads requests
+#                  and hands complete requests to a pool of CONCURRENCY
+#                  handler threads. Framed transport, so clients must use
+#                  framed transport too (client_transport does this).
+#   processpool -- TProcessPoolServer: CONCURRENCY forked processes accept
+#                  connections from a shared listening socket. Buffered
+#                  transport. Handlers do not share memory with the parent,
+#                  so only suitable for handlers that just forward work through
+#                  a multiprocessing queue (i.e. the sig service).
+#
+
+import import_thrift_lib
+
+from thrift.transport import TSocket
+from thrift.transport import TTransport
+from thrift.protocol import TBinaryProtocol
+from thrift.server import TServer
+from thrift.server import TNonblockingServer
+from thrift.server import TProcessPoolServer
+
+def make_server(processor, port, mode, concurrency):
+    '''Returns a Thrift server (not yet serving) for processor, listening on port'''
+    transport = TSocket.TServerSocket(port=port)
+    pfactory = TBinaryProtocol.TBinaryProtocolFactory()
+    if mode == "threadpool":
+        tfactory = TTransport.TBufferedTransportFactory()
+        server = TServer.TThreadPoolServer(processor, transport, tfactory, pfactory)
+        server.setNumThreads(concurrency)
+    elif mode == "nonblocking":
+        server = TNonblockingServer.TNonblockingServer(processor, transport, pfactory,
+            threads=concurrency)
+    elif mode == "processpool":
+        tfactory = TTransport.TBufferedTransportFactory()
+        server = TProcessPoolServer.TProcessPoolServer(processor, transport, tfactory, pfactory)
+        server.setNumWorkers(concurrency)
+    else:
+        raise ValueError("Unknown rpc mode '%s'" % mode)
+    return server
+
+def client_transport(addr, port, mode):
+    '''Returns an unopened client transport that can talk to a server built by
+    make_server(..., mode, ...)'''
+    transport = TSocket.TSocket(addr, port)
+    if mode == "nonblocking":
+        return TTransport.TFramedTransport(transport)
+    else:
+        return TTransport.TBufferedTransport(transport)
+
+def make_client(client_class, addr, port, mode):
+    '''Returns (client, transport) where client is an instance of client_class
+    (e.g. BouncerService.Client) and transport is unopened'''
+    transport = client_transport(addr, port, mode)
+    protocol = TBinaryProtocol.TBinaryProtocol(transport)
+    return client_class(protocol), transport
@@ -30,6 +30,10 @@ SUDO="/usr/bin/sudo"
 
 MYSQL_USER="root"
 MYSQL_PASSWORD="dummyP@ssw0rd"
+# Exported under different names so that they do not clobber the per-worker
+# MYSQL_USER that bouncers pass to workers (used by php_bouncer's SqlKiller)
+export MYSQL_ADMIN_USER="$MYSQL_USER"
+export MYSQL_ADMIN_PASSWORD="$MYSQL_PASSWORD"
 DOWNLOAD_DIR="$DIR/downloads"
 
 NGINX_DL_REMOTE_PATH="http://nginx.org/download/nginx-1.2.0.tar.gz"
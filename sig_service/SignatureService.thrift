@@ -22,6 +22,52 @@
  *
  */
 
+/**
+ * The results of classifying new samples with the live signature over the
+ * last window seconds (see shadow.py). Evicted samples are the positives.
+ */
+struct ConfusionMatrix {
+    1: double window,
+    2: i64 tp,
+    3: i64 fp,
+    4: i64 tn,
+    5: i64 fn
+}
+
+/**
+ * The state of one shard's learner (see LearnThread in sigservice.py). Apart
+ * from queue_depth, the fields are as of the learner's most recent update
+ * cycle.
+ */
+struct ShardStats {
+    1: string name,
+    2: string sig_file,
+    // notices waiting in the shard's queue
+    3: i64 queue_depth,
+    // notices the learner has taken from its queue
+    4: i64 samples,
+    // number of update cycles (validate, build, write) completed
+    5: i64 cycles,
+    // version of the most recently published signature (see sigfile.py)
+    6: i64 model_version,
+    // seconds the most recent cycle spent validating the current samples,
+    // building the new model, and comparing and writing the signature
+    7: double validate_seconds,
+    8: double build_seconds,
+    9: double write_seconds,
+    // unix time at which the most recent cycle ended; 0.0 before the first
+    10: double last_update,
+    // shadow evaluation, one matrix per window
+    11: list<ConfusionMatrix> shadow
+}
+
+struct SigServiceStats {
+    // the default shard is last
+    1: list<ShardStats> shards,
+    // seconds since the sigservice started
+    2: double uptime
+}
+
 service SignatureService {
 
     /**
@@ -34,5 +80,10 @@ service SignatureService {
      */
     oneway void completed(1: string request_str)
 
+    /**
+     * Called by operators and tools (e.g. sigservice_benchmark.py)
+     */
+    SigServiceStats stats()
+
 }
 
@@ -16,11 +16,39 @@
 #
 # ==== bayes.py ====
 #
+# A naive bayesian classifier over sets of tokens.
+#
+# The model only depends on how many positive and negative messages contain
+# each token, so IncrementalModel keeps those counts (TokenCounts) up to date
+# as messages are added and removed (e.g. as they enter and leave the
+# sigservice's sample window), and only re-ranks the tokens whose counts
+# changed since the previous build. Classifier builds a model from scratch.
+#
+# Classifier.classify_batch scores many messages at once. With engine="numpy"
+# it maps tokens to a vocabulary index and scores the whole batch with one
+# sparse (message x token) matrix product against arrays of log-probabilities
+# (see NumpyScorer). The decisions are identical to the pure-Python engine:
+# messages whose scores are too close to call in floating point, or whose
+# probability products underflow, are re-scored with Classifier.classify.
+#
+# FeatureHasher bounds the number of distinct tokens (and therefore the memory
+# and CPU of every model update), even if every request carries unique random
+# tokens: it replaces each token with the token of one of feature_buckets
+# buckets (see feature_token), in training and in the signature. Consumers of
+# such a signature must hash their tokens the same way.
+#
 
 import sys
+import collections
+import heapq
 import itertools
+import math
+import multiprocessing
 import random
+import threading
+import time
 import json
+import zlib
 import re
 import os
 import argparse
@@ -32,74 +60,176 @@ sys.path.append(os.path.join(DIRNAME, '..', 'common'))
 
 import log
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ENGINES = ["python", "numpy"]
+
+# see MAX_TOKEN_STR_LEN in ../nginx_doorman/bayes.h
+MAX_TOKEN_LEN = 127
+
+# prefix of the tokens that stand for feature buckets. No tokenizer produces
+# tokens that start with it
+FEATURE_PREFIX = "#"
+
+# the result of testing one fold (see Validate)
+FoldResult = collections.namedtuple("FoldResult", ["fold", "tp", "fp", "tn", "fn", "seconds"])
+
+# Validate only tests folds in parallel when there are at least this many samples
+PARALLEL_THRESHOLD = 4000
+
+# TokenCounts.difference forgets tokens whose counts are all within this of 0
+COUNT_EPSILON = 1e-9
+
+def make_pool(processes=None):
+    '''Returns a process pool for Validate, with one process per CPU if processes
+    is None, or None if the pool would have fewer than 2 processes.
+
+    Processes fork with a copy of the caller's locks, and a lock that another
+    thread held at the time stays locked forever in the child. So
+    multi-threaded programs must create the pool before starting any threads,
+    and keep it for their lifetime'''
+    if processes == None:
+        processes = multiprocessing.cpu_count()
+    if processes < 2:
+        return None
+    return multiprocessing.Pool(processes)
+
+def test_fold(args):
+    '''Returns the FoldResult for one fold. args is (fold_num, counts, test_positive,
+    test_negative, kwargs), where counts are the TokenCounts of all samples,
+    test_positive and test_negative are the fold's lists of (message, weight),
+    and kwargs are IncrementalModel's options.
+
+    This runs in Validate's pool, so it must not log (see make_pool)'''
+    fold_num, counts, test_positive, test_negative, kwargs = args
+    start = time.time()
+    test_counts = TokenCounts()
+    for message, weight in test_positive:
+        test_counts.add("positive", message, weight)
+    for message, weight in test_negative:
+        test_counts.add("negative", message, weight)
+    model = IncrementalModel(counts=counts.difference(test_counts), **kwargs)
+    classifier = model.classifier()
+
+    tp = 0
+    fn = 0
+    for result in classifier.classify_batch([message for message, weight in test_positive]):
+        if result == "positive":
+            tp += 1
+        else:
+            fn += 1
+    tn = 0
+    fp = 0
+    for result in classifier.classify_batch([message for message, weight in test_negative]):
+        if result == "negative":
+            tn += 1
+        else:
+            fp += 1
+    return FoldResult(fold_num, tp, fp, tn, fn, time.time() - start)
+
 class Validate:
+    '''k-fold cross validation. Every sample is in the test set of exactly one fold,
+    and each fold's model is trained on the samples of the other folds.
 
-    def __init__(self, positive, negative, logger, **kwargs):
+    The token counts of all samples are computed once; the training counts for
+    each fold are derived by subtracting the counts of the fold's test samples.
+    Samples count as many times as their weight (see weighted_samples) in
+    training; the tp, fp, tn and fn of the test sets count every sample once.
+
+    When there are at least parallel_threshold samples, the folds are tested in
+    parallel by pool (see make_pool), or if pool is None, by a pool of
+    processes that is created for each validation (None means one per CPU).
+    Programs with threads must pass a pool'''
+
+    def __init__(self, positive, negative, logger, processes=None, parallel_threshold=PARALLEL_THRESHOLD,
+            pool=None, **kwargs):
         self.positive = positive
         self.negative = negative
         self.logger = logger
+        self.processes = processes
+        self.parallel_threshold = parallel_threshold
+        self.pool = pool
         self.kwargs = kwargs
 
-    def test_fold(self, test_positive, test_negative, train_positive, train_negative, fold_num):
-        classifier = Classifier(train_positive, train_negative, **self.kwargs)
-        tp = 0
-        fp = 0
-        tn = 0
-        fn = 0
-        count = 0
-        for positive_example in test_positive:
-            count += 1
-            result = classifier.classify(positive_example)
-            if result == "positive":
-                tp += 1
-                self.logger.debug("(%d, %d) true positive", fold_num, count)
-            else:
-                fn += 1
-                self.logger.debug("(%d, %d) false neative", fold_num, count)
-        for negative_example in test_negative:
-            count += 1
-            result = classifier.classify(negative_example)
-            if result == "negative":
-                tn += 1
-                self.logger.debug("(%d, %d) true negative", fold_num, count)
-            else:
-                fp += 1
-                self.logger.debug("(%d, %d) false positive", fold_num, count)
-        self.tp += tp
-        self.fp += fp
-        self.tn += tn
-        self.fn += fn
-
-    def validate(self, num_folds=10):
-        # do num_folds_times
-        # train on 9/10ths of data
-        # test on the other 10ths of data
-        # for now to make life simple, use random sampling to produce folds
-        self.tp = 0
-        self.fp = 0
-        self.tn = 0
-        self.fn = 0
-
-        for i in xrange(0, num_folds):
-            random.shuffle(self.positive)
-            random.shuffle(self.negative)
+    def fold_args(self, fold_num):
+        return (fold_num, self.counts, self.test_positive[fold_num], self.test_negative[fold_num], self.kwargs)
 
-            num_test_positive = max(1, int(len(self.positive) / float(num_folds)))
-            num_test_negative = max(1, int(len(self.negative) / float(num_folds)))
+    def test_fold(self, fold_num):
+        '''Returns the FoldResult for fold fold_num'''
+        return test_fold(self.fold_args(fold_num))
 
-            train_positive = self.positive[0:num_test_positive]
-            test_positive = self.positive[num_test_positive:]
-            train_negative = self.negative[0:num_test_negative]
-            test_negative = self.negative[num_test_negative:]
+    def validate(self, num_folds=10):
+        '''Returns the aggregate (tp, fp, tn, fn). Also sets self.folds to the list of
+        FoldResults, and self.seconds to the time the validation took'''
+        start = time.time()
+
+        # randomly assign each sample to a fold (without reordering the caller's lists)
+        self.test_positive = self.split(list(weighted_samples(self.positive)), num_folds)
+        self.test_negative = self.split(list(weighted_samples(self.negative)), num_folds)
+        self.counts = TokenCounts()
+        for fold in self.test_positive:
+            for message, weight in fold:
+                self.counts.add("positive", message, weight)
+        for fold in self.test_negative:
+            for message, weight in fold:
+                self.counts.add("negative", message, weight)
+
+        parallel = len(self.positive) + len(self.negative) >= self.parallel_threshold
+        processes = self.processes if self.processes != None else multiprocessing.cpu_count()
+        processes = min(processes, num_folds)
+        if parallel and self.pool != None:
+            self.folds = self.pool.map(test_fold, map(self.fold_args, range(num_folds)))
+        elif parallel and processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                self.folds = pool.map(test_fold, map(self.fold_args, range(num_folds)))
+            finally:
+                pool.terminate()
+        else:
+            self.folds = [self.test_fold(i) for i in xrange(num_folds)]
 
-            self.test_fold(test_positive, test_negative, train_positive, train_negative, i)
+        self.tp = sum(fold.tp for fold in self.folds)
+        self.fp = sum(fold.fp for fold in self.folds)
+        self.tn = sum(fold.tn for fold in self.folds)
+        self.fn = sum(fold.fn for fold in self.folds)
+        self.seconds = time.time() - start
 
+        for fold in self.folds:
+            self.logger.debug("fold %d: tp = %d, fp = %d, tn = %d, fn = %d (%fs)", *fold)
         self.logger.debug("tp = %d", self.tp)
         self.logger.debug("fp = %d", self.fp)
         self.logger.debug("tn = %d", self.tn)
         self.logger.debug("fn = %d", self.fn)
         return (self.tp, self.fp, self.tn, self.fn)
 
+    @staticmethod
+    def split(samples, num_folds):
+        '''Returns a list of num_folds disjoint lists that together contain every
+        sample (e.g. every (message, weight))'''
+        order = range(len(samples))
+        random.shuffle(order)
+        return [[samples[i] for i in order[fold::num_folds]] for fold in xrange(num_folds)]
+
+def token_probs(positive_count, negative_count, num_positive_messages, num_negative_messages):
+    '''Returns (P(token | positive), P(token | negative)) for a token that occurs in
+    positive_count of the num_positive_messages positive messages, and similarly
+    for negative'''
+    positive_count = max(positive_count, 0.5)
+    negative_count = max(negative_count, 0.5)
+    if num_positive_messages == 0:
+        positive_prob = 1.0 / float(num_negative_messages + 1)
+    else:
+        positive_prob = positive_count / float(num_positive_messages)
+
+    if num_negative_messages == 0:
+        negative_prob = 1.0 / float(num_positive_messages + 1)
+    else:
+        negative_prob = negative_count / float(num_negative_messages)
+    return positive_prob, negative_prob
+
 class Prob:
 
     def __init__(self):
@@ -125,74 +255,287 @@ class Prob:
         return abs(self.positive_prob - self.negative_prob)
 
     def done(self, num_positive_messages, num_negative_messages):
+        self.positive_prob, self.negative_prob = token_probs(self.positive_count, self.negative_count,
+            num_positive_messages, num_negative_messages)
         self.positive_count = max(self.positive_count, 0.5)
         self.negative_count = max(self.negative_count, 0.5)
-        if num_positive_messages == 0:
-            self.positive_prob = 1.0 / float(num_negative_messages + 1)
-        else:
-            self.positive_prob = self.positive_count / float(num_positive_messages)
-
-        if num_negative_messages == 0:
-            self.negative_prob = 1.0 / float(num_positive_messages + 1)
-        else:
-            self.negative_prob = self.negative_count / float(num_negative_messages)
 
     def __str__(self):
         return "rank=%f, pcount=%d, ncount=%d, pprob=%s, nprob=%s" % \
             (self.rank(),
             self.positive_count, self.negative_count, self.positive_prob, self.negative_prob)
 
+class TokenCounts:
+    '''Running counts of the positive and negative messages that contain each token'''
+
+    def __init__(self):
+        self.num_positive = 0
+        self.num_negative = 0
+        # maps each token to [positive_count, negative_count]
+        self.counts = {}
+        # the tokens whose counts changed since the last call to clear_dirty
+        self.dirty = set()
+
+    def add(self, category, message, weight=1):
+        '''message is a set of tokens. A message with weight w counts as w messages
+        (messages with fractional weights cannot be removed)'''
+        index = self.index(category, weight)
+        for token in message:
+            counts = self.counts.get(token)
+            if counts == None:
+                counts = self.counts[token] = [0, 0]
+            counts[index] += weight
+        self.dirty.update(message)
+
+    def remove(self, category, message):
+        '''message must have been added (to category) before'''
+        index = self.index(category, -1)
+        for token in message:
+            counts = self.counts[token]
+            counts[index] -= 1
+            if counts[0] == 0 and counts[1] == 0:
+                del self.counts[token]
+        self.dirty.update(message)
+
+    def index(self, category, delta):
+        '''Adds delta to the number of messages in category and returns the index
+        of category in the count lists'''
+        if category == "positive":
+            self.num_positive += delta
+            return 0
+        elif category == "negative":
+            self.num_negative += delta
+            return 1
+        raise ValueError("Unknown category: %s" % category)
+
+    def difference(self, other):
+        '''Returns a new TokenCounts for the messages counted by self but not by other
+        (which must have counted a subset of self's messages)'''
+        result = TokenCounts()
+        result.num_positive = self.num_positive - other.num_positive
+        result.num_negative = self.num_negative - other.num_negative
+        other_counts = other.counts
+        for token, counts in self.counts.iteritems():
+            subtract = other_counts.get(token)
+            if subtract == None:
+                result.counts[token] = list(counts)
+            elif counts != subtract:
+                positive_count = counts[0] - subtract[0]
+                negative_count = counts[1] - subtract[1]
+                # weighted counts might not cancel out exactly
+                if abs(positive_count) > COUNT_EPSILON or abs(negative_count) > COUNT_EPSILON:
+                    result.counts[token] = [positive_count, negative_count]
+        result.dirty = set(result.counts)
+        return result
+
+    def clear_dirty(self):
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
+class IncrementalModel:
+    '''Maintains a model (see Classifier) under additions and removals of messages.
+
+    build() ranks the tokens in O(number of tokens) when the number of positive or
+    negative messages changed since the last build (since that changes every
+    token's probabilities), and otherwise only re-ranks the tokens whose counts
+    changed. E.g. once a sliding window of samples is full, the cost of a build
+    scales with the number of samples that entered and left the window.
+
+    The top model_size tokens are likewise chosen from a candidate set of about
+    CANDIDATE_FACTOR * model_size tokens: every ranked token outside the set
+    ranks below the set's floor, so the candidates hold the true top tokens as
+    long as model_size of them still rank at or above the floor. Otherwise (or
+    once the set has grown too large) build() re-selects the candidates from the
+    whole vocabulary.'''
+
+    CANDIDATE_FACTOR = 2
+
+    def __init__(self, model_size=5000, rare_threshold=0.05, engine="python", counts=None):
+        '''counts is the TokenCounts to start from (by default, no messages)'''
+        self.model_size = model_size
+        self.rare_threshold = rare_threshold
+        self.engine = engine
+        self.counts = counts if counts != None else TokenCounts()
+        # maps every token that is not rare to (rank, positive_prob, negative_prob)
+        self.ranks = {}
+        # (num_positive, num_negative) as of the last build
+        self.totals = None
+        # a subset of ranks that contains the top tokens (see select)
+        self.candidates = set()
+        # the lowest key (see key) of the candidates when they were selected, or
+        # None if every ranked token is a candidate
+        self.floor = None
+
+    def add(self, category, message, weight=1):
+        self.counts.add(category, message, weight)
+
+    def remove(self, category, message):
+        self.counts.remove(category, message)
+
+    def key(self, token):
+        '''The information gain of token (ties are broken by token, so that the
+        model is deterministic)'''
+        return (self.ranks[token][0], token)
+
+    def select(self):
+        '''Re-selects the candidates from all ranked tokens'''
+        size = max(self.CANDIDATE_FACTOR * self.model_size, 1)
+        if len(self.ranks) <= size:
+            self.candidates = set(self.ranks)
+            self.floor = None
+        else:
+            best = heapq.nlargest(size, self.ranks, key=self.key)
+            self.candidates = set(best)
+            self.floor = self.key(best[-1])
+
+    def build(self):
+        '''Returns a dict that maps each token in the model to its Prob'''
+        num_positive = self.counts.num_positive
+        num_negative = self.counts.num_negative
+        dirty = self.counts.clear_dirty()
+        full = self.totals != (num_positive, num_negative)
+        if full:
+            self.totals = (num_positive, num_negative)
+            self.ranks = {}
+            tokens = self.counts.counts.iterkeys()
+        else:
+            tokens = dirty
+
+        for token in tokens:
+            self.ranks.pop(token, None)
+            self.candidates.discard(token)
+            counts = self.counts.counts.get(token)
+            if counts == None:
+                continue
+            positive_prob, negative_prob = token_probs(counts[0], counts[1], num_positive, num_negative)
+            # filter out rare tokens
+            if max(positive_prob, negative_prob) >= self.rare_threshold:
+                self.ranks[token] = (abs(positive_prob - negative_prob), positive_prob, negative_prob)
+                # a token that now ranks above the floor must be a candidate
+                if not full and (self.floor == None or self.key(token) >= self.floor):
+                    self.candidates.add(token)
+
+        if full or len(self.candidates) > 2 * self.CANDIDATE_FACTOR * self.model_size:
+            self.select()
+
+        # take the best N according to the information gain for each token
+        best = heapq.nlargest(self.model_size, self.candidates, key=self.key)
+        if (self.floor != None and self.model_size > 0 and
+                (len(best) < self.model_size or self.key(best[-1]) < self.floor)):
+            # the candidates ranked below the floor might not be the top tokens
+            self.select()
+            best = heapq.nlargest(self.model_size, self.candidates, key=self.key)
+
+        model = {}
+        for token in best:
+            rank, positive_prob, negative_prob = self.ranks[token]
+            prob = Prob()
+            counts = self.counts.counts[token]
+            prob.positive_count = max(counts[0], 0.5)
+            prob.negative_count = max(counts[1], 0.5)
+            prob.positive_prob = positive_prob
+            prob.negative_prob = negative_prob
+            model[token] = prob
+        return model
+
+    def classifier(self):
+        '''Returns a Classifier for the current model'''
+        return Classifier(None, None, self.model_size, self.rare_threshold, self.engine,
+            model=self.build())
+
+class NumpyScorer:
+    '''Computes log(prior * product of token probabilities) for both categories for
+    a batch of messages'''
+
+    def __init__(self, model, positive_prior, negative_prior):
+        if numpy == None:
+            raise ValueError("The numpy engine requires numpy")
+        tokens = model.keys()
+        # maps each token in the model to its column
+        self.vocabulary = dict((token, index) for index, token in enumerate(tokens))
+        # row i holds (log P(token i | positive), log P(token i | negative)). All
+        # tokens that are not in the model map to the last row, which is all zeros
+        probs = [(model[token].positive_prob, model[token].negative_prob) for token in tokens]
+        probs.append((1.0, 1.0))
+        self.log_probs = numpy.log(numpy.array(probs, dtype=numpy.float64))
+        self.unknown = len(tokens)
+        self.log_priors = numpy.log(numpy.array([positive_prior, negative_prior], dtype=numpy.float64))
+
+    def score(self, messages):
+        '''Returns an array with one (positive score, negative score) row per message'''
+        # the (row, column) coordinates of the non-zeros of the sparse matrix
+        # that has a row per message and a column per token
+        tokens = list(itertools.chain.from_iterable(messages))
+        columns = numpy.array(map(self.vocabulary.get, tokens, itertools.repeat(self.unknown, len(tokens))),
+            dtype=numpy.intp)
+        rows = numpy.repeat(numpy.arange(len(messages), dtype=numpy.intp), map(len, messages))
+
+        # the matrix product, i.e. the sum of each message's log-probabilities
+        scores = numpy.empty((len(messages), 2), dtype=numpy.float64)
+        for category in (0, 1):
+            scores[:, category] = numpy.bincount(rows, weights=self.log_probs[columns, category],
+                minlength=len(messages))
+        scores += self.log_priors
+        return scores
+
+# log of the smallest normal double. Below it, the products in Classifier.classify
+# lose precision and eventually underflow to 0.0
+LOG_MIN_NORMAL = math.log(sys.float_info.min)
+
+# log scores closer than this (relative) might be ordered differently by
+# Classifier.classify, due to rounding
+TIE_TOLERANCE = 1e-9
+
+def weighted_samples(messages):
+    '''Returns an iterable of (message, weight) for messages, which is a list of
+    messages (all with weight 1) or a sample store (see samplestore.py)'''
+    if hasattr(messages, "weighted_samples"):
+        return messages.weighted_samples()
+    return ((message, 1) for message in messages)
+
 class Classifier:
 
-    def __init__(self, positive, negative, model_size=5000, rare_threshold=0.05):
+    def __init__(self, positive, negative, model_size=5000, rare_threshold=0.05, engine="python",
+            model=None):
         '''
         positive is a list of "positive" messages, where each message is a set of tokens
         And similarly for negative
+        engine is one of ENGINES, and selects the implementation of classify_batch
+        positive and negative may also be sample stores (see samplestore.py), in
+        which case each message counts as many times as its weight.
+        If model is not None, it is a model built by IncrementalModel.build, and
+        positive and negative are ignored.
         '''
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine: %s" % engine)
+        if engine == "numpy" and numpy == None:
+            raise ValueError("The numpy engine requires numpy")
         self.positive = positive
         self.negative = negative
         self.model_size = model_size
         self.rare_threshold = rare_threshold
-        self.buildModel()
+        self.engine = engine
+        self.scorer = None
+        if model == None:
+            self.buildModel()
+        else:
+            self.model = model
+        self.positive_prior = 0.5
+        self.negative_prior = 0.5
 
     def buildModel(self):
         '''
         sets self.model, which maps tokens to corresponding Prob objects
-        sets self.positive_prior
-        sets self.negative_prior
         '''
-
-        num_positive_messages = len(self.positive)
-        num_negative_messages = len(self.negative)
-        total_messages = num_positive_messages + num_negative_messages
-        self.positive_prior = 0.5
-        self.negative_prior = 0.5
-
-        model = {}
-
-        # count tokens
+        incremental = IncrementalModel(self.model_size, self.rare_threshold)
         for category, messages in (("positive", self.positive), ("negative", self.negative)):
-            for token in itertools.chain(*messages):
-                if token not in model:
-                    model[token] = Prob()
-                model[token].inc(category)
-
-        # calculate probabilities for tokens
-        [token.done(num_positive_messages, num_negative_messages) for token in model.values()]
-
-        # filter out rare tokens
-        for token, prob in model.items():
-            if max(prob.positive_prob, prob.negative_prob) < self.rare_threshold:
-                del(model[token])
-
-        # sort according to the information gain for each token, and take best N
-        sorted_model = sorted(model.items(), reverse=True, cmp=lambda x,y: cmp(x[1].rank(), y[1].rank()))
-        sorted_model = sorted_model[:self.model_size]
-
-        self.model = dict(sorted_model)
+            for message, weight in weighted_samples(messages):
+                incremental.add(category, message, weight)
+        self.model = incremental.build()
 
     def __str__(self):
-        items = sorted(self.model.items(), reverse=True, cmp=lambda x,y: cmp(x[1].rank(), y[1].rank()))
+        items = sorted(self.model.items(), reverse=True, key=lambda (token, prob): (prob.rank(), token))
         lines = ["%s,%f,%f" % (token, prob.positive_prob, prob.negative_prob) for token, prob in items]
         return "\n".join(lines)
 
@@ -212,17 +555,38 @@ class Classifier:
         else:
             return "negative"
 
+    def classify_batch(self, messages):
+        '''Returns the list of classify(message) for each message in messages'''
+        if self.engine == "python" or len(messages) == 0:
+            return [self.classify(message) for message in messages]
+
+        if self.scorer == None:
+            self.scorer = NumpyScorer(self.model, self.positive_prior, self.negative_prior)
+        scores = self.scorer.score(messages)
+        positive = scores[:, 0]
+        negative = scores[:, 1]
+        results = numpy.where(positive > negative, "positive", "negative").tolist()
+
+        # let classify decide the messages where the two engines might disagree
+        difference = numpy.abs(positive - negative)
+        magnitude = numpy.maximum(numpy.abs(positive), numpy.abs(negative))
+        unsure = (difference <= TIE_TOLERANCE * numpy.maximum(magnitude, 1.0)) | \
+            (numpy.maximum(positive, negative) < LOG_MIN_NORMAL)
+        for index in numpy.flatnonzero(unsure):
+            results[index] = self.classify(messages[index])
+        return results
+
 def splitTokensNgrams(string, regex_str="\s+", ngrams=1):
     '''
-    splits string according to regex and returns set of n-gram tokens
+    splits string according to regex and returns set of n-gram tokens (the
+    words of an n-gram are joined with "+"; see also tokenizer.py)
     '''
     r = re.compile(regex_str)
     token_list = r.split(string)
     token_list = filter(lambda t: t != '', token_list)
     tokens = set()
     for i in xrange(len(token_list) - ngrams + 1):
-        seq = str(token_list[i:i + ngrams])
-        tokens.add(seq)
+        tokens.add("+".join(token_list[i:i + ngrams]))
     return tokens
 
 def splitTokens(string, regex_str="\s+"):
@@ -235,7 +599,8 @@ def splitTokens(string, regex_str="\s+"):
     return set(tokens)
 
 invalid_url_char = re.compile("[^a-z0-9%]")
-# TODO: urldecode?
+# tokenizes like the doorman. See tokenizer.py for URL decoding and structured
+# tokens
 def splitTokensUrl(string):
     return set(invalid_url_char.sub(' ', string.lower()).split())
 
@@ -246,6 +611,94 @@ def splitTokensMap(string, regex_str="\s+", map_func=str.lower):
     tokens = splitTokens(string, regex_str)
     return set([map_func(t) for t in tokens])
 
+def feature_token(token, feature_buckets):
+    '''Returns the token for the bucket that token hashes to: the CRC-32 of the
+    token's first MAX_TOKEN_LEN bytes (the doorman truncates tokens the same
+    way), modulo feature_buckets'''
+    return "%s%d" % (FEATURE_PREFIX, (zlib.crc32(token[:MAX_TOKEN_LEN]) & 0xffffffff) % feature_buckets)
+
+class FeatureHasher:
+    '''Wraps tokenize_func so that it returns feature-bucket tokens (see
+    feature_token), of which there are at most feature_buckets'''
+
+    def __init__(self, tokenize_func=splitTokensUrl, feature_buckets=4096):
+        if feature_buckets < 1:
+            raise ValueError("feature_buckets must be at least 1")
+        self.tokenize_func = tokenize_func
+        self.feature_buckets = feature_buckets
+
+    def __call__(self, string):
+        feature_buckets = self.feature_buckets
+        return set([feature_token(token, feature_buckets) for token in self.tokenize_func(string)])
+
+def make_tokenizer(feature_buckets=0, tokenize_func=splitTokensUrl):
+    '''Returns tokenize_func, hashed into feature_buckets buckets unless
+    feature_buckets is 0'''
+    if feature_buckets == 0:
+        return tokenize_func
+    return FeatureHasher(tokenize_func, feature_buckets)
+
+class TokenCache:
+    '''A bounded LRU cache of tokenize_func(string) (as frozensets), for tokenizing
+    repetitive request strings. Call it like tokenize_func. Thread safe.'''
+
+    # fields of the entries in the LRU list
+    PREV, NEXT, KEY, TOKENS = 0, 1, 2, 3
+
+    def __init__(self, tokenize_func=splitTokensUrl, max_size=10000):
+        self.tokenize_func = tokenize_func
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # maps each cached string to its entry, which is a link in a circular
+        # doubly linked list ordered from least to most recently used. (Faster
+        # than a collections.OrderedDict, which is implemented in Python.)
+        self.cache = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+    def __call__(self, string):
+        PREV, NEXT, TOKENS = self.PREV, self.NEXT, self.TOKENS
+        with self.lock:
+            entry = self.cache.get(string)
+            if entry != None:
+                self.hits += 1
+                # move entry to the most recently used end
+                entry[PREV][NEXT] = entry[NEXT]
+                entry[NEXT][PREV] = entry[PREV]
+                last = self.root[PREV]
+                last[NEXT] = self.root[PREV] = entry
+                entry[PREV] = last
+                entry[NEXT] = self.root
+                return entry[TOKENS]
+            self.misses += 1
+
+        tokens = frozenset(self.tokenize_func(string))
+        if self.max_size <= 0:
+            return tokens
+
+        with self.lock:
+            if string in self.cache:
+                # another thread added it in the meantime
+                return tokens
+            if len(self.cache) >= self.max_size:
+                oldest = self.root[NEXT]
+                self.root[NEXT] = oldest[NEXT]
+                oldest[NEXT][PREV] = self.root
+                del self.cache[oldest[self.KEY]]
+            last = self.root[PREV]
+            entry = [last, self.root, string, tokens]
+            last[NEXT] = self.root[PREV] = self.cache[string] = entry
+        return tokens
+
+    def __len__(self):
+        return len(self.cache)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups > 0 else 0.0
+
 def load_samples(filenames, do_lines=False, tokenize_func=splitTokensUrl):
     messages = []
     for filename in filenames:
@@ -279,26 +732,41 @@ if __name__ == "__main__":
     parser.add_argument("-r", "--rare", type=float, default=0.05,
                     help="Default=%(default)s. A feature must occur in at least RARE proportion "
                     "of positive or negative samples for it to be part of the model")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="python",
+                    help="Default=%(default)s. Implementation used to classify batches of samples")
+    parser.add_argument("-b", "--feature-buckets", type=int, default=0,
+                    help="Default=%(default)s. If not 0, hash tokens into this many feature buckets")
+    parser.add_argument("-f", "--folds", type=int, default=10,
+                    help="Default=%(default)s. Number of folds for OUTPUT = validate")
+    parser.add_argument("--processes", type=int, default=None,
+                    help="Default=one per CPU. Number of processes that test folds in parallel "
+                    "(when there are at least %d samples)" % PARALLEL_THRESHOLD)
 
     log.add_arguments(parser)
     args = parser.parse_args()
     logger = log.getLogger(args)
 
-    positive = load_samples(args.positive, do_lines=args.line)
-    negative = load_samples(args.negative, do_lines=args.line)
+    tokenize_func = make_tokenizer(args.feature_buckets)
+    positive = load_samples(args.positive, do_lines=args.line, tokenize_func=tokenize_func)
+    negative = load_samples(args.negative, do_lines=args.line, tokenize_func=tokenize_func)
 
     if args.output == "validate":
-        validate = Validate(positive, negative, logger, \
-            model_size=args.model_size, rare_threshold=args.rare)
-        validate.validate()
+        validate = Validate(positive, negative, logger, processes=args.processes, \
+            model_size=args.model_size, rare_threshold=args.rare, engine=args.engine)
+        validate.validate(args.folds)
+        print "fold,tp,fp,tn,fn,seconds"
+        for fold in validate.folds:
+            print "%d,%d,%d,%d,%d,%f" % fold
+        print "all,%d,%d,%d,%d,%f" % (validate.tp, validate.fp, validate.tn, validate.fn, validate.seconds)
     elif args.output == "model":
         c = Classifier(positive, negative, model_size=args.model_size, rare_threshold=args.rare)
         print c
     elif args.output == "classify":
         if args.classify == None:
             raise ValueError()
-        c = Classifier(positive, negative, model_size=args.model_size, rare_threshold=args.rare)
-        print c.classify(splitTokensUrl(args.classify))
+        c = Classifier(positive, negative, model_size=args.model_size, rare_threshold=args.rare,
+            engine=args.engine)
+        print c.classify_batch([tokenize_func(args.classify)])[0]
     else:
         raise ValueError()
 
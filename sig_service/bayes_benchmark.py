@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== bayes_benchmark.py ====
+#
+# Benchmarks for bayes.py. Requests whose URL matches --positive-regex are
+# labeled "evicted" (positive); all others are labeled "completed". Prints the
+# timings as JSON.
+#
+# --mode update (the default) compares the cost of rebuilding the Bayes model
+# from scratch (bayes.Classifier) with updating it incrementally
+# (bayes.IncrementalModel), the way the sigservice's LearnThread does: requests
+# stream into a sliding window of at most --window evicted and --window
+# completed samples, and the model is rebuilt every --update requests. Every
+# incremental model is checked against the corresponding full rebuild.
+#
+# --mode classify trains a model on the first --window samples of each category
+# and classifies all requests with each engine (see bayes.ENGINES), checking
+# that the engines agree.
+#
+# --mode tokenize replays the requests --repeat times at --rate requests per
+# second (0 = as fast as possible) through bayes.splitTokensUrl, and then
+# through a bayes.TokenCache of --cache-size entries, and compares the CPU
+# time spent.
+#
+# --mode hashing compares exact tokens with tokens hashed into each of
+# --feature-buckets buckets (see bayes.FeatureHasher; 0 = exact):
+#   - accuracy: how often the hashed model agrees with the exact model on
+#     test/sample_test.txt (trained on test/sample_*_train.txt), and the
+#     accuracy of a --folds-fold validation on the requests
+#   - adversarial tokens: the update benchmark's sliding window, where every
+#     evicted request carries a unique random parameter (an attacker
+#     randomizing its URLs). Reports the number of distinct tokens the model
+#     counts, and the time spent updating it
+#
+# USAGE: ./bayes_benchmark.py [--mode update] [--requests wikipedia_requests.txt] [--window 1000] [--update 50]
+#
+
+import os
+import re
+import argparse
+import json
+import logging
+import random
+import time
+
+import bayes
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+TEST_DIR = os.path.join(DIRNAME, "test")
+
+def summarize(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return {}
+    return {
+        "num" : len(values),
+        "median" : values[len(values) / 2],
+        "max" : values[-1],
+        "total" : sum(values),
+    }
+
+def benchmark(requests, positive_regex, window, update, bayes_classifier):
+    positive_regex = re.compile(positive_regex)
+    samples = {"positive" : [], "negative" : []}
+    model = bayes.IncrementalModel(**bayes_classifier)
+    full_times = []
+    incremental_times = []
+    incremental_build_times = []
+
+    add_time = 0.0
+    for i, request in enumerate(requests):
+        category = "positive" if positive_regex.search(request) else "negative"
+        sample = bayes.splitTokensUrl(request)
+        samples[category].append(sample)
+        start = time.time()
+        model.add(category, sample)
+        add_time += time.time() - start
+
+        if (i + 1) % update != 0:
+            continue
+
+        start = time.time()
+        for category in samples:
+            for sample in samples[category][:-window]:
+                model.remove(category, sample)
+        build_start = time.time()
+        incremental = model.classifier()
+        end = time.time()
+        incremental_times.append(end - start + add_time)
+        incremental_build_times.append(end - build_start)
+        add_time = 0.0
+
+        for category in samples:
+            samples[category] = samples[category][-window:]
+
+        start = time.time()
+        full = bayes.Classifier(samples["positive"], samples["negative"], **bayes_classifier)
+        full_times.append(time.time() - start)
+
+        if str(full) != str(incremental):
+            raise AssertionError("incremental model differs from full rebuild after %d requests" % (i + 1))
+
+    results = {
+        "requests" : len(requests),
+        "window" : window,
+        "update" : update,
+        "full_rebuild" : summarize(full_times),
+        "incremental" : summarize(incremental_times),
+        "incremental_build_only" : summarize(incremental_build_times),
+    }
+    if results["incremental"].get("total"):
+        results["speedup"] = results["full_rebuild"]["total"] / results["incremental"]["total"]
+    return results
+
+def benchmark_engines(requests, positive_regex, window, bayes_classifier, repeat):
+    positive_regex = re.compile(positive_regex)
+    samples = [bayes.splitTokensUrl(request) for request in requests]
+    positive = [sample for request, sample in zip(requests, samples) if positive_regex.search(request)]
+    negative = [sample for request, sample in zip(requests, samples) if not positive_regex.search(request)]
+
+    results = {
+        "requests" : len(requests),
+        "window" : window,
+        "repeat" : repeat,
+    }
+    expected = None
+    for engine in bayes.ENGINES:
+        classifier = bayes.Classifier(positive[:window], negative[:window], engine=engine, **bayes_classifier)
+        # the first batch includes one-time setup (e.g. building the vocabulary)
+        start = time.time()
+        classified = classifier.classify_batch(samples)
+        first = time.time() - start
+        times = []
+        for i in range(repeat):
+            start = time.time()
+            classifier.classify_batch(samples)
+            times.append(time.time() - start)
+        if expected == None:
+            expected = classified
+        elif classified != expected:
+            raise AssertionError("engine %s disagrees with engine %s" % (engine, bayes.ENGINES[0]))
+        results[engine] = summarize(times)
+        results[engine]["first"] = first
+        results[engine]["positive"] = classified.count("positive")
+    if results["numpy"].get("median"):
+        results["speedup"] = results["python"]["median"] / results["numpy"]["median"]
+    return results
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+def replay(requests, tokenize_func, rate, repeat):
+    '''Returns (CPU seconds, wall seconds) to tokenize the requests repeat times
+    at rate requests per second'''
+    start_cpu = cpu_time()
+    start = time.time()
+    sent = 0
+    for i in range(repeat):
+        for request in requests:
+            if rate > 0:
+                delay = start + sent / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            tokenize_func(request)
+            sent += 1
+    return cpu_time() - start_cpu, time.time() - start
+
+def benchmark_tokenize(requests, cache_size, rate, repeat):
+    cache = bayes.TokenCache(bayes.splitTokensUrl, cache_size)
+    results = {
+        "requests" : len(requests) * repeat,
+        "unique_requests" : len(set(requests)),
+        "rate" : rate,
+        "cache_size" : cache_size,
+    }
+    for name, tokenize_func in (("uncached", bayes.splitTokensUrl), ("cached", cache)):
+        cpu, wall = replay(requests, tokenize_func, rate, repeat)
+        results[name] = {
+            "cpu_seconds" : cpu,
+            "wall_seconds" : wall,
+            "cpu_us_per_request" : cpu / results["requests"] * 1e6,
+        }
+    results["cached"]["hit_rate"] = cache.hit_rate()
+    if results["uncached"]["cpu_seconds"] > 0:
+        results["cpu_savings"] = 1.0 - results["cached"]["cpu_seconds"] / results["uncached"]["cpu_seconds"]
+    return results
+
+def load_lines(filename, tokenize_func):
+    with open(filename) as f:
+        return [tokenize_func(line) for line in f if line.strip() != ""]
+
+def adversarial_update(requests, positive_regex, window, update, bayes_classifier, tokenize_func):
+    '''Streams the requests through an IncrementalModel with a sliding window
+    (like benchmark), appending a unique random parameter to every positive
+    request. Returns (seconds, max number of distinct tokens counted)'''
+    rand = random.Random(0)
+    samples = {"positive" : [], "negative" : []}
+    model = bayes.IncrementalModel(**bayes_classifier)
+    max_tokens = 0
+    start = time.time()
+    for i, request in enumerate(requests):
+        category = "positive" if positive_regex.search(request) else "negative"
+        if category == "positive":
+            request = "%s&r%x=%x" % (request, rand.getrandbits(32), rand.getrandbits(64))
+        sample = tokenize_func(request)
+        samples[category].append(sample)
+        model.add(category, sample)
+        if (i + 1) % update != 0:
+            continue
+        for category in samples:
+            for sample in samples[category][:-window]:
+                model.remove(category, sample)
+            samples[category] = samples[category][-window:]
+        model.classifier()
+        max_tokens = max(max_tokens, len(model.counts.counts))
+    return time.time() - start, max_tokens
+
+def benchmark_hashing(requests, positive_regex, window, update, bayes_classifier, feature_buckets, folds):
+    positive_regex = re.compile(positive_regex)
+    logger = logging.getLogger("bayes_benchmark")
+    results = {
+        "requests" : len(requests),
+        "window" : window,
+        "update" : update,
+        "folds" : folds,
+    }
+    expected = None
+    for buckets in feature_buckets:
+        tokenize_func = bayes.make_tokenizer(buckets)
+        classifier = bayes.Classifier(
+            load_lines(os.path.join(TEST_DIR, "sample_positive_train.txt"), tokenize_func),
+            load_lines(os.path.join(TEST_DIR, "sample_negative_train.txt"), tokenize_func),
+            **bayes_classifier)
+        classified = classifier.classify_batch(
+            load_lines(os.path.join(TEST_DIR, "sample_test.txt"), tokenize_func))
+        if expected == None:
+            expected = bayes.Classifier(
+                load_lines(os.path.join(TEST_DIR, "sample_positive_train.txt"), bayes.splitTokensUrl),
+                load_lines(os.path.join(TEST_DIR, "sample_negative_train.txt"), bayes.splitTokensUrl),
+                **bayes_classifier).classify_batch(
+                load_lines(os.path.join(TEST_DIR, "sample_test.txt"), bayes.splitTokensUrl))
+        agreement = sum(1 for a, b in zip(classified, expected) if a == b)
+
+        samples = [tokenize_func(request) for request in requests]
+        positive = [sample for request, sample in zip(requests, samples) if positive_regex.search(request)]
+        negative = [sample for request, sample in zip(requests, samples) if not positive_regex.search(request)]
+        random.seed(0)
+        tp, fp, tn, fn = bayes.Validate(positive, negative, logger, **bayes_classifier).validate(folds)
+
+        seconds, max_tokens = adversarial_update(requests, positive_regex, window, update, bayes_classifier,
+            tokenize_func)
+        results["exact" if buckets == 0 else str(buckets)] = {
+            "test_agreement" : float(agreement) / len(expected),
+            "validate_accuracy" : float(tp + tn) / (tp + fp + tn + fn),
+            "validate_fp" : fp,
+            "validate_fn" : fn,
+            "adversarial_seconds" : seconds,
+            "adversarial_max_tokens" : max_tokens,
+        }
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks Bayes model rebuilds and classification')
+    parser.add_argument("-m", "--mode", choices=["update", "classify", "tokenize", "hashing"], default="update",
+                        help="Default=%(default)s. Which benchmark to run")
+    parser.add_argument("-r", "--requests", type=str, default=os.path.join(DIRNAME, "wikipedia_requests.txt"),
+                        help="Default=%(default)s. File with one request URL per line")
+    parser.add_argument("-p", "--positive-regex", type=str, default="action=raw",
+                        help="Default=%(default)s. Requests matching this regex are labeled evicted")
+    parser.add_argument("-w", "--window", type=int, default=1000,
+                        help="Default=%(default)d. Max number of samples of each category (like sigservice.py --max-sample-size)")
+    parser.add_argument("-u", "--update", type=int, default=50,
+                        help="Default=%(default)d. Number of requests between model builds")
+    parser.add_argument("-n", "--repeat", type=int, default=10,
+                        help="Default=%(default)d. Number of timed batches per engine (--mode classify), "
+                        "or replays of the requests (--mode tokenize)")
+    parser.add_argument("-c", "--cache-size", type=int, default=10000,
+                        help="Default=%(default)d. Size of the TokenCache (--mode tokenize)")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Default=%(default)f. Requests per second (--mode tokenize; 0 = as fast as possible)")
+    parser.add_argument("-fb", "--feature-buckets", type=int, nargs="+", default=[0, 64, 256, 1024, 4096],
+                        help="Default=%(default)s. Numbers of feature buckets to compare (--mode hashing; "
+                        "0 = exact tokens)")
+    parser.add_argument("-f", "--folds", type=int, default=10,
+                        help="Default=%(default)d. Number of folds to validate (--mode hashing)")
+    parser.add_argument("-bm", "--bayes-model-size", type=int, default=5000,
+                        help="Default=%(default)d. Size of Bayes model; see bayes.py")
+    parser.add_argument("-br", "--bayes-rare-threshold", type=float, default=0.01,
+                        help="Default=%(default)f. Rarity threshold for Bayes model; see bayes.py")
+    args = parser.parse_args()
+
+    with open(args.requests) as f:
+        requests = [line.strip() for line in f if line.strip() != ""]
+
+    bayes_classifier = {
+        "model_size" : args.bayes_model_size,
+        "rare_threshold" : args.bayes_rare_threshold,
+    }
+    if args.mode == "update":
+        results = benchmark(requests, args.positive_regex, args.window, args.update, bayes_classifier)
+    elif args.mode == "classify":
+        results = benchmark_engines(requests, args.positive_regex, args.window, bayes_classifier, args.repeat)
+    elif args.mode == "tokenize":
+        results = benchmark_tokenize(requests, args.cache_size, args.rate, args.repeat)
+    else:
+        results = benchmark_hashing(requests, args.positive_regex, args.window, args.update, bayes_classifier,
+            args.feature_buckets, args.folds)
+    print json.dumps(results, indent=4, sort_keys=True)
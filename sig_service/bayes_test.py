@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== bayes_test.py ====
+#
+#
+import random
+import time
+import logging
+import unittest
+import samplestore
+from bayes import *
+
+def random_message(rand, vocabulary=60, size=6):
+    return set("t%d" % rand.randint(0, vocabulary - 1) for i in xrange(size))
+
+def model_probs(model):
+    return dict((token, (prob.positive_prob, prob.negative_prob)) for token, prob in model.iteritems())
+
+class Test_TokenCounts(unittest.TestCase):
+
+    def test_add_remove(self):
+        counts = TokenCounts()
+        counts.add("positive", set(["a", "b"]))
+        counts.add("negative", set(["b", "c"]))
+        counts.add("negative", set(["c"]), weight=2)
+        self.assertEqual((counts.num_positive, counts.num_negative), (1, 3))
+        self.assertEqual(counts.counts, {"a" : [1, 0], "b" : [1, 1], "c" : [0, 3]})
+        self.assertEqual(counts.clear_dirty(), set(["a", "b", "c"]))
+
+        counts.remove("positive", set(["a", "b"]))
+        self.assertEqual((counts.num_positive, counts.num_negative), (0, 3))
+        self.assertEqual(counts.counts, {"b" : [0, 1], "c" : [0, 3]})
+        self.assertEqual(counts.clear_dirty(), set(["a", "b"]))
+        self.assertEqual(counts.clear_dirty(), set())
+        self.assertRaises(ValueError, counts.add, "neutral", set(["a"]))
+
+    def test_difference(self):
+        counts = TokenCounts()
+        subset = TokenCounts()
+        for category, message in [("positive", set(["a", "b"])), ("negative", set(["b"]))]:
+            counts.add(category, message)
+            subset.add(category, message)
+        counts.add("positive", set(["b", "c"]))
+        result = counts.difference(subset)
+        self.assertEqual((result.num_positive, result.num_negative), (1, 0))
+        self.assertEqual(result.counts, {"b" : [1, 0], "c" : [1, 0]})
+        self.assertEqual(result.dirty, set(["b", "c"]))
+
+class Test_IncrementalModel(unittest.TestCase):
+
+    def assertSameModel(self, model, positive, negative, model_size):
+        expected = Classifier(positive, negative, model_size=model_size).model
+        self.assertEqual(model_probs(model), model_probs(expected))
+
+        # the model is the top model_size tokens by rank
+        counts = TokenCounts()
+        for message in positive:
+            counts.add("positive", message)
+        for message in negative:
+            counts.add("negative", message)
+        ranks = []
+        for token, (positive_count, negative_count) in counts.counts.iteritems():
+            positive_prob, negative_prob = token_probs(positive_count, negative_count, len(positive), len(negative))
+            if max(positive_prob, negative_prob) >= 0.05:
+                ranks.append((abs(positive_prob - negative_prob), token))
+        self.assertEqual(sorted(model), sorted(token for rank, token in sorted(ranks)[-model_size:]))
+
+    def test_sliding_window(self):
+        rand = random.Random(1)
+        for model_size in [1, 5, 20, 100]:
+            positive = [random_message(rand) for i in xrange(30)]
+            negative = [random_message(rand) for i in xrange(50)]
+            model = IncrementalModel(model_size=model_size)
+            for message in positive:
+                model.add("positive", message)
+            for message in negative:
+                model.add("negative", message)
+            self.assertSameModel(model.build(), positive, negative, model_size)
+
+            # replace a few samples at a time, so that the totals stay the same
+            # and builds only re-rank the tokens that changed
+            for step in xrange(40):
+                for category, messages in [("positive", positive), ("negative", negative)]:
+                    for i in xrange(rand.randint(0, 2)):
+                        model.remove(category, messages.pop(0))
+                        messages.append(random_message(rand))
+                        model.add(category, messages[-1])
+                self.assertSameModel(model.build(), positive, negative, model_size)
+
+    def test_changing_totals(self):
+        rand = random.Random(2)
+        positive = []
+        negative = []
+        model = IncrementalModel(model_size=5)
+        self.assertEqual(model.build(), {})
+        for step in xrange(30):
+            category, messages = rand.choice([("positive", positive), ("negative", negative)])
+            if len(messages) > 0 and rand.random() < 0.3:
+                model.remove(category, messages.pop(rand.randrange(len(messages))))
+            else:
+                messages.append(random_message(rand))
+                model.add(category, messages[-1])
+            self.assertSameModel(model.build(), positive, negative, 5)
+
+class Test_Validate(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(3)
+        self.positive = [random_message(rand) | set(["evil"]) for i in xrange(40)]
+        self.negative = [random_message(rand) for i in xrange(60)]
+        self.logger = logging.getLogger("bayes_test")
+
+    def validate(self, **kwargs):
+        random.seed(4)
+        validate = Validate(self.positive, self.negative, self.logger, model_size=20, **kwargs)
+        validate.validate(5)
+        return [fold[:5] for fold in validate.folds]
+
+    def test_pool(self):
+        folds = self.validate(processes=1)
+        self.assertEqual(sum(sum(fold[1:]) for fold in folds), 100)
+        pool = make_pool(2)
+        try:
+            self.assertEqual(self.validate(pool=pool, parallel_threshold=0), folds)
+        finally:
+            pool.terminate()
+        self.assertEqual(self.validate(processes=2, parallel_threshold=0), folds)
+        self.assertEqual(make_pool(1), None)
+
+    def test_weighted(self):
+        positive = samplestore.DecayStore(100, half_life=10.0)
+        for i, message in enumerate(self.positive):
+            positive.add(message, timestamp=time.time() - i)
+        validate = Validate(positive, self.negative, self.logger, model_size=20)
+        tp, fp, tn, fn = validate.validate(5)
+        self.assertEqual((tp + fn, fp + tn), (40, 60))
+        self.assertTrue(tp > 0)
+
+if __name__ == '__main__':
+    unittest.main()
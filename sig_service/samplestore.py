@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== samplestore.py ====
+#
+# Fixed-capacity stores for the samples (tokenized requests) of one category
+# that the sigservice trains on. Memory stays flat no matter how fast samples
+# arrive: add() evicts samples as soon as the store is full, and returns them
+# so that an incremental model (bayes.IncrementalModel) can forget them.
+#
+# Policies:
+#   ring:      the last `capacity` samples
+#   decay:     the last `capacity` samples, weighted by age (a sample's weight
+#              halves every `half_life` seconds)
+#   reservoir: a uniform random sample of (roughly) the last `horizon`
+#              samples, so the model remembers a longer history than fits in
+#              the store
+#
+# Stores are iterable (and have len and indexing), so bayes.Classifier and
+# bayes.Validate consume them directly. Both train on weighted_samples(),
+# which gives every sample weight 1 except in the decay store.
+#
+# USAGE: see sigservice.py
+#
+
+import time
+import random
+
+POLICIES = ["ring", "decay", "reservoir"]
+
+class RingStore:
+    '''The last capacity samples'''
+
+    # True iff weighted_samples gives weights other than 1
+    weighted = False
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.samples = [None] * capacity
+        # index of the oldest sample
+        self.start = 0
+        self.size = 0
+
+    def add(self, sample, timestamp=None):
+        '''Adds sample and returns the list of samples that left the store (for a
+        reservoir, this may be sample itself)'''
+        if self.size < self.capacity:
+            self.samples[(self.start + self.size) % self.capacity] = sample
+            self.size += 1
+            return []
+        evicted = self.samples[self.start]
+        self.samples[self.start] = sample
+        self.start = (self.start + 1) % self.capacity
+        return [evicted]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        '''The index-th oldest sample'''
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError("sample index out of range")
+        return self.samples[(self.start + index) % self.capacity]
+
+    def __iter__(self):
+        for index in xrange(self.size):
+            yield self.samples[(self.start + index) % self.capacity]
+
+    def weighted_samples(self, now=None):
+        '''Yields (sample, weight) for every sample'''
+        for sample in self:
+            yield sample, 1
+
+class DecayStore(RingStore):
+    '''The last capacity samples, where a sample's weight halves every half_life
+    seconds'''
+
+    weighted = True
+
+    def __init__(self, capacity, half_life=60.0):
+        RingStore.__init__(self, capacity)
+        if half_life <= 0.0:
+            raise ValueError("half_life must be positive")
+        self.half_life = half_life
+        self.timestamps = [0.0] * capacity
+
+    def add(self, sample, timestamp=None):
+        if timestamp == None:
+            timestamp = time.time()
+        self.timestamps[(self.start + self.size) % self.capacity] = timestamp
+        return RingStore.add(self, sample)
+
+    def weighted_samples(self, now=None):
+        if now == None:
+            now = time.time()
+        for index in xrange(self.size):
+            slot = (self.start + index) % self.capacity
+            age = max(0.0, now - self.timestamps[slot])
+            yield self.samples[slot], 0.5 ** (age / self.half_life)
+
+class ReservoirStore(RingStore):
+    '''A uniform random sample of the samples added so far, where "so far" is
+    capped at the last horizon samples: once horizon samples have been seen,
+    each new sample replaces a random sample with probability
+    capacity / horizon, so samples are forgotten at the same rate they would
+    leave a window of horizon samples'''
+
+    def __init__(self, capacity, horizon=None, rand=random):
+        RingStore.__init__(self, capacity)
+        self.horizon = horizon if horizon != None else 10 * capacity
+        if self.horizon < capacity:
+            raise ValueError("horizon must be at least capacity")
+        self.rand = rand
+        self.seen = 0
+
+    def add(self, sample, timestamp=None):
+        self.seen = min(self.seen + 1, self.horizon)
+        if self.size < self.capacity:
+            return RingStore.add(self, sample)
+        index = self.rand.randint(0, self.seen - 1)
+        if index >= self.capacity:
+            # sample is not kept
+            return [sample]
+        evicted = self.samples[index]
+        self.samples[index] = sample
+        return [evicted]
+
+STORES = {
+    "ring" : RingStore,
+    "decay" : DecayStore,
+    "reservoir" : ReservoirStore,
+}
+
+def make_store(capacity, policy="ring", **options):
+    '''Returns an empty store. options are passed to the store's constructor
+    (e.g. half_life for decay, horizon for reservoir)'''
+    if policy not in STORES:
+        raise ValueError("Unknown sample store policy: %s" % policy)
+    return STORES[policy](capacity, **options)
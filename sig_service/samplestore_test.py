@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== samplestore_test.py ====
+#
+#
+import random
+import unittest
+import bayes
+from samplestore import *
+
+def random_message(rand, vocabulary=40, size=5):
+    return set("t%d" % rand.randint(0, vocabulary - 1) for i in xrange(size))
+
+def model_probs(model):
+    return dict((token, (prob.positive_prob, prob.negative_prob)) for token, prob in model.iteritems())
+
+class Test_samplestore(unittest.TestCase):
+
+    def test_ring(self):
+        store = make_store(3)
+        self.assertEqual([store.add(i) for i in xrange(5)], [[], [], [], [0], [1]])
+        self.assertEqual(list(store), [2, 3, 4])
+        self.assertEqual((len(store), store[0], store[-1]), (3, 2, 4))
+        self.assertEqual(list(store.weighted_samples()), [(2, 1), (3, 1), (4, 1)])
+
+    def test_decay(self):
+        store = make_store(2, "decay", half_life=10.0)
+        store.add("a", timestamp=0.0)
+        store.add("b", timestamp=10.0)
+        self.assertEqual(store.add("c", timestamp=20.0), ["a"])
+        self.assertEqual(list(store.weighted_samples(now=20.0)), [("b", 0.5), ("c", 1.0)])
+
+    def test_reservoir(self):
+        store = make_store(10, "reservoir", horizon=50, rand=random.Random(1))
+        kept = set(xrange(200))
+        for i in xrange(200):
+            for sample in store.add(i):
+                kept.remove(sample)
+        self.assertEqual(kept, set(store))
+        self.assertEqual(len(store), 10)
+
+    def test_bad_options(self):
+        self.assertRaises(ValueError, make_store, 10, "fifo")
+        self.assertRaises(ValueError, make_store, 0)
+        self.assertRaises(ValueError, make_store, 10, "reservoir", horizon=5)
+
+    def test_incremental_model(self):
+        # an IncrementalModel that forgets every evicted sample (the way the
+        # sigservice's LearnThread does) has the same model as a Classifier
+        # trained on the stores from scratch
+        for policy, options in [("ring", {}), ("reservoir", {"horizon" : 100, "rand" : random.Random(2)})]:
+            rand = random.Random(3)
+            positive = make_store(20, policy, **options)
+            negative = make_store(30, policy, **options)
+            model = bayes.IncrementalModel(model_size=10)
+            for i in xrange(300):
+                category, store = rand.choice([("positive", positive), ("negative", negative)])
+                sample = random_message(rand)
+                evicted = store.add(sample)
+                model.add(category, sample)
+                for old_sample in evicted:
+                    model.remove(category, old_sample)
+                if i % 10 == 0:
+                    expected = bayes.Classifier(positive, negative, model_size=10)
+                    self.assertEqual(model_probs(model.build()), model_probs(expected.model))
+
+    def test_decay_counts(self):
+        # models count each sample as many times as its weight
+        store = make_store(2, "decay", half_life=10.0)
+        store.add(set(["a"]), timestamp=0.0)
+        store.add(set(["a", "b"]), timestamp=10.0)
+        counts = bayes.TokenCounts()
+        for message, weight in store.weighted_samples(now=20.0):
+            counts.add("positive", message, weight)
+        self.assertEqual((counts.num_positive, counts.counts), (0.75, {"a" : [0.75, 0], "b" : [0.5, 0]}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== shadow.py ====
+#
+# Shadow evaluation of the live signature. The sigservice classifies every
+# sample with the most recently published model before the sample joins the
+# training window, so the results measure how the signature does on traffic it
+# has not been trained on (unlike bayes.Validate, which cross-validates the
+# training window itself). Evicted samples are the positives.
+#
+# ShadowEvaluator keeps a rolling confusion matrix for each of several windows
+# (in seconds). A window is a ring of BUCKETS buckets, so its matrix covers
+# the last `window` seconds to within window / BUCKETS seconds, in constant
+# memory.
+#
+# write_series adds the matrices to a CSV time series with the columns
+# SERIES_HEADER, one row per window. The sigservice keeps the series next to
+# the signature (on a ramdisk), so the file only holds the last max_rows rows:
+# it is rewritten atomically each time, rather than appended to forever.
+#
+# USAGE: see sigservice.py --shadow-windows
+#
+
+import time
+import collections
+
+from sigfile import atomic_write
+
+# the default windows, in seconds
+DEFAULT_WINDOWS = [60, 600, 3600]
+
+BUCKETS = 60
+
+# the default number of rows the time series keeps (with the default windows,
+# the last 1000 updates)
+SERIES_ROWS = 3000
+
+Confusion = collections.namedtuple("Confusion", ["window", "tp", "fp", "tn", "fn"])
+
+SERIES_HEADER = "time,model_version,window,tp,fp,tn,fn"
+
+TP = 0
+FP = 1
+TN = 2
+FN = 3
+
+def outcome(category, result):
+    '''Returns the index (TP, FP, TN or FN) for a sample of category
+    ("positive" or "negative") that the model classified as result'''
+    if category == "positive":
+        return TP if result == "positive" else FN
+    else:
+        return FP if result == "positive" else TN
+
+def read_series(filename):
+    '''Returns the rows (without the header) of the time series in filename, or
+    [] if it cannot be read'''
+    try:
+        with open(filename) as f:
+            return [line.rstrip("\n") for line in f if line.strip() != "" and not line.startswith(SERIES_HEADER)]
+    except IOError:
+        return []
+
+def parse_windows(windows):
+    '''Returns the list of windows in a comma-separated string of seconds ("" =
+    no windows). Raises ValueError if a window is invalid'''
+    result = []
+    for window in windows.split(","):
+        if window.strip() == "":
+            continue
+        result.append(float(window))
+        if result[-1] <= 0.0:
+            raise ValueError("Shadow windows must be positive: %s" % window)
+    return result
+
+class RollingConfusion:
+    '''The confusion matrix of the last window seconds'''
+
+    def __init__(self, window):
+        if window <= 0.0:
+            raise ValueError("window must be positive")
+        self.window = window
+        self.resolution = float(window) / BUCKETS
+        # the bucket number (time / resolution) that each slot counts, and its
+        # counts indexed by TP, FP, TN, FN
+        self.bucket = [None] * BUCKETS
+        self.counts = [[0, 0, 0, 0] for i in xrange(BUCKETS)]
+
+    def add(self, index, now):
+        bucket = int(now / self.resolution)
+        slot = bucket % BUCKETS
+        if self.bucket[slot] != bucket:
+            self.bucket[slot] = bucket
+            self.counts[slot] = [0, 0, 0, 0]
+        self.counts[slot][index] += 1
+
+    def confusion(self, now):
+        oldest = int(now / self.resolution) - BUCKETS + 1
+        totals = [0, 0, 0, 0]
+        for bucket, counts in zip(self.bucket, self.counts):
+            if bucket != None and bucket >= oldest:
+                for i in xrange(4):
+                    totals[i] += counts[i]
+        return Confusion(self.window, *totals)
+
+class ShadowEvaluator:
+
+    def __init__(self, windows=DEFAULT_WINDOWS, max_rows=SERIES_ROWS):
+        self.windows = [RollingConfusion(window) for window in windows]
+        self.max_rows = max_rows
+        # the rows of the time series (see write_series)
+        self.series = None
+
+    def add(self, category, result, now=None):
+        '''Records that the live model classified a sample of category as result'''
+        if now == None:
+            now = time.time()
+        index = outcome(category, result)
+        for window in self.windows:
+            window.add(index, now)
+
+    def confusions(self, now=None):
+        '''Returns a Confusion for every window'''
+        if now == None:
+            now = time.time()
+        return [window.confusion(now) for window in self.windows]
+
+    def write_series(self, filename, model_version, now=None):
+        '''Adds the current confusion matrices to the CSV time series in filename,
+        and atomically rewrites it with the last max_rows rows. The first call
+        continues the series already in filename (e.g. from before a restart)'''
+        if now == None:
+            now = time.time()
+        if self.series == None:
+            self.series = collections.deque(read_series(filename), self.max_rows)
+        for confusion in self.confusions(now):
+            self.series.append("%.3f,%d,%g,%d,%d,%d,%d" % ((now, model_version) + tuple(confusion)))
+        atomic_write(filename, "\n".join([SERIES_HEADER] + list(self.series)) + "\n")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== shadow_test.py ====
+#
+#
+import os
+import shutil
+import tempfile
+import unittest
+from shadow import *
+
+class Test_shadow(unittest.TestCase):
+
+    def test_confusions(self):
+        evaluator = ShadowEvaluator([60, 600])
+        evaluator.add("positive", "positive", now=1000.0)
+        evaluator.add("positive", "negative", now=1000.0)
+        evaluator.add("negative", "positive", now=1030.0)
+        evaluator.add("negative", "negative", now=1059.0)
+        self.assertEqual(evaluator.confusions(now=1059.5), [Confusion(60, 1, 1, 1, 1), Confusion(600, 1, 1, 1, 1)])
+        # the first two samples have left the 60s window, but not the 600s window
+        self.assertEqual(evaluator.confusions(now=1061.0), [Confusion(60, 0, 1, 1, 0), Confusion(600, 1, 1, 1, 1)])
+        self.assertEqual(evaluator.confusions(now=2000.0), [Confusion(60, 0, 0, 0, 0), Confusion(600, 0, 0, 0, 0)])
+
+    def test_reused_buckets(self):
+        evaluator = ShadowEvaluator([60])
+        evaluator.add("positive", "positive", now=0.0)
+        evaluator.add("positive", "positive", now=60.0)
+        self.assertEqual(evaluator.confusions(now=60.0), [Confusion(60, 1, 0, 0, 0)])
+
+    def test_write_series(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, "series")
+            evaluator = ShadowEvaluator([60, 600])
+            evaluator.add("negative", "positive", now=10.0)
+            evaluator.write_series(filename, 3, now=10.0)
+            evaluator.write_series(filename, 4, now=20.0)
+            with open(filename) as f:
+                self.assertEqual(f.read().splitlines(), [SERIES_HEADER,
+                    "10.000,3,60,0,1,0,0", "10.000,3,600,0,1,0,0",
+                    "20.000,4,60,0,1,0,0", "20.000,4,600,0,1,0,0"])
+
+            # only the last max_rows rows are kept, across restarts
+            evaluator = ShadowEvaluator([60], max_rows=3)
+            evaluator.write_series(filename, 5, now=30.0)
+            evaluator.write_series(filename, 6, now=40.0)
+            with open(filename) as f:
+                self.assertEqual(f.read().splitlines(), [SERIES_HEADER,
+                    "20.000,4,600,0,1,0,0", "30.000,5,60,0,0,0,0", "40.000,6,60,0,0,0,0"])
+            self.assertEqual(os.listdir(tempdir), ["series"])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_parse_windows(self):
+        self.assertEqual(parse_windows("60, 600"), [60.0, 600.0])
+        self.assertEqual(parse_windows(""), [])
+        self.assertRaises(ValueError, parse_windows, "60,0")
+        self.assertRaises(ValueError, parse_windows, "sixty")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== shards.py ====
+#
+# Routes sigservice notices to shards, so that each application behind the
+# same nginx gets its own model and signature file (see sigservice.py).
+#
+# A shard is a dict:
+#   {
+#       "name" : "mediawiki",
+#       "sig_file" : "/home/nginx_user/ramdisk/mediawiki_signature.txt",
+#       "host" : "wiki.example.com",      (optional)
+#       "path_prefix" : "/mediawiki/"      (optional)
+#   }
+# A notice goes to the first shard whose host and path_prefix (whichever are
+# given) both match, and to the default shard (the sigservice's own sig_file)
+# if no shard matches. Each shard needs a host or a path_prefix.
+#
+# The request strings in notices are the doorman's signature key (see
+# $sig_key in the apps' nginx.conf files): whitespace-separated fields whose
+# last field is $request_uri. To route by virtual host, $sig_key needs the
+# field "host$host" right before $request_uri, as in the
+# core12_doorman_sig_service templates. Only that position counts: the user
+# agent is split into several fields, any of which may start with "host".
+#
+
+import collections
+
+Shard = collections.namedtuple("Shard", ["name", "sig_file", "host", "path_prefix"])
+
+# name of the shard for notices that match no other shard
+DEFAULT_SHARD = "default"
+
+HOST_FIELD = "host"
+
+def parse_shards(shards):
+    '''Returns a list of Shards for a list of shard dicts. Raises ValueError if
+    the dicts are invalid'''
+    result = []
+    names = set([DEFAULT_SHARD])
+    sig_files = set()
+    for shard in shards:
+        unknown = set(shard.keys()) - set(Shard._fields)
+        if len(unknown) > 0:
+            raise ValueError("Unknown shard options: %s" % ", ".join(sorted(unknown)))
+        for field in ("name", "sig_file"):
+            if field not in shard:
+                raise ValueError("shard %s is not defined" % field)
+        if shard["name"] in names:
+            raise ValueError("Duplicate shard name '%s'" % shard["name"])
+        if shard["sig_file"] in sig_files:
+            raise ValueError("Shards '%s' and another share the sig_file '%s'" % (shard["name"], shard["sig_file"]))
+        host = shard.get("host")
+        path_prefix = shard.get("path_prefix")
+        if host == None and path_prefix == None:
+            raise ValueError("Shard '%s' needs a host or a path_prefix" % shard["name"])
+        names.add(shard["name"])
+        sig_files.add(shard["sig_file"])
+        result.append(Shard(shard["name"], shard["sig_file"], host.lower() if host != None else None,
+            path_prefix))
+    return result
+
+def request_host(fields):
+    '''Returns the host in the fields of a request string (the field before the
+    request URI), or None'''
+    if len(fields) < 2 or not fields[-2].startswith(HOST_FIELD):
+        return None
+    return fields[-2][len(HOST_FIELD):].lower()
+
+def request_path(fields):
+    '''Returns the request URI in the fields of a request string'''
+    if len(fields) == 0:
+        return ""
+    return fields[-1]
+
+class ShardRouter:
+
+    def __init__(self, shards):
+        '''shards is a list of shard dicts (see the top of this file)'''
+        self.shards = parse_shards(shards)
+
+    def route(self, request_str):
+        '''Returns the index (in self.shards) of the shard for request_str, or None
+        for the default shard'''
+        if len(self.shards) == 0:
+            return None
+        fields = request_str.split()
+        host = None
+        path = request_path(fields)
+        for index, shard in enumerate(self.shards):
+            if shard.host != None:
+                if host == None:
+                    host = request_host(fields)
+                if host != shard.host:
+                    continue
+            if shard.path_prefix != None and not path.startswith(shard.path_prefix):
+                continue
+            return index
+        return None
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== shards_test.py ====
+#
+#
+import unittest
+from shards import *
+
+# a $sig_key, as in the core12_doorman_sig_service nginx.conf templates
+SIG_KEY = ("512 agentMozilla/5.0 (compatible; hosttracker/2.0; +http://www.host-tracker.com/) schemehttp "
+    "contentlength contenttype requestmethodGET remoteuser host%s %s")
+
+class Test_shards(unittest.TestCase):
+
+    def setUp(self):
+        self.router = ShardRouter([
+            {"name" : "osqa", "sig_file" : "/tmp/osqa_sig", "host" : "OSQA.example.com"},
+            {"name" : "wiki-api", "sig_file" : "/tmp/api_sig", "host" : "wiki.example.com",
+                "path_prefix" : "/api.php"},
+            {"name" : "wiki", "sig_file" : "/tmp/wiki_sig", "path_prefix" : "/index.php"},
+        ])
+
+    def test_route(self):
+        self.assertEqual(self.router.route(SIG_KEY % ("osqa.example.com", "/questions/1")), 0)
+        self.assertEqual(self.router.route(SIG_KEY % ("wiki.example.com", "/api.php?action=query")), 1)
+        self.assertEqual(self.router.route(SIG_KEY % ("wiki.example.com", "/index.php?title=Main")), 2)
+        self.assertEqual(self.router.route(SIG_KEY % ("other.example.com", "/index.php")), 2)
+        self.assertEqual(self.router.route(SIG_KEY % ("wiki.example.com", "/robots.txt")), None)
+        self.assertEqual(self.router.route("/api.php"), None)
+        self.assertEqual(self.router.route(""), None)
+
+    def test_host_field(self):
+        # only the field before the request URI is the host
+        self.assertEqual(request_host((SIG_KEY % ("wiki.example.com", "/")).split()), "wiki.example.com")
+        without_host = SIG_KEY.replace(" host%s", "") % "/questions/1"
+        self.assertEqual(request_host(without_host.split()), None)
+        self.assertEqual(self.router.route(without_host), None)
+        self.assertEqual(self.router.route("hostosqa.example.com /questions/1"), 0)
+        self.assertEqual(request_host(["hostosqa.example.com"]), None)
+
+    def test_no_shards(self):
+        self.assertEqual(ShardRouter([]).route("/index.php"), None)
+
+    def test_bad_shards(self):
+        self.assertRaises(ValueError, ShardRouter, [{"name" : "a", "sig_file" : "/tmp/a"}])
+        self.assertRaises(ValueError, ShardRouter, [{"name" : "a", "path_prefix" : "/"}])
+        self.assertRaises(ValueError, ShardRouter, [{"name" : DEFAULT_SHARD, "sig_file" : "/tmp/a",
+            "path_prefix" : "/"}])
+        self.assertRaises(ValueError, ShardRouter, [{"name" : "a", "sig_file" : "/tmp/a", "path_prefix" : "/",
+            "prefix" : "/"}])
+        self.assertRaises(ValueError, ShardRouter, [
+            {"name" : "a", "sig_file" : "/tmp/a", "path_prefix" : "/a"},
+            {"name" : "b", "sig_file" : "/tmp/a", "path_prefix" : "/b"}])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== sigfile.py ====
+#
+# Reads and writes signature files (i.e. Bayes models; see bayes.py).
+#
+# There are two formats:
+#   - text: one "TOKEN,POSITIVE_PROB,NEGATIVE_PROB" line per token (str() of a
+#     bayes.Classifier). This is what the doorman (../nginx_doorman/bayes.c)
+#     parses.
+#   - binary: a fixed layout that readers can mmap and query without parsing.
+#
+# Binary layout (little endian):
+#   header: magic "BSIG", version (u32), num_tokens (u32), num_buckets (u32),
+#           feature buckets (u32; 0 unless the model's tokens are hashed, see
+#           bayes.FeatureHasher), reserved (u32), model version (u64; see
+#           Publisher)
+#   num_buckets buckets of: token hash (u64), log(positive_prob) (double),
+#           log(negative_prob) (double)
+#
+# The buckets are an open-addressing hash table with linear probing: a token
+# lives in the first bucket at or after (hash % num_buckets) whose hash
+# matches, and is absent if an empty bucket (hash 0) comes first. num_buckets
+# is a power of two and at least twice num_tokens. The hash is 64-bit FNV-1a
+# of the token's first MAX_TOKEN_LEN bytes (the doorman truncates tokens the
+# same way), with 0 remapped to 1. Readers cannot tell apart tokens with the
+# same hash, so encode only keeps the most informative of them (see encode).
+# If the model's tokens are hashed into feature buckets, SigFileReader.lookup
+# hashes tokens the same way first.
+#
+# Both formats are published atomically: the file is written under a
+# temporary name and renamed into place, so readers never see a partially
+# written signature.
+#
+# Publisher only publishes a model when it differs materially from the last
+# model it published (see diff_models), and numbers the models it publishes.
+# After each signature it writes the model version to SIG_FILE.version, so
+# consumers can skip reloading a signature they already have by reading (or
+# stat'ing) that small file.
+#
+# USAGE: ./sigfile.py BINARY_SIG_FILE [--text TEXT_SIG_FILE]
+#   validates a binary signature file, and optionally checks that it holds the
+#   same model as a text signature file
+#
+
+import os
+import sys
+import math
+import mmap
+import struct
+import argparse
+import collections
+
+from bayes import MAX_TOKEN_LEN, feature_token
+
+MAGIC = "BSIG"
+VERSION = 3
+
+HEADER = struct.Struct("<4sIIIIIQ")
+BUCKET = struct.Struct("<Qdd")
+
+EMPTY = 0
+
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+MASK_64 = 0xffffffffffffffff
+
+FORMATS = ["text", "binary", "both"]
+
+# with --sig-format both, the binary signature goes to the sig file + this suffix
+BINARY_SUFFIX = ".bin"
+
+# Publisher writes the model version to the sig file + this suffix
+VERSION_SUFFIX = ".version"
+
+Header = collections.namedtuple("Header", ["num_tokens", "num_buckets", "feature_buckets", "model_version"])
+
+ModelDiff = collections.namedtuple("ModelDiff", ["added", "removed", "changed", "max_delta"])
+
+class SigFileError(Exception):
+    pass
+
+def token_hash(token):
+    h = FNV_OFFSET
+    for c in token[:MAX_TOKEN_LEN]:
+        h = ((h ^ ord(c)) * FNV_PRIME) & MASK_64
+    if h == EMPTY:
+        h = 1
+    return h
+
+def num_buckets_for(num_tokens):
+    num_buckets = 2
+    while num_buckets < 2 * num_tokens:
+        num_buckets *= 2
+    return num_buckets
+
+def bucket_offset(index):
+    return HEADER.size + index * BUCKET.size
+
+def atomic_write(path, data):
+    '''Replaces the file at path with data, such that readers see either the old
+    or the new file'''
+    tmp_path = "%s.tmp.%d" % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def encode(model, model_version=0, feature_buckets=0, logger=None):
+    '''Returns the binary signature for model (a dict that maps tokens to
+    bayes.Prob objects, like Classifier.model). Of several tokens with the same
+    hash, only the one with the highest rank is kept (and a warning is logged
+    to logger, if given)'''
+    num_buckets = num_buckets_for(len(model))
+    mask = num_buckets - 1
+    buckets = [None] * num_buckets
+    num_tokens = 0
+    for token, prob in sorted(model.iteritems(), key=lambda (token, prob): (-prob.rank(), token)):
+        h = token_hash(token)
+        index = h & mask
+        while buckets[index] != None and buckets[index][0] != h:
+            index = (index + 1) & mask
+        if buckets[index] != None:
+            if logger != None:
+                logger.warning("Tokens '%s' and '%s' have the same hash; leaving out '%s'",
+                    buckets[index][3], token, token)
+            continue
+        buckets[index] = (h, math.log(prob.positive_prob), math.log(prob.negative_prob), token)
+        num_tokens += 1
+
+    data = [HEADER.pack(MAGIC, VERSION, num_tokens, num_buckets, feature_buckets, 0, model_version)]
+    empty = BUCKET.pack(EMPTY, 0.0, 0.0)
+    for bucket in buckets:
+        if bucket == None:
+            data.append(empty)
+        else:
+            data.append(BUCKET.pack(*bucket[:3]))
+    return "".join(data)
+
+def check_format(sig_format, feature_buckets=0):
+    '''Raises ValueError unless sig_format is one of FORMATS and can hold models
+    whose tokens are hashed into feature_buckets feature buckets. The text
+    format cannot: the doorman reads it, and it does not hash its tokens, so
+    it would never match a token of the signature'''
+    if sig_format not in FORMATS:
+        raise ValueError("Unknown signature format: %s" % sig_format)
+    if feature_buckets > 0 and sig_format != "binary":
+        raise ValueError("Models with feature buckets can only be published in the binary format "
+            "(the doorman does not hash tokens), not %s" % sig_format)
+
+def publish(sig_file, classifier, sig_format="text", model_version=0, feature_buckets=0, logger=None):
+    '''Atomically writes classifier's model to sig_file in sig_format (one of
+    FORMATS; see check_format). logger gets encode's warnings'''
+    check_format(sig_format, feature_buckets)
+    if sig_format == "binary":
+        atomic_write(sig_file, encode(classifier.model, model_version, feature_buckets, logger))
+    else:
+        atomic_write(sig_file, str(classifier) + "\n")
+        if sig_format == "both":
+            atomic_write(sig_file + BINARY_SUFFIX,
+                encode(classifier.model, model_version, feature_buckets, logger))
+
+def model_probs(model):
+    '''Returns a dict that maps each token in model (see encode) to
+    (positive_prob, negative_prob)'''
+    return dict((token, (prob.positive_prob, prob.negative_prob)) for token, prob in model.iteritems())
+
+def diff_models(old, new):
+    '''Returns the ModelDiff from old to new, which map tokens to (positive_prob,
+    negative_prob) (see model_probs). max_delta is the largest change in any
+    probability, where a token that is missing from a model has probability 0'''
+    added = 0
+    removed = 0
+    changed = 0
+    max_delta = 0.0
+    for token, probs in new.iteritems():
+        old_probs = old.get(token)
+        if old_probs == None:
+            added += 1
+            max_delta = max(max_delta, probs[0], probs[1])
+        elif old_probs != probs:
+            changed += 1
+            max_delta = max(max_delta, abs(probs[0] - old_probs[0]), abs(probs[1] - old_probs[1]))
+    for token, probs in old.iteritems():
+        if token not in new:
+            removed += 1
+            max_delta = max(max_delta, probs[0], probs[1])
+    return ModelDiff(added, removed, changed, max_delta)
+
+def read_model_version(sig_file):
+    '''Returns the model version of the signature last published to sig_file by a
+    Publisher, or 0 if there is none'''
+    try:
+        with open(sig_file + VERSION_SUFFIX) as f:
+            return int(f.read().strip())
+    except (IOError, ValueError):
+        return 0
+
+class Publisher:
+    '''Publishes signatures to sig_file (see publish), unless the model differs from
+    the last published model by a max_delta of at most threshold. The first
+    model is always published. Every published model gets the next model
+    version, which continues from the version of the signature already in
+    sig_file (if any), so it increases across restarts. feature_buckets is the
+    number of feature buckets the models' tokens are hashed into (0 = not
+    hashed). logger gets encode's warnings'''
+
+    def __init__(self, sig_file, sig_format="text", threshold=0.0, feature_buckets=0, logger=None):
+        check_format(sig_format, feature_buckets)
+        self.sig_file = sig_file
+        self.sig_format = sig_format
+        self.threshold = threshold
+        self.feature_buckets = feature_buckets
+        self.logger = logger
+        self.model_version = read_model_version(sig_file)
+        # see model_probs
+        self.published = None
+
+    def publish(self, classifier):
+        '''Returns (ModelDiff from the last published model, whether classifier was
+        published)'''
+        model = model_probs(classifier.model)
+        diff = diff_models(self.published if self.published != None else {}, model)
+        if self.published != None and diff.max_delta <= self.threshold:
+            return diff, False
+        model_version = self.model_version + 1
+        publish(self.sig_file, classifier, self.sig_format, model_version, self.feature_buckets, self.logger)
+        atomic_write(self.sig_file + VERSION_SUFFIX, "%d\n" % model_version)
+        self.model_version = model_version
+        self.published = model
+        return diff, True
+
+def load_text(path):
+    '''Returns a dict that maps each token in the text signature file to
+    (positive_prob, negative_prob)'''
+    model = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line == "":
+                continue
+            token, positive_prob, negative_prob = line.rsplit(",", 2)
+            model[token] = (float(positive_prob), float(negative_prob))
+    return model
+
+class SigFileReader:
+    '''Queries a binary signature file. Reopens the file if it was replaced.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.mmap = None
+        self.inode = None
+        self.header = None
+
+    def open(self):
+        '''(Re)maps the file if necessary. Raises SigFileError if it is missing or invalid'''
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError, e:
+            self.close()
+            raise SigFileError("Could not stat %s: %s" % (self.path, e))
+        if inode == self.inode:
+            return
+        self.close()
+        try:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ)
+        except (IOError, mmap.error), e:
+            raise SigFileError("Could not map %s: %s" % (self.path, e))
+        if len(mapped) < HEADER.size:
+            mapped.close()
+            raise SigFileError("%s is too short" % self.path)
+        magic, version, num_tokens, num_buckets, feature_buckets, reserved, model_version = \
+            HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != VERSION:
+            mapped.close()
+            raise SigFileError("%s is not a version %d signature file" % (self.path, VERSION))
+        if num_buckets < 2 or num_buckets & (num_buckets - 1) != 0 or num_tokens * 2 > num_buckets or \
+                len(mapped) != bucket_offset(num_buckets):
+            mapped.close()
+            raise SigFileError("%s has an invalid header" % self.path)
+        self.mmap = mapped
+        self.inode = inode
+        self.header = Header(num_tokens, num_buckets, feature_buckets, model_version)
+
+    def close(self):
+        if self.mmap != None:
+            self.mmap.close()
+        self.mmap = None
+        self.inode = None
+        self.header = None
+
+    def lookup(self, token):
+        '''Returns (log(positive_prob), log(negative_prob)) for token, or None if it
+        is not in the model'''
+        if self.header.feature_buckets > 0:
+            token = feature_token(token, self.header.feature_buckets)
+        return self.find(token)
+
+    def find(self, token):
+        '''Like lookup, but token is one of the model's own tokens (already hashed
+        into a feature bucket if the model uses them)'''
+        h = token_hash(token)
+        mask = self.header.num_buckets - 1
+        index = h & mask
+        while True:
+            bucket_hash, log_positive, log_negative = BUCKET.unpack_from(self.mmap, bucket_offset(index))
+            if bucket_hash == h:
+                return (log_positive, log_negative)
+            if bucket_hash == EMPTY:
+                return None
+            index = (index + 1) & mask
+
+    def classify(self, message, positive_prior=0.5, negative_prior=0.5):
+        '''Like bayes.Classifier.classify, but sums log-probabilities'''
+        self.open()
+        positive = math.log(positive_prior)
+        negative = math.log(negative_prior)
+        for token in message:
+            probs = self.lookup(token)
+            if probs != None:
+                positive += probs[0]
+                negative += probs[1]
+        if positive > negative:
+            return "positive"
+        else:
+            return "negative"
+
+    def validate(self):
+        '''Checks the whole hash table. Raises SigFileError on the first problem'''
+        self.open()
+        mask = self.header.num_buckets - 1
+        num_tokens = 0
+        for index in xrange(self.header.num_buckets):
+            bucket_hash, log_positive, log_negative = BUCKET.unpack_from(self.mmap, bucket_offset(index))
+            if bucket_hash == EMPTY:
+                continue
+            num_tokens += 1
+            for log_prob in (log_positive, log_negative):
+                if not (log_prob <= 0.0 and log_prob > float("-inf")):
+                    raise SigFileError("Bucket %d has invalid log-probability %r" % (index, log_prob))
+            # every bucket between the token's home bucket and its bucket must be full
+            probe = bucket_hash & mask
+            while probe != index:
+                probe_hash = BUCKET.unpack_from(self.mmap, bucket_offset(probe))[0]
+                if probe_hash == EMPTY:
+                    raise SigFileError("Bucket %d is unreachable from bucket %d" % (index, bucket_hash & mask))
+                if probe_hash == bucket_hash:
+                    raise SigFileError("Buckets %d and %d have the same hash" % (probe, index))
+                probe = (probe + 1) & mask
+        if num_tokens != self.header.num_tokens:
+            raise SigFileError("Header says %d tokens, but the table has %d" %
+                (self.header.num_tokens, num_tokens))
+
+    def compare(self, model, tolerance=1e-6):
+        '''Raises SigFileError unless the file holds exactly the tokens in model (a
+        dict from load_text), with the same probabilities (within tolerance,
+        since the text format rounds them)'''
+        self.open()
+        if len(model) != self.header.num_tokens:
+            raise SigFileError("%d tokens in the model, but %d in %s" %
+                (len(model), self.header.num_tokens, self.path))
+        for token, (positive_prob, negative_prob) in model.iteritems():
+            probs = self.find(token)
+            if probs == None:
+                raise SigFileError("Token '%s' is missing from %s" % (token, self.path))
+            if abs(math.exp(probs[0]) - positive_prob) > tolerance or \
+                    abs(math.exp(probs[1]) - negative_prob) > tolerance:
+                raise SigFileError("Token '%s' has probabilities (%f, %f) in %s, but (%f, %f) in the model" %
+                    (token, math.exp(probs[0]), math.exp(probs[1]), self.path, positive_prob, negative_prob))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validates a binary signature file')
+    parser.add_argument("sig_file", type=str,
+                        help="The binary signature file")
+    parser.add_argument("-t", "--text", type=str, default=None,
+                        help="A text signature file that should hold the same model")
+    args = parser.parse_args()
+
+    reader = SigFileReader(args.sig_file)
+    try:
+        reader.validate()
+        if args.text != None:
+            reader.compare(load_text(args.text))
+    except SigFileError, e:
+        print "INVALID: %s" % e
+        sys.exit(1)
+    print "OK: %d tokens in %d buckets (%d feature buckets, model version %d)" % reader.header
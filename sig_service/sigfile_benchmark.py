@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== sigfile_benchmark.py ====
+#
+# Compares the text and binary signature formats (see sigfile.py). Builds a
+# model from a request trace (requests matching --positive-regex are
+# positive), publishes it in both formats, validates the binary file against
+# the text file, and reports as JSON:
+#   - the size of each file
+#   - the time to load each file until it can be queried (parsing the text
+#     file into a dict vs. mapping the binary file and checking its header)
+#   - the time to look up every token of every request in each
+#
+# USAGE: ./sigfile_benchmark.py [--requests wikipedia_requests.txt] [--repeat 20]
+#
+
+import os
+import re
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+import bayes
+import sigfile
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+def median_time(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return sorted(times)[len(times) / 2]
+
+def benchmark(requests, positive_regex, bayes_classifier, repeat, sig_dir):
+    positive_regex = re.compile(positive_regex)
+    samples = [bayes.splitTokensUrl(request) for request in requests]
+    positive = [sample for request, sample in zip(requests, samples) if positive_regex.search(request)]
+    negative = [sample for request, sample in zip(requests, samples) if not positive_regex.search(request)]
+    classifier = bayes.Classifier(positive, negative, **bayes_classifier)
+
+    text_file = os.path.join(sig_dir, "sig_file")
+    binary_file = text_file + sigfile.BINARY_SUFFIX
+    publish_time = median_time(lambda: sigfile.publish(text_file, classifier, "both"), repeat)
+
+    reader = sigfile.SigFileReader(binary_file)
+    reader.validate()
+    reader.compare(sigfile.load_text(text_file))
+
+    def load_binary():
+        reader.close()
+        reader.open()
+
+    text_model = sigfile.load_text(text_file)
+    def lookup_text():
+        for sample in samples:
+            for token in sample:
+                text_model.get(token)
+
+    def lookup_binary():
+        for sample in samples:
+            for token in sample:
+                reader.lookup(token)
+
+    return {
+        "requests" : len(requests),
+        "tokens" : len(classifier.model),
+        "publish_both" : publish_time,
+        "text" : {
+            "bytes" : os.path.getsize(text_file),
+            "load" : median_time(lambda: sigfile.load_text(text_file), repeat),
+            "lookup_all" : median_time(lookup_text, repeat),
+        },
+        "binary" : {
+            "bytes" : os.path.getsize(binary_file),
+            "load" : median_time(load_binary, repeat),
+            "lookup_all" : median_time(lookup_binary, repeat),
+        },
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares the text and binary signature formats')
+    parser.add_argument("-r", "--requests", type=str, default=os.path.join(DIRNAME, "wikipedia_requests.txt"),
+                        help="Default=%(default)s. File with one request URL per line")
+    parser.add_argument("-p", "--positive-regex", type=str, default="action=raw",
+                        help="Default=%(default)s. Requests matching this regex are positive")
+    parser.add_argument("-n", "--repeat", type=int, default=20,
+                        help="Default=%(default)d. Number of times to time each operation")
+    parser.add_argument("-bm", "--bayes-model-size", type=int, default=5000,
+                        help="Default=%(default)d. Size of Bayes model; see bayes.py")
+    parser.add_argument("-br", "--bayes-rare-threshold", type=float, default=0.0,
+                        help="Default=%(default)f. Rarity threshold for Bayes model; see bayes.py")
+    args = parser.parse_args()
+
+    with open(args.requests) as f:
+        requests = [line.strip() for line in f if line.strip() != ""]
+
+    bayes_classifier = {
+        "model_size" : args.bayes_model_size,
+        "rare_threshold" : args.bayes_rare_threshold,
+    }
+    sig_dir = tempfile.mkdtemp()
+    try:
+        results = benchmark(requests, args.positive_regex, bayes_classifier, args.repeat, sig_dir)
+    finally:
+        shutil.rmtree(sig_dir)
+    print json.dumps(results, indent=4, sort_keys=True)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== sigfile_test.py ====
+#
+#
+import os
+import math
+import shutil
+import logging
+import tempfile
+import unittest
+import bayes
+from sigfile import *
+
+POSITIVE = [set(["evil", "index", "php"]), set(["evil", "search"]), set(["evil", "index"])]
+NEGATIVE = [set(["index", "php"]), set(["main", "page"]), set(["index", "search"]), set(["page"])]
+
+class Test_sigfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.sig_file = os.path.join(self.tempdir, "signature.txt")
+        self.classifier = bayes.Classifier(POSITIVE, NEGATIVE, rare_threshold=0.0)
+        self.logger = logging.getLogger("sigfile_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_round_trip(self):
+        publish(self.sig_file, self.classifier, "both", model_version=7)
+        reader = SigFileReader(self.sig_file + BINARY_SUFFIX)
+        reader.validate()
+        self.assertEqual(reader.header, Header(len(self.classifier.model), 16, 0, 7))
+        reader.compare(load_text(self.sig_file))
+        for token, prob in self.classifier.model.iteritems():
+            self.assertEqual(reader.lookup(token), (math.log(prob.positive_prob), math.log(prob.negative_prob)))
+        self.assertEqual(reader.lookup("missing"), None)
+        for message in POSITIVE + NEGATIVE + [set(["evil"]), set()]:
+            self.assertEqual(reader.classify(message), self.classifier.classify(message))
+        reader.close()
+
+    def test_feature_buckets(self):
+        hashed = lambda messages: [set(bayes.feature_token(token, 8) for token in message) for message in messages]
+        classifier = bayes.Classifier(hashed(POSITIVE), hashed(NEGATIVE), rare_threshold=0.0)
+        publish(self.sig_file, classifier, "binary", feature_buckets=8)
+        reader = SigFileReader(self.sig_file)
+        reader.validate()
+        self.assertEqual(reader.header.feature_buckets, 8)
+        prob = classifier.model[bayes.feature_token("evil", 8)]
+        self.assertEqual(reader.lookup("evil"), (math.log(prob.positive_prob), math.log(prob.negative_prob)))
+        reader.close()
+
+    def test_check_format(self):
+        check_format("binary", 8)
+        check_format("both", 0)
+        for sig_format in ["text", "both"]:
+            self.assertRaises(ValueError, Publisher, self.sig_file, sig_format, feature_buckets=8)
+        self.assertRaises(ValueError, publish, self.sig_file, self.classifier, "csv")
+        self.assertFalse(os.path.exists(self.sig_file))
+
+    def test_colliding_tokens(self):
+        # tokens are hashed by their first MAX_TOKEN_LEN bytes
+        common = "x" * bayes.MAX_TOKEN_LEN
+        classifier = bayes.Classifier([set([common + "a"])] * 3,
+            [set([common + "b", "page"]), set(["page"]), set(["page"])], rare_threshold=0.0)
+        self.assertEqual(token_hash(common + "a"), token_hash(common + "b"))
+        publish(self.sig_file, classifier, "binary", logger=self.logger)
+        reader = SigFileReader(self.sig_file)
+        reader.validate()
+        self.assertEqual(reader.header.num_tokens, 2)
+        # the token with the higher rank is kept
+        prob = classifier.model[common + "a"]
+        self.assertEqual(reader.find(common + "b"), (math.log(prob.positive_prob), math.log(prob.negative_prob)))
+        reader.close()
+
+    def test_publisher(self):
+        publisher = Publisher(self.sig_file, threshold=0.1)
+        self.assertEqual(publisher.publish(self.classifier)[1], True)
+        self.assertEqual(publisher.publish(self.classifier), (ModelDiff(0, 0, 0, 0.0), False))
+        self.assertEqual(read_model_version(self.sig_file), 1)
+
+        # a failed publish does not use up a model version
+        publisher = Publisher(os.path.join(self.tempdir, "missing", "signature.txt"))
+        self.assertRaises((IOError, OSError), publisher.publish, self.classifier)
+        self.assertEqual(publisher.model_version, 0)
+
+        # the model version continues across publishers
+        publisher = Publisher(self.sig_file)
+        publisher.publish(bayes.Classifier(POSITIVE[:2], NEGATIVE))
+        self.assertEqual(read_model_version(self.sig_file), 2)
+
+if __name__ == '__main__':
+    unittest.main()
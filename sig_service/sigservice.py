@@ -26,15 +26,37 @@
 #
 # TODO: the classification might work better if it takes into account missing features
 #
+# Several applications behind the same nginx can each get their own model: with
+# shards (see shards.py), the SigServer routes each notice to a shard by
+# virtual host or URL path prefix, and every shard learns in its own process
+# and writes its own signature file.
+#
+# After every update cycle, each learner writes its stats (see ShardStats in
+# SignatureService.thrift) to SIG_FILE.stats, so that the stats() RPC can
+# report them no matter which process the learner runs in.
+#
+# Each learner also classifies every new sample with the signature it
+# published most recently, before learning from the sample, and keeps rolling
+# confusion matrices of the results (see shadow.py). They are part of its stats,
+# and are added to the CSV time series SIG_FILE.shadow (which keeps the most
+# recent rows) after every cycle.
+#
 
 import bayes
+import samplestore
+import shadow
+import sigfile
+import tokenizer
+from shards import ShardRouter, DEFAULT_SHARD
 import sys
 import os
 import argparse
+import json
 
 import threading
 import logging
 import Queue
+import multiprocessing
 import time
 
 DIRNAME = os.path.dirname(os.path.realpath(__file__))
@@ -43,35 +65,90 @@ sys.path.append(os.path.join(DIRNAME, '..', 'common'))
 sys.path.append(os.path.join(DIRNAME, '..', 'bouncer'))
 
 import log
+import rpc
 
 import import_thrift_lib
 
-from thrift.transport import TSocket
-from thrift.transport import TTransport
-from thrift.protocol import TBinaryProtocol
-from thrift.server import TServer
 from thrift.Thrift import TException
 
 from SignatureService import SignatureService
 from SignatureService.ttypes import *
 
-from bouncer_common import Config
+from bouncer_common import Config, DEFAULT_RPC, SIGSERVICE_RPC_MODES
+
+# each learner writes its stats to its sig file + this suffix
+STATS_SUFFIX = ".stats"
+
+# and its shadow evaluation time series (see shadow.py) to its sig file + this suffix
+SHADOW_SUFFIX = ".shadow"
+
+# the stats of a learner that has not finished an update cycle yet
+LEARN_STATS = {
+    "samples" : 0,
+    "cycles" : 0,
+    "model_version" : 0,
+    "validate_seconds" : 0.0,
+    "build_seconds" : 0.0,
+    "write_seconds" : 0.0,
+    "last_update" : 0.0,
+    # a [window, tp, fp, tn, fn] list for every shadow window
+    "shadow" : [],
+}
+
+def read_learn_stats(sig_file):
+    '''Returns the stats that the learner for sig_file wrote most recently'''
+    stats = dict(LEARN_STATS)
+    try:
+        with open(sig_file + STATS_SUFFIX) as f:
+            stats.update((str(key), value) for key, value in json.load(f).iteritems() if key in LEARN_STATS)
+    except (IOError, ValueError):
+        pass
+    return stats
 
 class LearnThread(threading.Thread):
 
     def __init__(self, queue, sig_file, max_sample_size, update_requests, \
-        min_delay, max_delay, bayes_classifier, logger):
+        min_delay, max_delay, bayes_classifier, logger, validate_pool=None, sig_format="text",
+        publish_threshold=0.0, token_cache_size=10000, sample_store=None, feature_buckets=0,
+        tokenizer_pipeline=tokenizer.DEFAULT_PIPELINE, shadow_windows=None):
         '''
         creates a new signature whenever it receives at least update_requests requests
         or max_delay seconds have passed since that last signature.
         At leat min_delay seconds must pass between signature generations
+        validate_pool is the process pool that validates large windows of
+        samples (see bayes.Validate), or None to validate in the LearnThread.
+        It must be created before any threads start (see bayes.make_pool)
+        sig_format is one of sigfile.FORMATS
+        a new signature is only published if some token's probability changed
+        by more than publish_threshold (see sigfile.Publisher)
+        token_cache_size is the number of request strings whose tokens are
+        cached (see bayes.TokenCache)
+        sample_store is a dict {"policy" : ..., other options} that selects how
+        the (at most) max_sample_size samples of each category are chosen (see
+        samplestore.make_store). By default, the newest samples.
+        if feature_buckets is not 0, tokens are hashed into that many feature
+        buckets (see bayes.FeatureHasher); sig_format must be binary (see
+        sigfile.check_format)
+        tokenizer_pipeline selects how requests are split into tokens (see
+        tokenizer.py); pipelines other than "words" require sig_format binary
+        (see tokenizer.check_format)
+        shadow_windows is the list of windows (in seconds) over which new samples
+        are shadow-evaluated (see shadow.py). None means shadow.DEFAULT_WINDOWS;
+        the empty list turns shadow evaluation off.
         '''
         threading.Thread.__init__(self)
         self.queue = queue
         self.bayes_classifier = bayes_classifier
-
-        # make sure bayes_classifier is valid
+        self.validate_pool = validate_pool
+        self.publisher = sigfile.Publisher(sig_file, sig_format, publish_threshold, feature_buckets, logger)
+        tokenizer.check_format(tokenizer_pipeline, sig_format)
+        self.token_cache = bayes.TokenCache(
+            bayes.make_tokenizer(feature_buckets, tokenizer.compile_pipeline(tokenizer_pipeline)), token_cache_size)
+        self.sample_store = sample_store if sample_store != None else {}
+
+        # make sure bayes_classifier and sample_store are valid
         test = bayes.Classifier( [], [], **self.bayes_classifier)
+        test = samplestore.make_store(max_sample_size, **self.sample_store)
 
         self.sig_file = sig_file
         self.max_sample_size = max_sample_size
@@ -79,13 +156,56 @@ class LearnThread(threading.Thread):
         self.min_delay = min_delay
         self.max_delay = max_delay
         self.logger = logger
+        self.stats = dict(LEARN_STATS)
+        self.stats["model_version"] = self.publisher.model_version
+
+        if shadow_windows == None:
+            shadow_windows = shadow.DEFAULT_WINDOWS
+        self.shadow = shadow.ShadowEvaluator(shadow_windows) if len(shadow_windows) > 0 else None
+        # the classifier of the signature published most recently
+        self.live_classifier = None
+
+    def write_stats(self):
+        try:
+            sigfile.atomic_write(self.sig_file + STATS_SUFFIX, json.dumps(self.stats) + "\n")
+        except (IOError, OSError), e:
+            self.logger.error("Could not write stats: %s", e)
 
     def tokenize(self, request_str):
-        return bayes.splitTokensUrl(request_str)
+        return self.token_cache(request_str)
+
+    def evaluate(self, category, sample):
+        '''Classifies sample with the live signature (before any model learns from
+        it). Samples that arrive before the first signature are not evaluated'''
+        if self.shadow != None and self.live_classifier != None:
+            self.shadow.add(category, self.live_classifier.classify(sample))
+
+    def write_shadow(self):
+        confusions = self.shadow.confusions()
+        for confusion in confusions:
+            self.logger.info("shadow window %gs: tp = %d, fp = %d, tn = %d, fn = %d", *confusion)
+        self.stats["shadow"] = [list(confusion) for confusion in confusions]
+        try:
+            self.shadow.write_series(self.sig_file + SHADOW_SUFFIX, self.publisher.model_version)
+        except (IOError, OSError), e:
+            self.logger.error("Could not write shadow evaluation: %s", e)
+
+    def add_sample(self, store, category, sample):
+        '''Adds sample to store, and keeps the model in sync with the store'''
+        evicted = store.add(sample)
+        if not store.weighted:
+            self.model.add(category, sample)
+            for old_sample in evicted:
+                self.model.remove(category, old_sample)
 
     def run(self):
-        self.evicted = []
-        self.completed = []
+        self.evicted = samplestore.make_store(self.max_sample_size, **self.sample_store)
+        self.completed = samplestore.make_store(self.max_sample_size, **self.sample_store)
+        # evicted requests are the positive samples. Unless the samples are
+        # weighted, the model's token counts track self.evicted and
+        # self.completed so each update only re-ranks the tokens of samples that
+        # entered or left the stores since the last one
+        self.model = bayes.IncrementalModel(**self.bayes_classifier)
 
         while True:
             last_update = time.time()
@@ -100,10 +220,15 @@ class LearnThread(threading.Thread):
                     category, request_str = self.queue.get(timeout=timeout)
                     self.logger.debug("Received sample: %s --> %s", category, request_str)
                     num_new_samples += 1
+                    self.stats["samples"] += 1
                     if category == "evicted":
-                        self.evicted.append(self.tokenize(request_str))
+                        sample = self.tokenize(request_str)
+                        self.evaluate("positive", sample)
+                        self.add_sample(self.evicted, "positive", sample)
                     elif category == "completed":
-                        self.completed.append(self.tokenize(request_str))
+                        sample = self.tokenize(request_str)
+                        self.evaluate("negative", sample)
+                        self.add_sample(self.completed, "negative", sample)
                     else:
                         self.logger.error("Unexpected message from queue: (%s, %s)", category, request_str)
                 except Queue.Empty:
@@ -113,74 +238,179 @@ class LearnThread(threading.Thread):
             elapsed = time.time() - last_update
             self.logger.info("Time since last update: %fs", elapsed)
             self.logger.info("Samples since last update: %d", num_new_samples)
+            self.logger.info("Token cache: %d entries, %d hits, %d misses (hit rate = %f)",
+                len(self.token_cache), self.token_cache.hits, self.token_cache.misses,
+                self.token_cache.hit_rate())
 
             self.logger.info("Evaluating signature accuracy")
-            validate = bayes.Validate(self.evicted, self.completed, self.logger)
+            validate = bayes.Validate(self.evicted, self.completed, self.logger,
+                pool=self.validate_pool, **self.bayes_classifier)
             tp, fp, tn, fn = validate.validate()
+            for fold in validate.folds:
+                self.logger.info("fold %d: tp = %d, fp = %d, tn = %d, fn = %d (%fs)", *fold)
+            self.logger.info("Validation time: %fs", validate.seconds)
             self.logger.info("tp = %d", tp)
             self.logger.info("fp = %d", fp)
             self.logger.info("tn = %d", tn)
             self.logger.info("fn = %d", fn)
+            self.stats["validate_seconds"] = validate.seconds
             if fp + tn > 0:
                 self.logger.info("fp-rate = %f", float(fp) / (fp + tn))
             if fn + tp > 0:
                 self.logger.info("fn-rate = %f", float(fn) / (fn + tp))
 
             self.logger.info("Building new signature")
-            self.evicted = self.evicted[-self.max_sample_size:]
-            self.completed = self.completed[-self.max_sample_size:]
             for i, sample in enumerate(self.evicted):
                 self.logger.info("evicted-%d: %s", i, sample)
             for i, sample in enumerate(self.completed):
                 self.logger.info("completed-%d: %s", i, sample)
-            classifier = bayes.Classifier(self.evicted, self.completed, **self.bayes_classifier)
-            with open(self.sig_file, 'w') as f:
-                f.write(str(classifier) + "\n")
-
-
+            build_start = time.time()
+            if self.evicted.weighted:
+                # the weights change over time, so count from scratch
+                classifier = bayes.Classifier(self.evicted, self.completed, **self.bayes_classifier)
+            else:
+                classifier = self.model.classifier()
+            write_start = time.time()
+            self.stats["build_seconds"] = write_start - build_start
+            try:
+                diff, published = self.publisher.publish(classifier)
+            except Exception:
+                # e.g. the ramdisk is full. The next cycle tries again
+                self.logger.exception("Error while publishing signature")
+            else:
+                self.logger.info("Signature diff: %d added, %d removed, %d changed, max delta = %f",
+                    diff.added, diff.removed, diff.changed, diff.max_delta)
+                if published:
+                    self.logger.info("Published signature version %d", self.publisher.model_version)
+                    self.live_classifier = classifier
+                else:
+                    self.logger.info("Signature has not changed by more than %f; not publishing",
+                        self.publisher.threshold)
+            self.stats["write_seconds"] = time.time() - write_start
+            self.stats["cycles"] += 1
+            self.stats["model_version"] = self.publisher.model_version
+            self.stats["last_update"] = time.time()
+            if self.shadow != None:
+                self.write_shadow()
+            self.write_stats()
+
+def learn_process(name, *args):
+    '''Runs a LearnThread (constructed with args) in the calling process'''
+    lt = LearnThread(*args)
+    lt.logger.info("Learning shard '%s' in process %d", name, os.getpid())
+    lt.run()
 
 class SigServer:
 
     def __init__(self, sig_file, addr, port, max_sample_size, update_requests, \
-        min_delay, max_delay, bayes_classifier, logger):
-
+        min_delay, max_delay, bayes_classifier, logger, rpc=DEFAULT_RPC, validate_processes=None,
+        sig_format="text", publish_threshold=0.0, token_cache_size=10000, sample_store=None,
+        shards=None, feature_buckets=0, tokenizer_pipeline=tokenizer.DEFAULT_PIPELINE, shadow_windows=None):
+        '''rpc is a dict {"mode" : ..., "concurrency" : ...} that selects the kind of
+        Thrift server (see ../common/rpc.py)
+        validate_processes, sig_format, publish_threshold, token_cache_size,
+        sample_store, feature_buckets, tokenizer_pipeline, shadow_windows: see
+        LearnThread
+        shards is a list of shard dicts (see shards.py). If there are any, each
+        shard, and the default shard (which writes sig_file), learns in its own
+        process.'''
+
+        self.start_time = time.time()
+        self.router = ShardRouter(shards if shards != None else [])
         self.sig_file = sig_file
+        self.sig_format = sig_format
+        self.publish_threshold = publish_threshold
+        self.token_cache_size = token_cache_size
+        self.sample_store = sample_store
+        self.feature_buckets = feature_buckets
+        self.tokenizer_pipeline = tokenizer_pipeline
+        self.shadow_windows = shadow_windows
         self.bayes_classifier = bayes_classifier
 
+        # the (name, sig_file) of every shard; the default shard is last, so
+        # that index None from ShardRouter.route selects it
+        self.shards = [(shard.name, shard.sig_file) for shard in self.router.shards]
+        self.shards.append((DEFAULT_SHARD, self.sig_file))
+
+        # make sure the pipeline is valid before any learn process starts
+        tokenizer.check_format(self.tokenizer_pipeline, self.sig_format)
+
         classifier = bayes.Classifier( [], [], **self.bayes_classifier)
-        with open(self.sig_file, 'w') as f:
-            f.write(str(classifier) + "\n")
+        for name, shard_sig_file in self.shards:
+            sigfile.Publisher(shard_sig_file, self.sig_format,
+                feature_buckets=self.feature_buckets).publish(classifier)
 
         self.addr = addr
         self.port = port
-        self.queue = Queue.Queue()
+        self.rpc = rpc
+        if self.rpc["mode"] == "processpool" or len(self.shards) > 1:
+            # evicted() and completed() run in the server's worker processes,
+            # or the shards learn in their own processes
+            self.queues = [multiprocessing.Queue() for shard in self.shards]
+        else:
+            self.queues = [Queue.Queue()]
         self.max_sample_size = max_sample_size
         self.update_requests = update_requests
         self.min_delay = min_delay
         self.max_delay = max_delay
         self.logger = logger
+        self.validate_processes = validate_processes
+
+    def queue(self, request_str):
+        '''Returns the queue of the shard for request_str'''
+        index = self.router.route(request_str)
+        if index == None:
+            return self.queues[-1]
+        return self.queues[index]
 
     def evicted(self, request_str):
-        self.queue.put(("evicted", request_str))
+        self.queue(request_str).put(("evicted", request_str))
 
     def completed(self, request_str):
-        self.queue.put(("completed", request_str))
+        self.queue(request_str).put(("completed", request_str))
+
+    def stats(self):
+        self.logger.debug("Received stats request")
+        shards = []
+        for (name, sig_file), queue in zip(self.shards, self.queues):
+            learn_stats = read_learn_stats(sig_file)
+            learn_stats["shadow"] = [ConfusionMatrix(window=window, tp=tp, fp=fp, tn=tn, fn=fn)
+                for window, tp, fp, tn, fn in learn_stats["shadow"]]
+            shards.append(ShardStats(name=name, sig_file=sig_file, queue_depth=queue.qsize(), **learn_stats))
+        return SigServiceStats(shards=shards, uptime=time.time() - self.start_time)
+
+    def learn_args(self, queue, sig_file, validate_pool):
+        return (queue, sig_file, self.max_sample_size, self.update_requests, self.min_delay,
+            self.max_delay, self.bayes_classifier, self.logger, validate_pool, self.sig_format,
+            self.publish_threshold, self.token_cache_size, self.sample_store, self.feature_buckets,
+            self.tokenizer_pipeline, self.shadow_windows)
 
     def run(self):
 
-        # launch learn thread
-        lt = LearnThread(self.queue, self.sig_file, self.max_sample_size, self.update_requests, self.min_delay, self.max_delay, self.bayes_classifier, self.logger)
-        lt.start()
+        if len(self.shards) == 1:
+            # launch learn thread. The validation pool forks before this or any
+            # other thread (e.g. the Thrift server's) starts
+            validate_pool = bayes.make_pool(self.validate_processes)
+            lt = LearnThread(*self.learn_args(self.queues[0], self.sig_file, validate_pool))
+            lt.start()
+        else:
+            # launch a learn process per shard. The shards already use several
+            # cores (and daemonic processes cannot have children), so they
+            # validate in the learn process
+            for (name, sig_file), queue in zip(self.shards, self.queues):
+                process = multiprocessing.Process(target=learn_process, name="learn-%s" % name,
+                    args=(name,) + self.learn_args(queue, sig_file, None))
+                process.daemon = True
+                process.start()
+                self.logger.info("Started shard '%s' (sig_file = %s) in process %d", name, sig_file,
+                    process.pid)
 
         # Launch thrift service
         processor = SignatureService.Processor(self)
-        transport = TSocket.TServerSocket(port=self.port)
-        tfactory = TTransport.TBufferedTransportFactory()
-        pfactory = TBinaryProtocol.TBinaryProtocolFactory()
-
-        server = TServer.TThreadPoolServer(processor, transport, tfactory, pfactory)
+        server = rpc.make_server(processor, self.port, self.rpc["mode"], self.rpc["concurrency"])
 
-        self.logger.info("Starting Signature Service on port %d" % self.port)
+        self.logger.info("Starting Signature Service on port %d (rpc mode = %s, concurrency = %d)",
+            self.port, self.rpc["mode"], self.rpc["concurrency"])
         server.serve()
         self.logger.info("finished")
 
@@ -196,6 +426,8 @@ if __name__ == "__main__":
                         help="Default=%(default)d. Size of Bayes model; see bayes.py")
     parser.add_argument("-br", "--bayes-rare-threshold", type=float, default=0.01,
                         help="Default=%(default)f. Rarity threshold for Bayes model; see bayes.py")
+    parser.add_argument("-be", "--bayes-engine", choices=bayes.ENGINES, default="python",
+                        help="Default=%(default)s. Implementation used to validate the Bayes model; see bayes.py")
     parser.add_argument("-a", "--addr", type=str, default="127.0.0.1",
                         help="Default=%(default)s. Alert router will send notifcations to SigService at ADDR")
     parser.add_argument("-p", "--port", type=int, default=4001,
@@ -209,6 +441,47 @@ if __name__ == "__main__":
                         help="Default=%(default)f. Minimum number of seconds that must pass between successive signature updates")
     parser.add_argument("-x", "--max-delay", type=float, default=5.0,
                         help="Default=%(default)f. Maximum number of seconds that may pass before a new signature is generated")
+    parser.add_argument("--rpc-mode", type=str, default=DEFAULT_RPC["mode"], choices=SIGSERVICE_RPC_MODES,
+                        help="Default=%(default)s. Kind of Thrift server; see common/rpc.py")
+    parser.add_argument("--rpc-concurrency", type=int, default=DEFAULT_RPC["concurrency"],
+                        help="Default=%(default)d. Number of handler threads (or processes, for processpool)")
+    parser.add_argument("--validate-processes", type=int, default=None,
+                        help="Default=one per CPU. Number of processes that validate large sample windows "
+                        "(1 = always validate in the LearnThread); see bayes.py")
+    parser.add_argument("--sig-format", choices=sigfile.FORMATS, default="text",
+                        help="Default=%(default)s. Format of the signature file. The doorman reads the text "
+                        "format; \"both\" also writes the binary format to SIG_FILE" + sigfile.BINARY_SUFFIX +
+                        " (see sigfile.py)")
+    parser.add_argument("--publish-threshold", type=float, default=0.0,
+                        help="Default=%(default)f. Only publish a new signature if some token's probability "
+                        "changed by more than this (tokens that enter or leave the model count as changing from 0)")
+    parser.add_argument("--token-cache-size", type=int, default=10000,
+                        help="Default=%(default)d. Number of request strings whose tokens are cached (0 = no cache)")
+    parser.add_argument("--sample-policy", choices=samplestore.POLICIES, default="ring",
+                        help="Default=%(default)s. How the MAX_SAMPLE_SIZE samples of each category are chosen: "
+                        "the newest (ring), the newest weighted by age (decay), or a random sample of a longer "
+                        "history (reservoir); see samplestore.py")
+    parser.add_argument("--decay-half-life", type=float, default=60.0,
+                        help="Default=%(default)f. Seconds for a sample's weight to halve (--sample-policy decay)")
+    parser.add_argument("--reservoir-horizon", type=int, default=None,
+                        help="Default=10 * MAX_SAMPLE_SIZE. Number of recent samples the reservoir samples "
+                        "from (--sample-policy reservoir)")
+    parser.add_argument("--feature-buckets", type=int, default=0,
+                        help="Default=%(default)d. If not 0, hash tokens into this many feature buckets, which "
+                        "bounds the model's memory and update time. Requires --sig-format binary, whose "
+                        "consumers must hash tokens the same way (see bayes.py)")
+    parser.add_argument("--tokenizer", type=str, default=tokenizer.DEFAULT_PIPELINE,
+                        help="Default=%%(default)s. Tokenizer pipeline: one of %s, or a comma-separated list of "
+                        "stages (words, path, params, pairs, ngramsN, urldecode); see tokenizer.py. The doorman "
+                        "only tokenizes words, so other pipelines require --sig-format binary" %
+                        ", ".join(sorted(tokenizer.PIPELINES)))
+    parser.add_argument("--shadow-windows", type=str, default=",".join(map(str, shadow.DEFAULT_WINDOWS)),
+                        help="Default=%(default)s. Comma-separated windows (in seconds) over which every new sample "
+                        "is classified with the live signature before it is learned; \"\" turns this off. See "
+                        "shadow.py")
+    parser.add_argument("--shards", type=str, default=None,
+                        help="Default=no shards. JSON file with a list of shards, each of which learns its own "
+                        "signature in its own process; see shards.py")
 
 
     log.add_arguments(parser)
@@ -227,6 +500,15 @@ if __name__ == "__main__":
         s = SigServer(logger=logger, **config.sigservice)
     else:
         logger.info("Command line arguments: %s" % str(args))
+        shard_list = None
+        if args.shards != None:
+            with open(args.shards) as f:
+                shard_list = json.load(f)
+        sample_store = {"policy" : args.sample_policy}
+        if args.sample_policy == "decay":
+            sample_store["half_life"] = args.decay_half_life
+        elif args.sample_policy == "reservoir":
+            sample_store["horizon"] = args.reservoir_horizon
         s = SigServer(
             args.sig_file,
             args.addr,
@@ -238,8 +520,22 @@ if __name__ == "__main__":
             {
                 "model_size" : args.bayes_model_size,
                 "rare_threshold" : args.bayes_rare_threshold,
+                "engine" : args.bayes_engine,
+            },
+            logger,
+            {
+                "mode" : args.rpc_mode,
+                "concurrency" : args.rpc_concurrency,
             },
-            logger)
+            args.validate_processes,
+            args.sig_format,
+            args.publish_threshold,
+            args.token_cache_size,
+            sample_store,
+            shard_list,
+            args.feature_buckets,
+            args.tokenizer,
+            shadow.parse_windows(args.shadow_windows))
 
     s.run()
 
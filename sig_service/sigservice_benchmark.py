@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== sigservice_benchmark.py ====
+#
+# Measures how many notices per second a sigservice absorbs, and how stale its
+# signature gets under load. For each rate in RATES it:
+#   (1) starts a fresh sigservice.py on localhost, writing to a temporary
+#       sig file
+#   (2) for DURATION seconds, CLIENTS threads send evicted() and completed()
+#       notices over Thrift at RATE notices per second in total. The notices
+#       replay --requests; requests matching --positive-regex are evicted, the
+#       rest completed
+#   (3) halfway through, a new attack pattern starts: ATTACK_FRACTION of the
+#       notices become evictions of URLs containing the token ATTACK_TOKEN
+#   (4) polls the sigservice's stats() RPC and the signature file every
+#       INTERVAL seconds, until ATTACK_TOKEN appears in the signature or
+#       --drain seconds after the load stops
+#   (5) stops the sigservice
+# and prints a JSON report with, for each rate:
+#   sent_rate          -- notices per second actually sent
+#   accepted_rate      -- notices per second the learners took from their
+#                         queues (over the update cycles that ended during the
+#                         load)
+#   queue_depth        -- max and final number of notices waiting in the
+#                         queues (summed over shards)
+#   validate/build/write_seconds -- durations of the update cycles' phases
+#                         (see ShardStats in SignatureService.thrift)
+#   freshness_seconds  -- from the first attack eviction until ATTACK_TOKEN
+#                         appears in the published signature (null if it never
+#                         did)
+#
+# Cycles are observed by polling, so cycles shorter than INTERVAL may be missed.
+#
+# Requires the compiled thrift files (see compile.sh).
+#
+# USAGE: ./sigservice_benchmark.py [--rates 100,1000,5000] [--duration 20] [--rpc-mode threadpool]
+#
+
+import sys
+import os
+import re
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.join(DIRNAME, 'gen-py'))
+sys.path.append(os.path.join(DIRNAME, '..', 'common'))
+sys.path.append(os.path.join(DIRNAME, '..', 'bouncer'))
+
+import import_thrift_lib
+import procinfo
+import rpc
+
+import sigfile
+
+from SignatureService import SignatureService
+
+from thrift import Thrift
+
+from bouncer_common import SIGSERVICE_RPC_MODES
+
+SIGSERVICE = os.path.join(DIRNAME, "sigservice.py")
+
+ATTACK_TOKEN = "sigbenchattack"
+ATTACK_URL = "index.php?title=Special:Search&search=%d&" + ATTACK_TOKEN + "=1"
+
+def summarize(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return {}
+    return {
+        "num" : len(values),
+        "median" : values[len(values) / 2],
+        "max" : values[-1],
+    }
+
+class SigServiceUnderTest:
+    '''A sigservice.py process with a temporary sig file'''
+
+    def __init__(self, args, tempdir, name):
+        self.addr = "127.0.0.1"
+        self.port = args.port
+        self.mode = args.rpc_mode
+        self.sig_file = os.path.join(tempdir, "%s_signature.txt" % name)
+        self.cmd = [sys.executable, SIGSERVICE,
+            "--sig-file", self.sig_file,
+            "--addr", self.addr,
+            "--port", str(self.port),
+            "--rpc-mode", args.rpc_mode,
+            "--rpc-concurrency", str(args.rpc_concurrency),
+            "--max-sample-size", str(args.max_sample_size),
+            "--update-requests", str(args.update_requests),
+            "--min-delay", str(args.min_delay),
+            "--max-delay", str(args.max_delay),
+            "--stderr", "ERROR",
+            "--logfile", "off"]
+        self.log = open(os.path.join(tempdir, "%s_sigservice.log" % name), "w")
+        self.process = None
+
+    def connect(self):
+        client, transport = rpc.make_client(SignatureService.Client, self.addr, self.port, self.mode)
+        transport.open()
+        return client, transport
+
+    def stats(self):
+        client, transport = self.connect()
+        try:
+            return client.stats()
+        finally:
+            transport.close()
+
+    def start(self, timeout):
+        '''Starts the sigservice, and returns True once it answers stats() (or
+        False if it did not within timeout seconds)'''
+        self.process = subprocess.Popen(self.cmd, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                self.stats()
+                return True
+            except Thrift.TException:
+                time.sleep(0.1)
+        return False
+
+    def log_tail(self, lines=20):
+        '''Returns the last lines of the sigservice's output'''
+        self.log.flush()
+        with open(self.log.name) as f:
+            return f.readlines()[-lines:]
+
+    def stop(self):
+        '''Kills the sigservice and all of its processes (server workers, shards)'''
+        if self.process == None:
+            return
+        pids = procinfo.descendants(self.process.pid)
+        self.process.kill()
+        self.process.wait()
+        for pid in pids:
+            try:
+                os.kill(pid, 9)
+            except OSError:
+                pass
+        self.log.close()
+
+class Load:
+    '''The notices to send, shared by the Sender threads'''
+
+    def __init__(self, notices, attack_time, attack_fraction):
+        '''notices is a list of (method name, request_str)'''
+        self.notices = notices
+        self.attack_time = attack_time
+        self.attack_every = max(1, int(round(1.0 / attack_fraction))) if attack_fraction > 0.0 else None
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.errors = 0
+        self.first_attack = None
+
+    def next(self, now):
+        '''Returns the (method name, request_str) of the next notice'''
+        with self.lock:
+            i = self.sent
+            self.sent += 1
+            if self.attack_every != None and now >= self.attack_time and i % self.attack_every == 0:
+                if self.first_attack == None:
+                    self.first_attack = now
+                return "evicted", ATTACK_URL % i
+        return self.notices[i % len(self.notices)]
+
+class Sender(threading.Thread):
+    '''Sends notices at rate per second from start_time until end_time'''
+
+    def __init__(self, sigservice, load, rate, start_time, end_time):
+        self.sigservice = sigservice
+        self.load = load
+        self.rate = rate
+        self.start_time = start_time
+        self.end_time = end_time
+        super(Sender, self).__init__()
+
+    def run(self):
+        client, transport = None, None
+        i = 0
+        while True:
+            scheduled = self.start_time + i / self.rate
+            if scheduled >= self.end_time:
+                break
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            i += 1
+            method, request_str = self.load.next(time.time())
+            try:
+                if client == None:
+                    client, transport = self.sigservice.connect()
+                getattr(client, method)(request_str)
+            except Thrift.TException:
+                with self.load.lock:
+                    self.load.errors += 1
+                if transport != None:
+                    transport.close()
+                client, transport = None, None
+        if transport != None:
+            transport.close()
+
+class Monitor:
+    '''Polls the sigservice's stats and signature file'''
+
+    def __init__(self, sigservice):
+        self.sigservice = sigservice
+        self.samples = []
+        self.cycles = {}
+        self.queue_depths = []
+        self.model_version = None
+        self.attack_published = None
+
+    def poll(self, load):
+        now = time.time()
+        try:
+            stats = self.sigservice.stats()
+        except Thrift.TException:
+            return
+        self.queue_depths.append(sum(shard.queue_depth for shard in stats.shards))
+        for shard in stats.shards:
+            if shard.cycles > 0:
+                self.cycles[(shard.name, shard.cycles)] = shard
+
+        model_version = sigfile.read_model_version(self.sigservice.sig_file)
+        if load.first_attack != None and self.attack_published == None and model_version != self.model_version:
+            self.model_version = model_version
+            try:
+                if ATTACK_TOKEN in sigfile.load_text(self.sigservice.sig_file):
+                    self.attack_published = now
+            except (IOError, ValueError):
+                pass
+
+def run_rate(sigservice, notices, rate, args):
+    start_time = time.time() + 0.5
+    end_time = start_time + args.duration
+    load = Load(notices, start_time + args.duration / 2.0, args.attack_fraction)
+    senders = [Sender(sigservice, load, float(rate) / args.clients, start_time + float(i) / rate, end_time)
+        for i in range(args.clients)]
+    for sender in senders:
+        sender.start()
+
+    monitor = Monitor(sigservice)
+    final_depth = None
+    deadline = end_time + args.drain
+    while True:
+        monitor.poll(load)
+        now = time.time()
+        if now >= end_time:
+            if final_depth == None and len(monitor.queue_depths) > 0:
+                final_depth = monitor.queue_depths[-1]
+            if monitor.attack_published != None or now >= deadline:
+                break
+        time.sleep(args.interval)
+    for sender in senders:
+        sender.join()
+
+    # the update cycles that ended while the load was running
+    cycles = [shard for shard in monitor.cycles.itervalues()
+        if start_time < shard.last_update <= end_time]
+    last_update = max([shard.last_update for shard in cycles] or [None])
+    accepted = sum(max([shard.samples for shard in cycles if shard.name == name] or [0])
+        for name in set(shard.name for shard in cycles))
+
+    return {
+        "rate" : rate,
+        "sent" : load.sent,
+        "errors" : load.errors,
+        "sent_rate" : load.sent / args.duration,
+        "accepted_rate" : accepted / (last_update - start_time) if last_update != None else None,
+        "queue_depth" : {
+            "max" : max(monitor.queue_depths or [None]),
+            "final" : final_depth,
+        },
+        "cycles" : len(cycles),
+        "validate_seconds" : summarize([shard.validate_seconds for shard in cycles]),
+        "build_seconds" : summarize([shard.build_seconds for shard in cycles]),
+        "write_seconds" : summarize([shard.write_seconds for shard in cycles]),
+        "freshness_seconds" : monitor.attack_published - load.first_attack
+            if monitor.attack_published != None else None,
+    }
+
+def load_notices(filename, positive_regex):
+    positive_regex = re.compile(positive_regex)
+    notices = []
+    with open(filename) as f:
+        for line in f:
+            request = line.strip()
+            if request == "":
+                continue
+            notices.append(("evicted" if positive_regex.search(request) else "completed", request))
+    return notices
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks sigservice ingest throughput and signature freshness')
+    parser.add_argument("-r", "--rates", type=str, default="100,1000,5000",
+                        help="Default=%(default)s. Comma-separated notices per second to offer")
+    parser.add_argument("-d", "--duration", type=float, default=20.0,
+                        help="Default=%(default)f. Seconds to send notices at each rate")
+    parser.add_argument("--clients", type=int, default=4,
+                        help="Default=%(default)d. Number of sending threads")
+    parser.add_argument("--requests", type=str, default=os.path.join(DIRNAME, "wikipedia_requests.txt"),
+                        help="Default=%(default)s. File with one request URL per line")
+    parser.add_argument("--positive-regex", type=str, default="action=raw",
+                        help="Default=%(default)s. Requests matching this regex are sent as evicted")
+    parser.add_argument("--attack-fraction", type=float, default=0.1,
+                        help="Default=%(default)f. Fraction of the notices that are attack evictions, from "
+                        "halfway through DURATION")
+    parser.add_argument("-i", "--interval", type=float, default=0.1,
+                        help="Default=%(default)f. Seconds between polls of stats() and the signature file")
+    parser.add_argument("--drain", type=float, default=30.0,
+                        help="Default=%(default)f. Seconds to keep waiting for the attack to be published "
+                        "after the load stops")
+    parser.add_argument("-p", "--port", type=int, default=4011,
+                        help="Default=%(default)d. Port for the sigservice under test")
+    parser.add_argument("--rpc-mode", choices=SIGSERVICE_RPC_MODES, default="threadpool",
+                        help="Default=%(default)s. See ../common/rpc.py")
+    parser.add_argument("--rpc-concurrency", type=int, default=8,
+                        help="Default=%(default)d. See ../common/rpc.py")
+    parser.add_argument("-m", "--max-sample-size", type=int, default=1000,
+                        help="Default=%(default)d. See sigservice.py")
+    parser.add_argument("-u", "--update-requests", type=int, default=100,
+                        help="Default=%(default)d. See sigservice.py")
+    parser.add_argument("-n", "--min-delay", type=float, default=1.0,
+                        help="Default=%(default)f. See sigservice.py")
+    parser.add_argument("-x", "--max-delay", type=float, default=5.0,
+                        help="Default=%(default)f. See sigservice.py")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Default=%(default)f. Seconds to wait for the sigservice to start")
+    args = parser.parse_args()
+
+    notices = load_notices(args.requests, args.positive_regex)
+    tempdir = tempfile.mkdtemp()
+    results = {
+        "rpc_mode" : args.rpc_mode,
+        "duration" : args.duration,
+        "max_sample_size" : args.max_sample_size,
+        "update_requests" : args.update_requests,
+        "rates" : [],
+    }
+    try:
+        for rate in [int(rate) for rate in args.rates.split(",")]:
+            sigservice = SigServiceUnderTest(args, tempdir, "rate%d" % rate)
+            try:
+                if not sigservice.start(args.timeout):
+                    results["rates"].append({"rate" : rate, "error" : "sigservice did not start",
+                        "log" : sigservice.log_tail()})
+                    continue
+                results["rates"].append(run_rate(sigservice, notices, rate, args))
+            finally:
+                sigservice.stop()
+    finally:
+        shutil.rmtree(tempdir)
+    print json.dumps(results, indent=4, sort_keys=True)
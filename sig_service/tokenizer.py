@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== tokenizer.py ====
+#
+# Tokenizer pipelines for request strings. A pipeline is a preset name (see
+# PIPELINES) or a comma-separated list of stages:
+#
+#   words       the alphanumeric words of the request, like bayes.splitTokensUrl
+#   path        "/segment" for every path segment
+#   params      "?name" for every query parameter name
+#   pairs       "&name=value" for every query parameter
+#   ngramsN     "word1+word2+..." for every N consecutive words (N >= 2)
+#   urldecode   URL-decode (%XX and +) the words, segments, names and values
+#
+# The path, params and pairs stages parse the last whitespace-separated field
+# of the request string as a URL (path?query): in the doorman's signature key
+# (see $sig_key in the apps' nginx.conf files, and shards.py) it is the
+# request URI, and the other fields (user agent, method, ...) are not URLs.
+# Requests are lowercased, and tokens never contain whitespace
+# or commas (which would break the text signature format) or start with
+# bayes.FEATURE_PREFIX.
+#
+# compile_pipeline parses a pipeline once and returns a tokenize function. The
+# "words" pipeline is bayes.splitTokensUrl itself, which is also how the
+# doorman tokenizes requests. The doorman reads the text signature format and
+# can never match the other stages' tokens, so other pipelines require the
+# binary format (see check_format), whose consumers must tokenize with the
+# same pipeline.
+#
+# USAGE: see sigservice.py --tokenizer, and tokenizer_benchmark.py
+#
+
+import re
+import urllib
+import itertools
+
+import bayes
+
+PIPELINES = {
+    "words" : "words",
+    "decoded" : "urldecode,words",
+    "structured" : "urldecode,words,path,params,pairs",
+    "ngrams" : "words,ngrams2",
+}
+
+# besides ngramsN and urldecode
+STAGES = ["words", "path", "params", "pairs"]
+
+DEFAULT_PIPELINE = "words"
+
+WORD = re.compile("[a-z0-9%]+")
+SEGMENT = re.compile("[^/]+")
+PARAM = re.compile("([^&;=]+)(?:=([^&;]*))?")
+# characters that tokens cannot contain
+UNSAFE_CHARS = "".join(chr(c) for c in range(0x21)) + "\x7f,"
+NGRAMS = re.compile("ngrams([0-9]+)$")
+
+def identity(string):
+    return string
+
+def decode(string):
+    '''URL-decodes string (which is lowercase), and lowercases the result'''
+    if "%" not in string and "+" not in string:
+        return string
+    return urllib.unquote_plus(string).lower()
+
+def parse_pipeline(pipeline):
+    '''Returns (stages, ngrams, urldecode) for a pipeline, where ngrams is the
+    list of n-gram sizes. Raises ValueError if the pipeline is invalid'''
+    stages = set()
+    ngrams = []
+    urldecode = False
+    for stage in PIPELINES.get(pipeline, pipeline).split(","):
+        stage = stage.strip()
+        match = NGRAMS.match(stage)
+        if match:
+            n = int(match.group(1))
+            if n < 2:
+                raise ValueError("n-grams need at least 2 words: %s" % stage)
+            if n not in ngrams:
+                ngrams.append(n)
+        elif stage == "urldecode":
+            urldecode = True
+        elif stage in STAGES:
+            stages.add(stage)
+        else:
+            raise ValueError("Unknown tokenizer stage '%s' (stages: %s, ngramsN, urldecode; pipelines: %s)" %
+                (stage, ", ".join(STAGES), ", ".join(sorted(PIPELINES))))
+    if len(stages) == 0 and len(ngrams) == 0:
+        raise ValueError("Tokenizer pipeline '%s' produces no tokens" % pipeline)
+    return stages, ngrams, urldecode
+
+class Tokenizer:
+    '''A compiled pipeline. Calling it returns the set of tokens for a request
+    string'''
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        stages, ngrams, urldecode = parse_pipeline(pipeline)
+        # applied to every part of the (lowercased) request before it is split into tokens
+        self.decode = decode if urldecode else identity
+        self.stages = []
+        if "words" in stages:
+            self.stages.append(self.words)
+        if stages & set(["path", "params", "pairs"]):
+            self.path = "path" in stages
+            self.params = "params" in stages
+            self.pairs = "pairs" in stages
+            self.stages.append(self.request_uri)
+        for n in ngrams:
+            self.stages.append(self.ngrams_stage(n))
+
+    def __call__(self, string):
+        string = string.lower()
+        tokens = set()
+        for stage in self.stages:
+            stage(string, tokens)
+        return tokens
+
+    def words(self, string, tokens):
+        tokens.update(bayes.invalid_url_char.sub(' ', self.decode(string)).split())
+
+    def component(self, string):
+        '''Returns string (a path segment, parameter name or value), decoded and
+        without characters that tokens cannot contain'''
+        return self.decode(string).translate(None, UNSAFE_CHARS)
+
+    def request_uri(self, string, tokens):
+        '''The path, params and pairs stages, for the last field of string'''
+        fields = string.rsplit(None, 1)
+        if len(fields) == 0:
+            return
+        component = self.component
+        path, separator, query = fields[-1].partition("?")
+        if self.path:
+            tokens.update("/" + component(segment.group()) for segment in SEGMENT.finditer(path))
+        if separator == "" or not (self.params or self.pairs):
+            return
+        for param in PARAM.finditer(query):
+            name = component(param.group(1))
+            if self.params:
+                tokens.add("?" + name)
+            if self.pairs and param.group(2) != None:
+                tokens.add("&%s=%s" % (name, component(param.group(2))))
+
+    def ngrams_stage(self, n):
+        def ngrams(string, tokens):
+            words = itertools.tee((word.group() for word in WORD.finditer(self.decode(string))), n)
+            for i, iterator in enumerate(words):
+                for j in xrange(i):
+                    next(iterator, None)
+            tokens.update(itertools.imap("+".join, itertools.izip(*words)))
+        return ngrams
+
+def check_format(pipeline, sig_format):
+    '''Raises ValueError unless signatures in sig_format (see sigfile.FORMATS) can
+    hold the tokens of pipeline: only the "words" pipeline produces the tokens
+    that the doorman, which reads the text format, looks up'''
+    stages, ngrams, urldecode = parse_pipeline(pipeline)
+    if sig_format != "binary" and (stages != set(["words"]) or len(ngrams) > 0 or urldecode):
+        raise ValueError("Tokenizer pipeline '%s' requires the binary signature format (the doorman "
+            "only tokenizes words), not %s" % (pipeline, sig_format))
+
+def compile_pipeline(pipeline=DEFAULT_PIPELINE):
+    '''Returns a tokenize function (string -> set of tokens) for pipeline. Raises
+    ValueError if the pipeline is invalid'''
+    if PIPELINES.get(pipeline, pipeline) == "words":
+        return bayes.splitTokensUrl
+    return Tokenizer(pipeline)
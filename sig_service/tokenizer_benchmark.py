@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== tokenizer_benchmark.py ====
+#
+# Compares tokenizer pipelines (see tokenizer.py) on a request trace, where
+# requests matching --positive-regex are positive. For each pipeline, reports
+# as JSON:
+#   - throughput: requests tokenized per second (median of --repeat passes)
+#   - the mean number of tokens per request, and the number of distinct tokens
+#   - the accuracy, false positives and false negatives of a --folds-fold
+#     validation (see bayes.Validate)
+#
+# USAGE: ./tokenizer_benchmark.py [--requests wikipedia_requests.txt] [--pipelines words structured ...]
+#
+
+import os
+import re
+import argparse
+import json
+import logging
+import random
+import time
+
+import bayes
+import tokenizer
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+def median_time(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return sorted(times)[len(times) / 2]
+
+def benchmark(requests, positive_regex, pipeline, bayes_classifier, repeat, folds):
+    positive_regex = re.compile(positive_regex)
+    tokenize_func = tokenizer.compile_pipeline(pipeline)
+
+    def tokenize_all():
+        for request in requests:
+            tokenize_func(request)
+
+    seconds = median_time(tokenize_all, repeat)
+    samples = [tokenize_func(request) for request in requests]
+    positive = [sample for request, sample in zip(requests, samples) if positive_regex.search(request)]
+    negative = [sample for request, sample in zip(requests, samples) if not positive_regex.search(request)]
+    distinct = set()
+    for sample in samples:
+        distinct.update(sample)
+
+    random.seed(0)
+    validate = bayes.Validate(positive, negative, logging.getLogger("tokenizer_benchmark"), **bayes_classifier)
+    tp, fp, tn, fn = validate.validate(folds)
+    return {
+        "requests_per_second" : len(requests) / seconds if seconds > 0 else None,
+        "tokens_per_request" : float(sum(len(sample) for sample in samples)) / len(samples),
+        "distinct_tokens" : len(distinct),
+        "accuracy" : float(tp + tn) / (tp + fp + tn + fn),
+        "fp" : fp,
+        "fn" : fn,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares tokenizer pipelines')
+    parser.add_argument("-r", "--requests", type=str, default=os.path.join(DIRNAME, "wikipedia_requests.txt"),
+                        help="Default=%(default)s. File with one request URL per line")
+    parser.add_argument("-p", "--positive-regex", type=str, default="action=raw",
+                        help="Default=%(default)s. Requests matching this regex are positive")
+    parser.add_argument("-t", "--pipelines", type=str, nargs="+", default=sorted(tokenizer.PIPELINES),
+                        help="Default=%(default)s. Pipelines to compare (see tokenizer.py)")
+    parser.add_argument("-n", "--repeat", type=int, default=5,
+                        help="Default=%(default)d. Number of times to time each pipeline")
+    parser.add_argument("-f", "--folds", type=int, default=10,
+                        help="Default=%(default)d. Number of folds to validate")
+    parser.add_argument("-bm", "--bayes-model-size", type=int, default=5000,
+                        help="Default=%(default)d. Size of Bayes model; see bayes.py")
+    parser.add_argument("-br", "--bayes-rare-threshold", type=float, default=0.01,
+                        help="Default=%(default)f. Rarity threshold for Bayes model; see bayes.py")
+    args = parser.parse_args()
+
+    with open(args.requests) as f:
+        requests = [line.strip() for line in f if line.strip() != ""]
+
+    bayes_classifier = {
+        "model_size" : args.bayes_model_size,
+        "rare_threshold" : args.bayes_rare_threshold,
+    }
+    results = {
+        "requests" : len(requests),
+        "folds" : args.folds,
+    }
+    for pipeline in args.pipelines:
+        results[pipeline] = benchmark(requests, args.positive_regex, pipeline, bayes_classifier, args.repeat,
+            args.folds)
+    print json.dumps(results, indent=4, sort_keys=True)
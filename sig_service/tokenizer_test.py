@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 HellaSec, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# ==== tokenizer_test.py ====
+#
+#
+import unittest
+import bayes
+from tokenizer import *
+
+REQUEST = "hostWiki.example.com /w/index.php?title=Foo%2C+Bar&action=raw;x"
+
+# a $sig_key (see the apps' nginx.conf files)
+SIG_KEY = ("512 agentMozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/15.0 schemehttp contentlength "
+    "contenttype requestmethodGET remoteuser /index.php?title=Main_Page")
+
+class Test_tokenizer(unittest.TestCase):
+
+    def test_words(self):
+        self.assertTrue(compile_pipeline("words") is bayes.splitTokensUrl)
+        self.assertEqual(Tokenizer("words,words")(REQUEST), bayes.splitTokensUrl(REQUEST))
+
+    def test_structured(self):
+        tokens = compile_pipeline("path,params,pairs")(REQUEST)
+        self.assertEqual(tokens, set(["/w", "/index.php", "?title", "?action", "?x",
+            "&title=foo%2c+bar", "&action=raw"]))
+        tokens = compile_pipeline("urldecode,pairs")(REQUEST)
+        self.assertEqual(tokens, set(["&title=foobar", "&action=raw"]))
+        self.assertTrue("foo" in compile_pipeline("decoded")(REQUEST))
+
+    def test_sig_key(self):
+        # only the request URI (the last field) is parsed as a URL
+        tokens = compile_pipeline("path,params,pairs")(SIG_KEY)
+        self.assertEqual(tokens, set(["/index.php", "?title", "&title=main_page"]))
+        self.assertEqual(compile_pipeline("path")(""), set())
+
+    def test_ngrams(self):
+        tokens = compile_pipeline("ngrams3")("a b c/d")
+        self.assertEqual(tokens, set(["a+b+c", "b+c+d"]))
+        self.assertEqual(compile_pipeline("ngrams3")("a b"), set())
+        self.assertEqual(bayes.splitTokensNgrams("a b c", ngrams=2), set(["a+b", "b+c"]))
+
+    def test_check_format(self):
+        for sig_format in ["text", "both", "binary"]:
+            check_format("words", sig_format)
+            check_format("words,words", sig_format)
+        for pipeline in ["decoded", "structured", "ngrams", "path"]:
+            check_format(pipeline, "binary")
+            self.assertRaises(ValueError, check_format, pipeline, "text")
+            self.assertRaises(ValueError, check_format, pipeline, "both")
+
+    def test_bad_pipelines(self):
+        for pipeline in ["", "nope", "ngrams1", "ngramsN", "urldecode"]:
+            self.assertRaises(ValueError, compile_pipeline, pipeline)
+
+if __name__ == '__main__':
+    unittest.main()
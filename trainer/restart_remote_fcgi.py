@@ -68,15 +68,23 @@ siteconfig = os.path.join(DIRNAME, "..", "siteconfig.sh")
 var = env.env(siteconfig)
 SERVER_NAME = var["SERVER_NAME"]
 
-MAX_RETRIES = 30
+MAX_RETRIES = 300
+
+# restart_remote_fcgi.sh returns before restart_fcgi.sh has done anything, so
+# wait RESTART_DELAY seconds (for the old workers to be killed) before polling
+RESTART_DELAY = 1.0
+
+# seconds between requests while waiting for the restart to take effect
+RETRY_INTERVAL = 0.1
 
 class RestartWorkerError(Exception):
     pass
 
-def restart_remote_fcgi(server, username, sshport, request_url, logger, max_retries=MAX_RETRIES):
+def restart_remote_fcgi(server, username, sshport, request_url, logger, max_retries=MAX_RETRIES,
+    retry_interval=RETRY_INTERVAL):
     # ssh username@server -p sshport, then executes restart_fcgi.sh on server
     # after executing restart_fcgi.sh on server, keeps requesting request_url
-    # until the request succeeds (up to max_retries)
+    # every retry_interval seconds until the request succeeds (up to max_retries)
     logger.debug("Restarting FCGI workers on %s", server)
     logger.debug("max_retries = %d", max_retries)
     cmd = [RESTART_SCRIPT,
@@ -97,9 +105,10 @@ def restart_remote_fcgi(server, username, sshport, request_url, logger, max_retr
 
     # Keep trying to access url until it succeeds (meeing restart_remote_fcgi.sh
     # has taken effect)
+    time.sleep(RESTART_DELAY)
     success = False
     for i in range(0, max_retries - 1):
-        time.sleep(1)
+        time.sleep(retry_interval)
         logger.debug("Requesting %s, try number = %d", request_url, i + 1)
         try:
             response = urllib2.urlopen(request_url)
@@ -110,7 +119,7 @@ def restart_remote_fcgi(server, username, sshport, request_url, logger, max_retr
             pass
 
     if not success:
-        time.sleep(1)
+        time.sleep(retry_interval)
         logger.debug("Requesting %s, last try", request_url)
         try:
             response = urllib2.urlopen(request_url)
@@ -139,6 +148,8 @@ if __name__ == "__main__":
     parser.add_argument("-m", "--max-retries", type=int, default=MAX_RETRIES,
                     help="Default=%(default)d. After attempting to restart the FCGI workers, how many times to " \
                         "try requesting URL before giving up.")
+    parser.add_argument("-i", "--retry-interval", type=float, default=RETRY_INTERVAL,
+                    help="Default=%(default)s. Seconds between requests to URL.")
 
     log.add_arguments(parser)
     args = parser.parse_args()
@@ -151,5 +162,6 @@ if __name__ == "__main__":
         args.sshport, \
         args.url, \
         logger, \
-        args.max_retries)
+        args.max_retries, \
+        args.retry_interval)
 